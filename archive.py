@@ -0,0 +1,33 @@
+import asyncio
+import time
+from config import (ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE, ARCHIVE_BATCH_PAUSE_MS, ARCHIVE_INTERVAL_SECONDS,
+                    DELIVERY_KEEP_DAYS)
+from repository import PurchaseRepository
+
+
+async def archive_once(repo: PurchaseRepository) -> int:
+    """Перенос всех решённых покупок старше ARCHIVE_AFTER_DAYS, пачками"""
+    created_before = int(time.time()) - ARCHIVE_AFTER_DAYS * 24 * 3600
+    total = 0
+    while True:
+        moved = await repo.archive_resolved(created_before, ARCHIVE_BATCH_SIZE)
+        total += moved
+        if moved < ARCHIVE_BATCH_SIZE:
+            return total
+        # Пауза между пачками, чтобы не занимать писателя надолго
+        await asyncio.sleep(ARCHIVE_BATCH_PAUSE_MS / 1000)
+
+
+async def archive_loop(repo: PurchaseRepository):
+    """Фоновая задача переноса решённых покупок в purchases_archive"""
+    while True:
+        try:
+            moved = await archive_once(repo)
+            if moved:
+                print(f"✅ В архив перенесено: {moved} покупок")
+            # Журнал доставок напоминаний нужен только на время возможных повторов
+            await repo.prune_deliveries(int(time.time()) - DELIVERY_KEEP_DAYS * 24 * 3600)
+        except Exception as e:
+            print(f"❌ Ошибка архивации: {e}")
+
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
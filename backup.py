@@ -0,0 +1,188 @@
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+import aiosqlite
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from config import (BACKUP_DIR, BACKUP_PAGES_PER_STEP, BACKUP_STEP_SLEEP_MS, BACKUP_INTERVAL_HOURS, BACKUP_KEEP,
+                    PHOTOS_DIR)
+from sharding import ShardSet
+from media import MediaStore, TMP_DIR, CACHE_DIR, cache_name
+
+# Структура BACKUP_DIR:
+#   <YYYYmmdd-HHMMSS>/<файл шарда>.db  — снимки баз
+#   <YYYYmmdd-HHMMSS>/manifest.json    — состав снимка (базы и фото на момент снимка)
+#   photos/                            — общая копия фото, каждый файл копируется один раз
+#   photos-manifest.json               — что уже лежит в BACKUP_DIR/photos (путь -> [размер, mtime_ns])
+# Пути фото — относительно PHOTOS_DIR (ab/cd/<sha256>.jpg, см. media.py); недокачанные tmp/ и кэш
+# ленивых фото cache/ не копируются. Ленивые фото (MEDIA_LAZY, есть только file_id) скачиваются
+# через MediaCache и лежат в photos/lazy/<cache_name(file_id)>.
+# Фото, которых нет ни в PHOTOS_DIR, ни в одном из оставшихся BACKUP_KEEP снимков, из photos/ удаляются.
+
+PHOTOS_ROOT = Path(PHOTOS_DIR)
+LAZY_DIR = 'lazy'
+
+
+async def snapshot_db(path: str, target_path: Path) -> int:
+    """Копия базы через online backup API, размер копии в байтах.
+
+    Источник — отдельное соединение с открытой транзакцией чтения: копируется один согласованный
+    снимок, и записи в WAL не заставляют backup начинаться заново. Писатели не ждут (WAL),
+    копирование идёт шагами по BACKUP_PAGES_PER_STEP страниц с паузой между ними.
+    """
+    partial = target_path.with_suffix('.partial')
+    source = await aiosqlite.connect(path, isolation_level=None)
+    target = sqlite3.connect(partial, check_same_thread=False)
+    try:
+        await source.execute('BEGIN')
+        await source.execute('SELECT COUNT(*) FROM sqlite_master')
+        # sleep в backup() срабатывает только при SQLITE_BUSY, паузу между шагами делает progress
+        # (он вызывается в потоке соединения aiosqlite, event loop не блокируется)
+        await source.backup(target, pages=BACKUP_PAGES_PER_STEP,
+                            progress=lambda status, remaining, total: time.sleep(BACKUP_STEP_SLEEP_MS / 1000))
+        await source.execute('ROLLBACK')
+    finally:
+        target.close()
+        await source.close()
+    os.replace(partial, target_path)
+    return target_path.stat().st_size
+
+
+def _scan_photos() -> dict:
+    photos = {}
+    for folder, dirs, files in os.walk(PHOTOS_ROOT):
+        if Path(folder) == PHOTOS_ROOT:
+            dirs[:] = [name for name in dirs if name not in (TMP_DIR, CACHE_DIR)]
+        for name in files:
+            path = Path(folder) / name
+            stat = path.stat()
+            photos[path.relative_to(PHOTOS_ROOT).as_posix()] = [stat.st_size, stat.st_mtime_ns]
+    return photos
+
+
+def _copy_photos(names: list[str], target_dir: Path):
+    for name in names:
+        (target_dir / name).parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(PHOTOS_ROOT / name, target_dir / name)
+
+
+def _copy_file(source: str, target: Path) -> int:
+    target.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copyfile(source, target)
+    return target.stat().st_size
+
+
+async def _backup_lazy(media: MediaStore, bot: Bot, target_dir: Path, copied: dict) -> tuple[dict, list]:
+    """Ленивые фото: (состав для манифеста, скопированные сейчас). Файл file_id не меняется — копируется один раз"""
+    photos, fetched = {}, []
+    for file_id in sorted(await media.repo.lazy_photos()):
+        name = f'{LAZY_DIR}/{cache_name(file_id)}'
+        if name in copied:
+            photos[name] = copied[name]
+            continue
+        try:
+            path = await media.cache.fetch(bot, file_id)
+        except TelegramAPIError as e:
+            print(f"❌ Не удалось загрузить фото {file_id} для снимка: {e}")
+            continue
+        photos[name] = [await asyncio.to_thread(_copy_file, path, target_dir / name), 0]
+        fetched.append(name)
+    return photos, fetched
+
+
+def _read_json(path: Path, default):
+    return json.loads(path.read_text()) if path.exists() else default
+
+
+def _write_json(path: Path, data, **kwargs):
+    partial = path.with_suffix('.partial')
+    partial.write_text(json.dumps(data, **kwargs))
+    os.replace(partial, path)
+
+
+def _prune_photos(backup_dir: Path, copied: dict) -> int:
+    """Удаление из photos/ и copied фото, на которые не ссылается ни один оставшийся снимок"""
+    wanted = set()
+    for manifest in backup_dir.glob('*/manifest.json'):
+        wanted.update(_read_json(manifest, {}).get('photos', {}))
+    photos_dir = backup_dir / 'photos'
+    removed = 0
+    for name in [name for name in copied if name not in wanted]:
+        del copied[name]
+        path = photos_dir / name
+        path.unlink(missing_ok=True)
+        removed += 1
+        # Опустевшие ab/cd
+        for folder in (path.parent, path.parent.parent):
+            if folder == photos_dir:
+                break
+            try:
+                folder.rmdir()
+            except OSError:
+                break
+    return removed
+
+
+def _prune(backup_dir: Path, keep: int):
+    snapshots = sorted(p for p in backup_dir.iterdir() if p.is_dir() and p.name != 'photos')
+    for old in snapshots[:-keep] if keep > 0 else []:
+        shutil.rmtree(old)
+
+
+async def snapshot(shards: ShardSet, backup_dir: str = BACKUP_DIR, media: MediaStore | None = None,
+                   bot: Bot | None = None) -> Path:
+    """Снимок всех шардов и инкрементальная копия фото, возвращает папку снимка.
+
+    Ленивые фото копируются, только если переданы media и bot (иначе их взять неоткуда).
+    """
+    root = Path(backup_dir)
+    target_dir = root / datetime.now().strftime('%Y%m%d-%H%M%S')
+    target_dir.mkdir(parents=True, exist_ok=True)
+    started = time.monotonic()
+
+    databases = {}
+    for db in shards:
+        name = Path(db.path).name
+        databases[name] = await snapshot_db(db.path, target_dir / name)
+
+    # Фото: копируем только новые и изменившиеся с прошлого снимка
+    manifest_path = root / 'photos-manifest.json'
+    copied = await asyncio.to_thread(_read_json, manifest_path, {})
+    photos = await asyncio.to_thread(_scan_photos)
+    new = [name for name, meta in photos.items() if copied.get(name) != meta]
+    await asyncio.to_thread(_copy_photos, new, root / 'photos')
+    if media is not None and bot is not None:
+        lazy, fetched = await _backup_lazy(media, bot, root / 'photos', copied)
+        photos.update(lazy)
+        new += fetched
+    copied.update({name: photos[name] for name in new})
+
+    await asyncio.to_thread(_write_json, target_dir / 'manifest.json', {
+        "created_at": int(time.time()),
+        "databases": databases,
+        "photos": photos,
+        "photos_copied": new,
+    }, ensure_ascii=False, indent=1)
+    await asyncio.to_thread(_prune, root, BACKUP_KEEP)
+    # Удалённые из PHOTOS_DIR фото уходят из копии, когда их не осталось ни в одном снимке
+    removed = await asyncio.to_thread(_prune_photos, root, copied)
+    await asyncio.to_thread(_write_json, manifest_path, copied)
+
+    print(f"✅ Снимок {target_dir}: баз {len(databases)} ({sum(databases.values())} байт), "
+          f"фото новых {len(new)} из {len(photos)}, удалено старых {removed}, {time.monotonic() - started:.1f} с")
+    return target_dir
+
+
+async def backup_loop(shards: ShardSet, media: MediaStore | None = None, bot: Bot | None = None):
+    """Фоновая задача: снимок раз в BACKUP_INTERVAL_HOURS"""
+    while True:
+        await asyncio.sleep(BACKUP_INTERVAL_HOURS * 3600)
+        try:
+            await snapshot(shards, media=media, bot=bot)
+        except Exception as e:
+            print(f"❌ Ошибка резервного копирования: {e}")
@@ -0,0 +1,82 @@
+import time
+from collections import OrderedDict
+from config import CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS
+
+
+class RenderCache:
+    """LRU-кэш с TTL для отрисованных карточек и страниц списков.
+
+    Ключи — (user_id, key), где key это ('card', purchase_id) или ('list', ...)/('history', ...).
+    Каждое значение помечено версией данных пользователя из базы (user_versions, растёт от триггеров
+    при любой записи — и из этого процесса, и из manage.py или другого процесса): get() отдаёт значение,
+    только если версия не изменилась. Версию берут до чтения из базы и передают в set(), поэтому
+    чтение, пересёкшееся с записью, после неё уже не совпадёт. invalidate() после своих записей
+    просто освобождает память.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # (user_id, key) -> (expires_at, version, value)
+        self._user_keys = {}  # user_id -> set(key), для сброса по пользователю
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, user_id: int, key: tuple, version: int):
+        """Значение из кэша для текущей версии данных пользователя или None"""
+        entry = self._entries.get((user_id, key))
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, cached_version, value = entry
+        if expires_at < time.monotonic() or cached_version != version:
+            self._drop(user_id, key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end((user_id, key))
+        self.hits += 1
+        return value
+
+    def set(self, user_id: int, key: tuple, value, version: int):
+        """Сохранение значения, прочитанного при версии version (вытесняет самые старые записи сверх лимита)"""
+        self._entries[(user_id, key)] = (time.monotonic() + self.ttl, version, value)
+        self._entries.move_to_end((user_id, key))
+        self._user_keys.setdefault(user_id, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            (old_user, old_key), _ = self._entries.popitem(last=False)
+            self._forget(old_user, old_key)
+            self.evictions += 1
+
+    def invalidate(self, user_id: int, purchase_id: int | None = None):
+        """Сброс после записи: карточка purchase_id и все списки пользователя"""
+        keys = self._user_keys.get(user_id)
+        if not keys:
+            return
+        for key in [k for k in keys if k[0] != 'card' or k[1] == purchase_id]:
+            self._drop(user_id, key)
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        """Счётчики для подбора размера и TTL"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    def _drop(self, user_id: int, key: tuple):
+        self._entries.pop((user_id, key), None)
+        self._forget(user_id, key)
+
+    def _forget(self, user_id: int, key: tuple):
+        keys = self._user_keys.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._user_keys[user_id]
@@ -1,4 +1,5 @@
 import os
+import socket
 from dotenv import load_dotenv
 from pathlib import Path
 
@@ -7,6 +8,122 @@ BOT_TOKEN = os.getenv('BOT_TOKEN')
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN не найден в .env файле!")
 
-Path("photos").mkdir(exist_ok=True)
+# Фото: по sha256 содержимого в PHOTOS_DIR/ab/cd/<hash>.jpg, одинаковые снимки хранятся одним файлом (см. media.py)
+PHOTOS_DIR = os.getenv('PHOTOS_DIR', 'photos')
+MEDIA_GRACE_SECONDS = int(os.getenv('MEDIA_GRACE_SECONDS', 24 * 3600))  # файл без ссылок моложе — не удаляем
+Path(PHOTOS_DIR).mkdir(exist_ok=True)
+# Обработка фото в пуле из IMAGE_WORKERS процессов (нужен Pillow, без него фото хранятся как есть):
+# уменьшение до IMAGE_MAX_SIDE по большей стороне, JPEG IMAGE_QUALITY и миниатюра IMAGE_THUMB_SIDE для сводок
+IMAGE_MAX_SIDE = int(os.getenv('IMAGE_MAX_SIDE', 1280))
+IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY', 82))
+IMAGE_THUMB_SIDE = int(os.getenv('IMAGE_THUMB_SIDE', 320))
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+# Ленивые фото (MEDIA_LAZY=1): при добавлении покупки сохраняется только file_id, фото показываются по нему;
+# для снимка (backup.py) файл скачивается в кэш PHOTOS_DIR/cache не больше MEDIA_CACHE_MAX_MB
+# (вытесняются давно не нужные)
+MEDIA_LAZY = os.getenv('MEDIA_LAZY', '0') == '1'
+MEDIA_CACHE_MAX_MB = int(os.getenv('MEDIA_CACHE_MAX_MB', 512))
+MEDIA_CHUNK_SIZE = int(os.getenv('MEDIA_CHUNK_SIZE', 64 * 1024))  # загрузка из Telegram кусками, без файла в памяти
+# Сборка мусора фото: файлы без ссылок (брошенные формы) старше MEDIA_GRACE_SECONDS, пачками по PHOTO_GC_BATCH
+PHOTO_GC_INTERVAL_HOURS = float(os.getenv('PHOTO_GC_INTERVAL_HOURS', 6))
+PHOTO_GC_BATCH = int(os.getenv('PHOTO_GC_BATCH', 500))
+PHOTO_GC_BATCH_PAUSE_MS = int(os.getenv('PHOTO_GC_BATCH_PAUSE_MS', 50))
 Path("docs").mkdir(exist_ok=True)
 DB_NAME = 'impulse_bot.db'
+DB_READERS = int(os.getenv('DB_READERS', 4))  # соединений-читателей в пуле (на каждый шард)
+
+# Шардирование по user_id: 1 — один файл DB_NAME, N > 1 — файлы DB_SHARD_PATH (см. sharding.py)
+DB_SHARDS = int(os.getenv('DB_SHARDS', 1))
+DB_SHARD_PATH = os.getenv('DB_SHARD_PATH', 'impulse_bot.shard{index}.db')
+
+# Состояния форм (FSM): отдельный файл, изменения копятся в памяти и пишутся раз в FSM_FLUSH_INTERVAL_MS
+FSM_DB_NAME = os.getenv('FSM_DB_NAME', 'impulse_bot.fsm.db')
+FSM_FLUSH_INTERVAL_MS = int(os.getenv('FSM_FLUSH_INTERVAL_MS', 1000))
+# Брошенные формы: без изменений дольше FSM_SESSION_TTL_HOURS — сбрасываются совсем (их фото потом удалит photo_gc);
+# в памяти держим не дольше FSM_MEMORY_TTL_SECONDS без обращений и не больше FSM_MAX_SESSIONS (остальное — в базе)
+FSM_SESSION_TTL_HOURS = float(os.getenv('FSM_SESSION_TTL_HOURS', 24))
+FSM_MEMORY_TTL_SECONDS = int(os.getenv('FSM_MEMORY_TTL_SECONDS', 600))
+FSM_MAX_SESSIONS = int(os.getenv('FSM_MAX_SESSIONS', 10000))
+FSM_SWEEP_INTERVAL_SECONDS = int(os.getenv('FSM_SWEEP_INTERVAL_SECONDS', 60))
+
+# Пагинация списков
+LIST_PAGE_SIZE = int(os.getenv('LIST_PAGE_SIZE', 8))  # строк на странице списка
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', 10))
+
+# SQLite: WAL + group commit
+DB_SYNCHRONOUS = os.getenv('DB_SYNCHRONOUS', 'FULL')  # FULL — каждый COMMIT пачки долговечен
+DB_CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB', 16384))
+DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', 256 * 1024 * 1024))
+DB_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', 5000))
+WRITE_BATCH_WINDOW_MS = float(os.getenv('WRITE_BATCH_WINDOW_MS', 3))  # окно сбора записей в одну транзакцию
+WRITE_BATCH_MAX = int(os.getenv('WRITE_BATCH_MAX', 256))
+
+# Миграции: размер пачки при заполнении столбцов и пауза между пачками
+MIGRATION_BATCH_SIZE = int(os.getenv('MIGRATION_BATCH_SIZE', 500))
+MIGRATION_BATCH_PAUSE_MS = int(os.getenv('MIGRATION_BATCH_PAUSE_MS', 20))
+
+# Кэш отрисованных карточек и страниц списков
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 10000))
+CACHE_TTL_SECONDS = float(os.getenv('CACHE_TTL_SECONDS', 300))
+
+# Администраторы (через запятую) — доступ к /metrics
+ADMIN_IDS = {int(x) for x in os.getenv('ADMIN_IDS', '').split(',') if x.strip()}
+
+# Архив решённых покупок (купленные/отменённые старше ARCHIVE_AFTER_DAYS)
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 30))
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', 500))  # строк в одной транзакции переноса
+ARCHIVE_BATCH_PAUSE_MS = int(os.getenv('ARCHIVE_BATCH_PAUSE_MS', 50))
+ARCHIVE_INTERVAL_SECONDS = int(os.getenv('ARCHIVE_INTERVAL_SECONDS', 3600))
+
+# Обслуживание базы: окно низкой нагрузки (часы локального времени, "3-6" или "23-2")
+MAINTENANCE_WINDOW = os.getenv('MAINTENANCE_WINDOW', '3-6')
+MAINTENANCE_INTERVAL_SECONDS = int(os.getenv('MAINTENANCE_INTERVAL_SECONDS', 600))
+MAINTENANCE_STEP_BUDGET_MS = int(os.getenv('MAINTENANCE_STEP_BUDGET_MS', 200))  # на шаг в одном шарде
+MAINTENANCE_VACUUM_PAGES = int(os.getenv('MAINTENANCE_VACUUM_PAGES', 256))  # страниц за один incremental_vacuum
+MAINTENANCE_ANALYSIS_LIMIT = int(os.getenv('MAINTENANCE_ANALYSIS_LIMIT', 1000))  # строк индекса на ANALYZE
+MAINTENANCE_ANALYZE_HOURS = int(os.getenv('MAINTENANCE_ANALYZE_HOURS', 24))  # как часто обновлять статистику
+
+# Снимки базы и фото (online backup API, см. backup.py)
+BACKUP_DIR = os.getenv('BACKUP_DIR', 'backups')
+BACKUP_PAGES_PER_STEP = int(os.getenv('BACKUP_PAGES_PER_STEP', 64))  # страниц за шаг копирования
+BACKUP_STEP_SLEEP_MS = int(os.getenv('BACKUP_STEP_SLEEP_MS', 5))
+BACKUP_INTERVAL_HOURS = float(os.getenv('BACKUP_INTERVAL_HOURS', 24))
+BACKUP_KEEP = int(os.getenv('BACKUP_KEEP', 7))  # сколько последних снимков хранить
+
+# Напоминания: в памяти держим сроки на REMINDER_HORIZON_SECONDS вперёд, дальше — перечитываем базу
+REMINDER_HORIZON_SECONDS = int(os.getenv('REMINDER_HORIZON_SECONDS', 3600))
+
+# Отправка напоминаний: лимиты Telegram (~30 сообщений/с на бота, ~1/с в один чат)
+SEND_RATE_GLOBAL = float(os.getenv('SEND_RATE_GLOBAL', 30))
+SEND_BURST_GLOBAL = float(os.getenv('SEND_BURST_GLOBAL', 1))
+SEND_RATE_CHAT = float(os.getenv('SEND_RATE_CHAT', 1))
+SEND_BURST_CHAT = float(os.getenv('SEND_BURST_CHAT', 1))
+SEND_PHOTO_WEIGHT = float(os.getenv('SEND_PHOTO_WEIGHT', 2))  # фото «дороже» текста
+SEND_CONCURRENCY = int(os.getenv('SEND_CONCURRENCY', 20))  # одновременных запросов к API
+# 429 в SEND_FLOOD_CHATS разных чатах за SEND_FLOOD_WINDOW_SECONDS — упёрлись в общий лимит бота, пауза для всех
+SEND_FLOOD_CHATS = int(os.getenv('SEND_FLOOD_CHATS', 3))
+SEND_FLOOD_WINDOW_SECONDS = float(os.getenv('SEND_FLOOD_WINDOW_SECONDS', 5))
+
+# Несколько процессов делят напоминания через аренду строк (см. PurchaseRepository.claim_due)
+WORKER_ID = os.getenv('WORKER_ID') or f"{socket.gethostname()}:{os.getpid()}"
+REMINDER_LEASE_SECONDS = int(os.getenv('REMINDER_LEASE_SECONDS', 300))  # больше времени отправки пачки
+REMINDER_CLAIM_BATCH = int(os.getenv('REMINDER_CLAIM_BATCH', 500))
+DELIVERY_KEEP_DAYS = int(os.getenv('DELIVERY_KEEP_DAYS', 30))  # сколько хранить журнал доставок
+
+# Сводка напоминаний: всё, что у пользователя наступит в ближайшие REMINDER_DIGEST_WINDOW_SECONDS, — одним сообщением
+REMINDER_DIGEST_WINDOW_SECONDS = int(os.getenv('REMINDER_DIGEST_WINDOW_SECONDS', 60))
+REMINDER_DIGEST_MAX_ITEMS = int(os.getenv('REMINDER_DIGEST_MAX_ITEMS', 10))  # не больше 10 — предел media group
+
+# Повторы отправки напоминаний: экспоненциальная пауза RETRY_BASE_SECONDS * 2^попытка (не больше RETRY_MAX_DELAY_SECONDS)
+RETRY_BASE_SECONDS = int(os.getenv('RETRY_BASE_SECONDS', 30))
+RETRY_MAX_DELAY_SECONDS = int(os.getenv('RETRY_MAX_DELAY_SECONDS', 6 * 3600))
+RETRY_MAX_ATTEMPTS = int(os.getenv('RETRY_MAX_ATTEMPTS', 8))  # после — в dead letters
+RETRY_INLINE_MAX_SECONDS = int(os.getenv('RETRY_INLINE_MAX_SECONDS', 10))  # retry_after дольше — через повтор
+
+# Догон после простоя: напоминания, опоздавшие больше чем на CATCHUP_LAG_SECONDS, уходят с самых старых
+# и занимают не больше CATCHUP_SHARE от SEND_RATE_GLOBAL — остальное остаётся живым пользователям
+CATCHUP_LAG_SECONDS = int(os.getenv('CATCHUP_LAG_SECONDS', 300))
+CATCHUP_SHARE = float(os.getenv('CATCHUP_SHARE', 0.5))
+
+# Остановка бота: сколько ждать завершения начатых отправок напоминаний
+SHUTDOWN_TIMEOUT_SECONDS = int(os.getenv('SHUTDOWN_TIMEOUT_SECONDS', 30))
@@ -1,96 +1,196 @@
+import asyncio
 import aiosqlite
-from config import DB_NAME
-
-
-async def init_db():
-    """Инициализация базы данных"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        # Таблица пользователей
-        await db.execute('''
-                         CREATE TABLE IF NOT EXISTS users
-                         (
-                             id
-                             INTEGER
-                             PRIMARY
-                             KEY
-                             AUTOINCREMENT,
-                             user_id
-                             INTEGER
-                             UNIQUE
-                             NOT
-                             NULL,
-                             created_at
-                             TIMESTAMP
-                             DEFAULT
-                             CURRENT_TIMESTAMP
-                         )
-                         ''')
-
-        # Таблица покупок
-        await db.execute('''
-                         CREATE TABLE IF NOT EXISTS purchases
-                         (
-                             id
-                             INTEGER
-                             PRIMARY
-                             KEY
-                             AUTOINCREMENT,
-                             user_id
-                             INTEGER
-                             NOT
-                             NULL,
-                             name
-                             TEXT
-                             NOT
-                             NULL,
-                             price
-                             REAL
-                             NOT
-                             NULL,
-                             store
-                             TEXT,
-                             link
-                             TEXT,
-                             description
-                             TEXT,
-                             photo_path
-                             TEXT,
-                             remind_at
-                             TIMESTAMP,
-                             reminded
-                             INTEGER
-                             DEFAULT
-                             0,
-                             status
-                             TEXT
-                             DEFAULT
-                             'pending',
-                             created_at
-                             TIMESTAMP
-                             DEFAULT
-                             CURRENT_TIMESTAMP,
-                             FOREIGN
-                             KEY
-                         (
-                             user_id
-                         ) REFERENCES users
-                         (
-                             user_id
-                         )
-                             )
-                         ''')
-
-        # ✅ Проверяем и добавляем отсутствующие столбцы
-        cursor = await db.execute("PRAGMA table_info(purchases)")
-        columns = [row[1] for row in await cursor.fetchall()]
-
-        if 'reminded' not in columns:
-            await db.execute('ALTER TABLE purchases ADD COLUMN reminded INTEGER DEFAULT 0')
-            print("✅ Добавлен столбец 'reminded'")
-
-        if 'status' not in columns:
-            await db.execute('ALTER TABLE purchases ADD COLUMN status TEXT DEFAULT "pending"')
-            print("✅ Добавлен столбец 'status'")
-
-        await db.commit()
-        print("✅ База данных инициализирована")
+from contextlib import asynccontextmanager
+from config import (DB_NAME, DB_READERS, DB_SYNCHRONOUS, DB_CACHE_SIZE_KB, DB_MMAP_SIZE, DB_BUSY_TIMEOUT_MS,
+                    WRITE_BATCH_WINDOW_MS, WRITE_BATCH_MAX)
+from migrations import migrate
+
+
+class Database:
+    """Пул соединений: один писатель с group commit + N читателей (WAL)"""
+
+    def __init__(self, path: str = DB_NAME, readers: int = DB_READERS):
+        self.path = path
+        self.readers_count = max(1, readers)
+        self._writer = None
+        self._writer_task = None
+        self._closing = False
+        self._write_queue = asyncio.Queue()
+        self._readers = asyncio.Queue()
+        self._all_readers = []
+
+    async def _connect(self, readonly: bool = False):
+        # isolation_level=None — транзакциями управляем сами (BEGIN/COMMIT в писателе)
+        conn = await aiosqlite.connect(self.path, isolation_level=None)
+        await conn.execute(f'PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}')
+        await conn.execute(f'PRAGMA cache_size = -{DB_CACHE_SIZE_KB}')
+        await conn.execute(f'PRAGMA mmap_size = {DB_MMAP_SIZE}')
+        if readonly:
+            await conn.execute('PRAGMA query_only = ON')
+        else:
+            # Действует только для нового файла (до создания таблиц); старую базу переводит manage.py vacuum
+            await conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            await conn.execute('PRAGMA journal_mode = WAL')
+            await conn.execute(f'PRAGMA synchronous = {DB_SYNCHRONOUS}')
+        return conn
+
+    async def open(self):
+        """Открытие соединений пула и запуск очереди записи"""
+        self._writer = await self._connect()
+        for _ in range(self.readers_count):
+            conn = await self._connect(readonly=True)
+            self._all_readers.append(conn)
+            self._readers.put_nowait(conn)
+        self._closing = False
+        self._writer_task = asyncio.create_task(self._writer_loop())
+        return self
+
+    async def close(self):
+        """Дожидаемся записи очереди и закрываем все соединения"""
+        if self._writer_task is not None:
+            self._closing = True
+            self._write_queue.put_nowait(None)
+            await self._writer_task
+            self._writer_task = None
+        for conn in self._all_readers:
+            await conn.close()
+        self._all_readers.clear()
+        self._readers = asyncio.Queue()
+        if self._writer is not None:
+            await self._writer.execute('PRAGMA optimize')
+            await self._writer.close()
+            self._writer = None
+
+    @asynccontextmanager
+    async def read(self):
+        """Соединение для чтения из пула"""
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    async def write(self, op):
+        """Выполнение op(conn) через очередь записи.
+
+        Возвращает результат op только после COMMIT транзакции, в которую попала запись.
+        """
+        return await self._enqueue(op, in_transaction=True)
+
+    async def maintain(self, op):
+        """Выполнение op(conn) на соединении писателя вне транзакции (VACUUM, ANALYZE, checkpoint).
+
+        Идёт через ту же очередь: между пачками записей, а не параллельно им.
+        """
+        return await self._enqueue(op, in_transaction=False)
+
+    @property
+    def idle(self) -> bool:
+        """Нет ожидающих записей"""
+        return self._write_queue.empty()
+
+    async def _enqueue(self, op, in_transaction: bool):
+        if self._writer_task is None:
+            raise RuntimeError("База данных не открыта")
+        if self._closing:
+            raise RuntimeError("База данных закрыта")
+        future = asyncio.get_running_loop().create_future()
+        self._write_queue.put_nowait((op, future, in_transaction))
+        return await future
+
+    async def _writer_loop(self):
+        """Group commit: собираем записи за WRITE_BATCH_WINDOW_MS и пишем одной транзакцией"""
+        stopping = False
+        while not stopping:
+            item = await self._write_queue.get()
+            if item is None:
+                break
+            batch = [item]
+            await asyncio.sleep(WRITE_BATCH_WINDOW_MS / 1000)
+            while len(batch) < WRITE_BATCH_MAX and not self._write_queue.empty():
+                item = self._write_queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            # Служебные операции выполняются по одной, между транзакциями обычных записей
+            run = []
+            for op, future, in_transaction in batch:
+                if in_transaction:
+                    run.append((op, future))
+                    continue
+                if run:
+                    await self._commit_batch(run)
+                    run = []
+                await self._run_outside_transaction(op, future)
+            if run:
+                await self._commit_batch(run)
+        # Записи после метки остановки не выполняются — ожидающие их получают ошибку, а не зависают
+        while not self._write_queue.empty():
+            item = self._write_queue.get_nowait()
+            if item is not None and not item[1].done():
+                item[1].set_exception(RuntimeError("База данных закрыта"))
+
+    async def _run_outside_transaction(self, op, future):
+        try:
+            result = await op(self._writer)
+        except Exception as e:
+            if self._writer.in_transaction:
+                await self._writer.execute('ROLLBACK')
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
+
+    async def _commit_batch(self, batch):
+        """Одна транзакция на пачку; ошибка одной записи откатывает только её savepoint"""
+        conn = self._writer
+        results = []
+        try:
+            await conn.execute('BEGIN IMMEDIATE')
+            for op, future in batch:
+                await conn.execute('SAVEPOINT write_op')
+                try:
+                    result = await op(conn)
+                except Exception as e:
+                    await conn.execute('ROLLBACK TO write_op')
+                    await conn.execute('RELEASE write_op')
+                    results.append((future, None, e))
+                else:
+                    await conn.execute('RELEASE write_op')
+                    results.append((future, result, None))
+            await conn.execute('COMMIT')
+        except Exception as e:
+            if conn.in_transaction:
+                await conn.execute('ROLLBACK')
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for future, result, error in results:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    async def fetchall(self, sql: str, params=()):
+        """SELECT через соединение-читатель (все строки)"""
+        async with self.read() as conn:
+            cursor = await conn.execute(sql, params)
+            return await cursor.fetchall()
+
+    async def fetchone(self, sql: str, params=()):
+        """SELECT через соединение-читатель (одна строка)"""
+        async with self.read() as conn:
+            cursor = await conn.execute(sql, params)
+            return await cursor.fetchone()
+
+
+async def init_db(db: Database):
+    """Инициализация базы данных (применение миграций)"""
+    await migrate(db)
+    print("✅ База данных инициализирована")
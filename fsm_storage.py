@@ -0,0 +1,332 @@
+import asyncio
+import heapq
+import json
+import time
+import weakref
+from typing import Any, Mapping
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+from config import (FSM_DB_NAME, FSM_FLUSH_INTERVAL_MS, FSM_SESSION_TTL_HOURS, FSM_MEMORY_TTL_SECONDS, FSM_MAX_SESSIONS,
+                    FSM_SWEEP_INTERVAL_SECONDS)
+from database import Database
+
+# Состояние форм (FSM) в отдельном файле FSM_DB_NAME: частые записи шагов формы не попадают
+# в WAL основной базы и не ждут её group commit. Источник истины во время работы — память:
+# шаг формы читает и пишет словарь, а изменённые ключи раз в FSM_FLUSH_INTERVAL_MS уходят
+# в базу одной транзакцией (десяток update_data одной формы — одна запись строки).
+# При аварии теряется не больше интервала сброса; при остановке бота close() сбрасывает всё.
+#
+# Брошенные формы убирает фоновый обход раз в FSM_SWEEP_INTERVAL_SECONDS (на апдейт — только
+# отметка времени): без изменений дольше FSM_SESSION_TTL_HOURS — сессия сбрасывается и в памяти,
+# и в базе; без обращений дольше FSM_MEMORY_TTL_SECONDS или сверх FSM_MAX_SESSIONS — уходит только
+# из памяти и при следующем апдейте читается из базы.
+#
+# Шаги формы добавления работают через FormStep: состояние и данные читаются одним обращением
+# к хранилищу, меняются в памяти шага и записываются одним обращением вместе с переходом.
+
+SQL_FSM_GET = 'SELECT state, data, updated_at FROM fsm_states WHERE key = ?'
+SQL_FSM_UPSERT = '''INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (key) DO UPDATE SET state = excluded.state, data = excluded.data,
+                                                    updated_at = excluded.updated_at'''
+SQL_FSM_DELETE = 'DELETE FROM fsm_states WHERE key = ?'
+SQL_FSM_EXPIRE = 'DELETE FROM fsm_states WHERE updated_at < ?'
+SQL_FSM_COUNT = 'SELECT COUNT(*) FROM fsm_states'
+# Фото незавершённых форм для photo_gc: проход по таблице (в ней только живые сессии) раз за сборку мусора
+SQL_FSM_PHOTOS = '''SELECT json_extract(data, '$.photo_path') FROM fsm_states
+                    WHERE json_extract(data, '$.photo_path') IS NOT NULL'''
+
+
+def storage_key(key: StorageKey) -> str:
+    return ':'.join(str(part) for part in (key.bot_id, key.chat_id, key.user_id, key.thread_id,
+                                             key.business_connection_id, key.destiny))
+
+
+class _Record:
+    __slots__ = ('state', 'data', 'changed_at', 'accessed')
+
+    def __init__(self, state: str | None = None, data: dict | None = None, changed_at: float | None = None):
+        self.state = state
+        self.data = data or {}
+        self.changed_at = time.time() if changed_at is None else changed_at  # для FSM_SESSION_TTL_HOURS
+        self.accessed = time.monotonic()  # для FSM_MEMORY_TTL_SECONDS и FSM_MAX_SESSIONS
+
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище FSM aiogram в SQLite с отложенной записью (write-behind)"""
+
+    def __init__(self, path: str = FSM_DB_NAME, flush_interval_ms: float = FSM_FLUSH_INTERVAL_MS,
+                 session_ttl: float = FSM_SESSION_TTL_HOURS * 3600, memory_ttl: float = FSM_MEMORY_TTL_SECONDS,
+                 max_sessions: int = FSM_MAX_SESSIONS):
+        self.db = Database(path, readers=1)
+        self.flush_interval = flush_interval_ms / 1000
+        self.session_ttl = session_ttl
+        self.memory_ttl = memory_ttl
+        self.max_sessions = max_sessions
+        self._records = {}  # ключ -> _Record (прочитанные и изменённые)
+        self._dirty = set()  # ключи, изменённые после последнего сброса
+        self._tasks = []
+        self._locks = weakref.WeakValueDictionary()  # ключ -> asyncio.Lock шага формы, пока его кто-то держит или ждёт
+        self.evicted = 0  # выгружено из памяти (остались в базе)
+        self.expired = 0  # брошенных сессий сброшено по FSM_SESSION_TTL_HOURS
+
+    async def open(self):
+        """Открытие базы и запуск фонового сброса"""
+        await self.db.open()
+
+        async def op(conn):
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS fsm_states (
+                    key TEXT PRIMARY KEY,
+                    state TEXT,
+                    data TEXT NOT NULL,
+                    updated_at INTEGER NOT NULL
+                ) WITHOUT ROWID
+            ''')
+            await conn.execute('CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states (updated_at)')
+
+        await self.db.write(op)
+        self._tasks = [asyncio.create_task(self._flush_loop()), asyncio.create_task(self._sweep_loop())]
+        return self
+
+    async def _record(self, key: StorageKey) -> tuple[str, _Record]:
+        name = storage_key(key)
+        record = self._records.get(name)
+        if record is None:
+            row = await self.db.fetchone(SQL_FSM_GET, (name,))
+            loaded = _Record(row[0], json.loads(row[1]), row[2]) if row else _Record()
+            # Пока читали, ключ мог появиться (параллельный апдейт) — память важнее
+            record = self._records.setdefault(name, loaded)
+        record.accessed = time.monotonic()
+        return name, record
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        name, record = await self._record(key)
+        record.state = state.state if isinstance(state, State) else state
+        record.changed_at = time.time()
+        self._dirty.add(name)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        _, record = await self._record(key)
+        return record.state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        name, record = await self._record(key)
+        record.data = data.copy()
+        record.changed_at = time.time()
+        self._dirty.add(name)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        _, record = await self._record(key)
+        return record.data.copy()
+
+    async def get_record(self, key: StorageKey) -> tuple[str | None, dict[str, Any]]:
+        """Состояние и данные одним чтением"""
+        _, record = await self._record(key)
+        return record.state, record.data.copy()
+
+    async def set_record(self, key: StorageKey, state: StateType, data: Mapping[str, Any]) -> None:
+        """Состояние и данные одной записью"""
+        name, record = await self._record(key)
+        record.state = state.state if isinstance(state, State) else state
+        record.data = dict(data)
+        record.changed_at = time.time()
+        self._dirty.add(name)
+
+    def lock(self, key: StorageKey) -> asyncio.Lock:
+        """Блокировка ключа: шаги формы одного пользователя идут по очереди"""
+        name = storage_key(key)
+        lock = self._locks.get(name)
+        if lock is None:
+            lock = self._locks[name] = asyncio.Lock()
+        return lock
+
+    async def flush(self) -> int:
+        """Запись изменённых ключей одной транзакцией, возвращает их число"""
+        if not self._dirty:
+            return 0
+        names, self._dirty = self._dirty, set()
+        now = int(time.time())
+        upserts, deletes = [], []
+        for name in names:
+            record = self._records[name]
+            if record.state is None and not record.data:
+                # Пустая запись — то же, что её отсутствие (форма завершена или сброшена)
+                deletes.append((name,))
+            else:
+                upserts.append((name, record.state, json.dumps(record.data, ensure_ascii=False), now))
+
+        async def op(conn):
+            await conn.executemany(SQL_FSM_UPSERT, upserts)
+            await conn.executemany(SQL_FSM_DELETE, deletes)
+
+        try:
+            await self.db.write(op)
+        except Exception:
+            self._dirty |= names  # повторим со следующим сбросом
+            raise
+        # Из памяти — только после удаления из базы (иначе чтение вернуло бы старую строку)
+        for (name,) in deletes:
+            record = self._records.get(name)
+            if name not in self._dirty and record is not None and record.state is None and not record.data:
+                del self._records[name]
+        return len(names)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"❌ Ошибка записи состояний FSM: {e}")
+
+    async def sweep(self) -> tuple[int, int]:
+        """Сброс брошенных сессий и выгрузка холодных из памяти: (сброшено, выгружено)"""
+        cutoff = time.time() - self.session_ttl
+        expired = 0
+        for name, record in self._records.items():
+            if record.changed_at < cutoff and (record.state is not None or record.data):
+                record.state, record.data = None, {}
+                self._dirty.add(name)
+                expired += 1
+        await self.flush()
+
+        # Строки, которых нет в памяти (в памяти устаревшие уже сброшены выше)
+        async def op(conn):
+            cursor = await conn.execute(SQL_FSM_EXPIRE, (cutoff,))
+            return cursor.rowcount
+
+        expired += await self.db.write(op)
+
+        # Из памяти — только записанное в базу
+        idle_before = time.monotonic() - self.memory_ttl
+        clean = [(record.accessed, name) for name, record in self._records.items() if name not in self._dirty]
+        drop = [name for accessed, name in clean if accessed < idle_before]
+        over = len(self._records) - len(drop) - self.max_sessions
+        if over > 0:
+            dropped = set(drop)
+            drop += [name for _, name in heapq.nsmallest(over, (item for item in clean if item[1] not in dropped))]
+        for name in drop:
+            del self._records[name]
+        self.expired += expired
+        self.evicted += len(drop)
+        return expired, len(drop)
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(FSM_SWEEP_INTERVAL_SECONDS)
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"❌ Ошибка очистки состояний FSM: {e}")
+
+    async def photo_paths(self) -> set[str]:
+        """Фото, загруженные в незавершённые формы (photo_path в данных) — в памяти и в базе"""
+        rows = await self.db.fetchall(SQL_FSM_PHOTOS)
+        paths = {row[0] for row in rows}
+        paths.update(record.data['photo_path'] for record in list(self._records.values())
+                     if record.data.get('photo_path'))
+        return paths
+
+    async def stats(self) -> dict:
+        """Счётчики для /metrics"""
+        row = await self.db.fetchone(SQL_FSM_COUNT)
+        return {
+            "live": len(self._records),
+            "dirty": len(self._dirty),
+            "stored": row[0],
+            "evicted": self.evicted,
+            "expired": self.expired,
+        }
+
+    async def close(self) -> None:
+        """Остановка фоновых задач, запись оставшегося и закрытие базы (вызывается aiogram при остановке)"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        try:
+            await self.flush()
+        finally:
+            await self.db.close()
+
+
+class FormStep:
+    """Шаг формы: одно чтение состояния с данными на входе, одна запись с переходом на выходе.
+
+    Запись — только если шаг что-то изменил и завершился без исключения (иначе форма остаётся
+    как была). С SQLiteStorage шаги одного ключа не перемешиваются: чтение, изменение и запись
+    идут под блокировкой ключа. Пишутся только ключи, изменённые шагом, поверх текущей записи:
+    state.update_data других обработчиков (они блокировку не берут) во время шага не теряются.
+
+        async with FormStep(state) as form:
+            form.update(price=price)
+            form.set_state(AddPurchase.waiting_store)
+    """
+
+    def __init__(self, context: FSMContext):
+        self.storage = context.storage
+        self.key = context.key
+        self.state = None
+        self.data = {}
+        self._changed = False
+        self._updates = {}  # ключи данных, изменённые шагом
+        self._state_set = False
+        self._cleared = False
+        self._lock = None
+
+    async def __aenter__(self) -> 'FormStep':
+        if isinstance(self.storage, SQLiteStorage):
+            self._lock = self.storage.lock(self.key)
+            await self._lock.acquire()
+            try:
+                self.state, self.data = await self.storage.get_record(self.key)
+            except BaseException:
+                self._lock.release()
+                raise
+        else:
+            self.state = await self.storage.get_state(self.key)
+            self.data = await self.storage.get_data(self.key)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        try:
+            if exc_type is None and self._changed:
+                if isinstance(self.storage, SQLiteStorage):
+                    # Запись в памяти — текущая запись читается без обращения к базе
+                    state, data = await self.storage.get_record(self.key)
+                else:
+                    state = await self.storage.get_state(self.key)
+                    data = await self.storage.get_data(self.key)
+                if self._cleared:
+                    state, data = None, {}
+                data.update(self._updates)
+                if self._state_set:
+                    state = self.state
+                if isinstance(self.storage, SQLiteStorage):
+                    await self.storage.set_record(self.key, state, data)
+                else:
+                    await self.storage.set_data(self.key, data)
+                    await self.storage.set_state(self.key, state)
+        finally:
+            if self._lock is not None:
+                self._lock.release()
+
+    def update(self, **kwargs: Any) -> None:
+        self.data.update(kwargs)
+        self._updates.update(kwargs)
+        self._changed = True
+
+    def set_state(self, state: StateType) -> None:
+        self.state = state.state if isinstance(state, State) else state
+        self._state_set = True
+        self._changed = True
+
+    def clear(self) -> None:
+        self.state, self.data = None, {}
+        self._updates = {}
+        self._state_set = self._cleared = True
+        self._changed = True
@@ -6,3 +6,4 @@ from . import fsm_steps
 from . import lists
 from . import cards
 from . import reminders
+from . import admin
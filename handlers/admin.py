@@ -0,0 +1,32 @@
+from aiogram import types, F, Router
+from aiogram.filters import Command
+from repository import PurchaseRepository
+from media import MediaStore
+from fsm_storage import SQLiteStorage
+from config import ADMIN_IDS
+
+router = Router()
+router.message.filter(F.from_user.id.in_(ADMIN_IDS))
+
+
+@router.message(Command("metrics"))
+async def cmd_metrics(message: types.Message, repo: PurchaseRepository, media: MediaStore,
+                      fsm_storage: SQLiteStorage):
+    """Метрики процесса (только для ADMIN_IDS)"""
+    cache = repo.cache.stats()
+    media_cache = media.cache.stats()
+    sessions = await fsm_storage.stats()
+    dead = await repo.dead_letter_count()
+    text = (
+        "📈 Метрики\n\n"
+        f"Кэш карточек и списков: {cache['entries']} записей\n"
+        f"• попадания: {cache['hits']}, промахи: {cache['misses']} ({cache['hit_rate']:.0%})\n"
+        f"• вытеснено: {cache['evictions']}, сброшено записями: {cache['invalidations']}\n\n"
+        f"Кэш ленивых фото (для снимков): {media_cache['entries']} файлов, {media_cache['bytes'] // (1024 * 1024)} МБ\n"
+        f"• попадания: {media_cache['hits']}, промахи: {media_cache['misses']} ({media_cache['hit_rate']:.0%}), "
+        f"вытеснено: {media_cache['evictions']}\n\n"
+        f"Сессии форм: в памяти {sessions['live']} (не записано {sessions['dirty']}), в базе {sessions['stored']}\n"
+        f"• выгружено из памяти: {sessions['evicted']}, брошенных сброшено: {sessions['expired']}\n\n"
+        f"Напоминаний в dead letters: {dead} (python manage.py dead-letters)"
+    )
+    await message.answer(text)
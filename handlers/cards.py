@@ -1,75 +1,108 @@
-import os
-import aiosqlite
 from aiogram import types, F, Router
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
 from aiogram.types import FSInputFile
 from keyboards import card_actions_keyboard, move_menu_keyboard, delete_confirm_keyboard, main_inline_keyboard
 from utils import escape_md
-from config import DB_NAME
+from repository import PurchaseRepository
+from media import MediaStore, exists
+from models import Status
 
 router = Router()
 
 
+async def load_card(repo: PurchaseRepository, purchase_id: int, user_id: int):
+    """Отрисованная карточка (text, name, photo_path, photo_file_id) из кэша или базы; None — не найдена"""
+    key = ('card', purchase_id)
+    version = await repo.data_version(user_id)
+    view = repo.cache.get(user_id, key, version)
+    if view is None:
+        row = await repo.get(purchase_id, user_id)
+        if not row:
+            return None
+
+        text = f"📦 **{escape_md(row.name)}**\n💰 {row.price:,.0f}₽\n🏪 {escape_md(row.store)}"
+        if row.description:
+            text += f"\n\n{escape_md(row.description)}"
+        if row.link:
+            text += f"\n\n🔗 {escape_md(row.link)}"
+
+        view = (text, row.name, row.photo_path, row.photo_file_id)
+        repo.cache.set(user_id, key, view, version)
+    return view
+
+
 @router.callback_query(F.data.startswith("open_"))
-async def open_purchase_callback(callback: types.CallbackQuery, state: FSMContext):
+async def open_purchase_callback(callback: types.CallbackQuery, state: FSMContext, repo: PurchaseRepository,
+                                 purchase_id: int | None = None):
     """Открытие карточки покупки"""
-    purchase_id = int(callback.data.split("_")[1])
+    if purchase_id is None:
+        purchase_id = int(callback.data.split("_")[1])
     await state.update_data(last_viewed_id=purchase_id)
 
-    async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute(
-            'SELECT name, price, store, link, description, photo_path FROM purchases WHERE id=? AND user_id=?',
-            (purchase_id, callback.from_user.id)
-        )
-        row = await cursor.fetchone()
+    view = await load_card(repo, purchase_id, callback.from_user.id)
 
-    if not row:
+    if not view:
         await callback.message.edit_text(
             "❌ Товар не найден!",
             reply_markup=main_inline_keyboard()
         )
         return
 
-    text = f"📦 **{escape_md(row[0])}**\n💰 {row[1]:,.0f}₽\n🏪 {escape_md(row[2])}"
-    if row[4]:  # description
-        text += f"\n\n{escape_md(row[4])}"
-    if row[3]:  # link
-        text += f"\n\n🔗 {escape_md(row[3])}"
-
+    text, _, photo_path, photo_file_id = view
     kb = card_actions_keyboard(purchase_id)
-
-    # Если есть фото - отправляем новое сообщение с фото
-    if row[5] and os.path.exists(row[5]):
+    # ✅ file_id, если фото уже было в Telegram; файл с диска загружается только один раз
+    photo = photo_file_id or (FSInputFile(photo_path) if await exists(photo_path) else None)
+
+    if photo and callback.message.photo:
+        # Сообщение уже с фото — меняем фото и подпись на месте
+        try:
+            sent = await callback.message.edit_media(
+                types.InputMediaPhoto(media=photo, caption=text, parse_mode="Markdown"),
+                reply_markup=kb
+            )
+        except TelegramBadRequest as e:
+            # Та же карточка (например, после перемещения) — менять нечего
+            if "message is not modified" not in str(e):
+                raise
+            sent = callback.message
+    elif photo:
+        # Текстовое сообщение нельзя превратить в фото — отправляем новое
         await callback.message.delete()
-        await callback.bot.send_photo(
+        sent = await callback.bot.send_photo(
             callback.from_user.id,
-            FSInputFile(row[5]),
+            photo,
             caption=text,
             reply_markup=kb,
             parse_mode="Markdown"
         )
+    elif callback.message.photo:
+        # И наоборот: фото без фото не отредактировать
+        await callback.message.delete()
+        sent = await callback.bot.send_message(
+            callback.from_user.id, text, reply_markup=kb, parse_mode="Markdown"
+        )
     else:
         # Иначе редактируем текущее
-        await callback.message.edit_text(text, reply_markup=kb, parse_mode="Markdown")
+        sent = await callback.message.edit_text(text, reply_markup=kb, parse_mode="Markdown")
+
+    # edit_media/edit_text могут вернуть True вместо Message
+    if photo and not photo_file_id and getattr(sent, 'photo', None):
+        await repo.set_photo_file_id(purchase_id, callback.from_user.id, sent.photo[-1].file_id)
 
     await callback.answer()
 
 
 @router.callback_query(F.data.startswith("move_"))
-async def move_purchase_callback(callback: types.CallbackQuery):
+async def move_purchase_callback(callback: types.CallbackQuery, repo: PurchaseRepository):
     """Показ меню перемещения"""
     purchase_id = int(callback.data.split("_")[1])
 
     # Получаем название товара
-    async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute(
-            'SELECT name FROM purchases WHERE id=? AND user_id=?',
-            (purchase_id, callback.from_user.id)
-        )
-        row = await cursor.fetchone()
+    view = await load_card(repo, purchase_id, callback.from_user.id)
 
-    if row:
-        text = f"🔄 **Переместить покупку**\n\n📦 {escape_md(row[0])}\n\nКуда переместить?"
+    if view:
+        text = f"🔄 **Переместить покупку**\n\n📦 {escape_md(view[1])}\n\nКуда переместить?"
         await callback.message.edit_text(
             text,
             reply_markup=move_menu_keyboard(purchase_id),
@@ -79,43 +112,31 @@ async def move_purchase_callback(callback: types.CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("moveto_"))
-async def moveto_callback(callback: types.CallbackQuery):
+async def moveto_callback(callback: types.CallbackQuery, state: FSMContext, repo: PurchaseRepository):
     """Перемещение покупки"""
     parts = callback.data.split("_")
-    status = parts[1]  # pending/buy/wait/reject
+    status = Status.from_slug(parts[1])  # pending/buy/wait/reject
     purchase_id = int(parts[2])
 
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute(
-            'UPDATE purchases SET status=? WHERE id=? AND user_id=?',
-            (status, purchase_id, callback.from_user.id)
-        )
-        await db.commit()
+    await repo.set_status(purchase_id, status, callback.from_user.id)
 
     await callback.answer("✅ Перемещено!")
 
     # Возвращаемся к карточке
-    await open_purchase_callback(callback,
-                                 await callback.bot.fsm.get_context(bot=callback.bot, user_id=callback.from_user.id,
-                                                                    chat_id=callback.message.chat.id))
+    await open_purchase_callback(callback, state, repo, purchase_id)
 
 
 @router.callback_query(F.data.startswith("delete_") & ~F.data.startswith("delete_confirm_"))
-async def delete_purchase_callback(callback: types.CallbackQuery):
+async def delete_purchase_callback(callback: types.CallbackQuery, repo: PurchaseRepository):
     """Запрос подтверждения удаления"""
     purchase_id = int(callback.data.split("_")[1])
 
-    async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute(
-            'SELECT name FROM purchases WHERE id=? AND user_id=?',
-            (purchase_id, callback.from_user.id)
-        )
-        row = await cursor.fetchone()
+    view = await load_card(repo, purchase_id, callback.from_user.id)
 
-    if row:
+    if view:
         text = (
             f"🗑️ **Подтверждение удаления**\n\n"
-            f"📦 {escape_md(row[0])}\n\n"
+            f"📦 {escape_md(view[1])}\n\n"
             f"⚠️ Уверен, что хочешь **НАВСЕГДА** удалить эту покупку?"
         )
         await callback.message.edit_text(
@@ -127,34 +148,22 @@ async def delete_purchase_callback(callback: types.CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("delete_confirm_"))
-async def delete_confirm_callback(callback: types.CallbackQuery, state: FSMContext):
+async def delete_confirm_callback(callback: types.CallbackQuery, state: FSMContext, repo: PurchaseRepository,
+                                  media: MediaStore):
     """Окончательное удаление"""
     purchase_id = int(callback.data.split("_")[2])
 
-    async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute(
-            'SELECT photo_path, name FROM purchases WHERE id=? AND user_id=?',
-            (purchase_id, callback.from_user.id)
-        )
-        row = await cursor.fetchone()
-
-        if row:
-            # Удаляем фото
-            if row[0] and os.path.exists(row[0]):
-                os.remove(row[0])
+    row = await repo.delete(purchase_id, callback.from_user.id)
 
-            # Удаляем запись
-            await db.execute(
-                'DELETE FROM purchases WHERE id=? AND user_id=?',
-                (purchase_id, callback.from_user.id)
-            )
-            await db.commit()
+    if row:
+        # Удаляем фото, если оно больше ни у кого не используется
+        await media.release(row.photo_path)
 
-            await callback.message.edit_text(
-                f"✅ **Удалено!**\n\n📦 {escape_md(row[1])}",
-                reply_markup=main_inline_keyboard(),
-                parse_mode="Markdown"
-            )
-            await callback.answer("🗑️ Удалено!")
-        else:
-            await callback.answer("❌ Не найдено", show_alert=True)
+        await callback.message.edit_text(
+            f"✅ **Удалено!**\n\n📦 {escape_md(row.name)}",
+            reply_markup=main_inline_keyboard(),
+            parse_mode="Markdown"
+        )
+        await callback.answer("🗑️ Удалено!")
+    else:
+        await callback.answer("❌ Не найдено", show_alert=True)
@@ -1,25 +1,23 @@
 import re
 import os
 import asyncio
-import aiosqlite
-from datetime import datetime, timedelta
-from pathlib import Path
+import time
 from aiogram import types, F, Router, Bot
 from aiogram.filters import StateFilter
 from aiogram.fsm.context import FSMContext
 from keyboards import fsm_nav_inline, fsm_time_inline, main_inline_keyboard
 from states import AddPurchase
-from config import DB_NAME
+from fsm_storage import FormStep
+from repository import PurchaseRepository
+from scheduler import ReminderScheduler
+from media import MediaStore
 
 router = Router()
 
 
-# Сохраняем ID сообщения формы
-async def update_form_message(message_or_callback, text: str, reply_markup, state: FSMContext):
+# ID сообщения формы берётся из данных шага (FormStep), возвращается новый
+async def update_form_message(message_or_callback, text: str, reply_markup, form_message_id: int | None):
     """Обновление сообщения формы"""
-    data = await state.get_data()
-    form_message_id = data.get('form_message_id')
-
     # Если это callback - редактируем
     if isinstance(message_or_callback, types.CallbackQuery):
         await message_or_callback.message.edit_text(text, reply_markup=reply_markup, parse_mode="Markdown")
@@ -61,18 +59,18 @@ async def process_name(message: types.Message, state: FSMContext):
         await warning.delete()
         return
 
-    await state.update_data(name=message.text.strip())
-    message_id = await update_form_message(
-        message,
-        f"📝 **Добавление покупки**\n\n"
-        f"✅ Название: `{message.text.strip()}`\n\n"
-        f"Шаг 2/6: Введи **цену вещи** (₽)\n\n"
-        f"💡 Примеры: `1500`, `1 000 000`, `1.500.000`",
-        fsm_nav_inline(),
-        state
-    )
-    await state.update_data(form_message_id=message_id)
-    await state.set_state(AddPurchase.waiting_price)
+    async with FormStep(state) as form:
+        message_id = await update_form_message(
+            message,
+            f"📝 **Добавление покупки**\n\n"
+            f"✅ Название: `{message.text.strip()}`\n\n"
+            f"Шаг 2/6: Введи **цену вещи** (₽)\n\n"
+            f"💡 Примеры: `1500`, `1 000 000`, `1.500.000`",
+            fsm_nav_inline(),
+            form.data.get('form_message_id')
+        )
+        form.update(name=message.text.strip(), form_message_id=message_id)
+        form.set_state(AddPurchase.waiting_price)
 
 
 @router.message(StateFilter(AddPurchase.waiting_price))
@@ -103,63 +101,61 @@ async def process_price(message: types.Message, state: FSMContext):
         await warning.delete()
         return
 
-    data = await state.get_data()
-    await state.update_data(price=price)
-    message_id = await update_form_message(
-        message,
-        f"📝 **Добавление покупки**\n\n"
-        f"✅ Название: `{data['name']}`\n"
-        f"✅ Цена: `{price:,.0f}₽`\n\n"
-        f"Шаг 3/6: Введи **название магазина**",
-        fsm_nav_inline(),
-        state
-    )
-    await state.update_data(form_message_id=message_id)
-    await state.set_state(AddPurchase.waiting_store)
+    async with FormStep(state) as form:
+        message_id = await update_form_message(
+            message,
+            f"📝 **Добавление покупки**\n\n"
+            f"✅ Название: `{form.data['name']}`\n"
+            f"✅ Цена: `{price:,.0f}₽`\n\n"
+            f"Шаг 3/6: Введи **название магазина**",
+            fsm_nav_inline(),
+            form.data.get('form_message_id')
+        )
+        form.update(price=price, form_message_id=message_id)
+        form.set_state(AddPurchase.waiting_store)
 
 
 @router.message(StateFilter(AddPurchase.waiting_store))
 async def process_store(message: types.Message, state: FSMContext):
     """Обработка магазина"""
-    data = await state.get_data()
-    await state.update_data(store=message.text.strip())
-    message_id = await update_form_message(
-        message,
-        f"📝 **Добавление покупки**\n\n"
-        f"✅ Название: `{data['name']}`\n"
-        f"✅ Цена: `{data['price']:,.0f}₽`\n"
-        f"✅ Магазин: `{message.text.strip()}`\n\n"
-        f"Шаг 4/6: Введи **ссылку или описание**",
-        fsm_nav_inline(show_skip=True),
-        state
-    )
-    await state.update_data(form_message_id=message_id)
-    await state.set_state(AddPurchase.waiting_link_desc)
+    async with FormStep(state) as form:
+        message_id = await update_form_message(
+            message,
+            f"📝 **Добавление покупки**\n\n"
+            f"✅ Название: `{form.data['name']}`\n"
+            f"✅ Цена: `{form.data['price']:,.0f}₽`\n"
+            f"✅ Магазин: `{message.text.strip()}`\n\n"
+            f"Шаг 4/6: Введи **ссылку или описание**",
+            fsm_nav_inline(show_skip=True),
+            form.data.get('form_message_id')
+        )
+        form.update(store=message.text.strip(), form_message_id=message_id)
+        form.set_state(AddPurchase.waiting_link_desc)
 
 
 @router.message(StateFilter(AddPurchase.waiting_link_desc))
 async def process_link_desc(message: types.Message, state: FSMContext):
     """Обработка описания"""
-    data = await state.get_data()
-    await state.update_data(link_desc_text=message.text.strip())
-    message_id = await update_form_message(
-        message,
-        f"📝 **Добавление покупки**\n\n"
-        f"✅ Название: `{data['name']}`\n"
-        f"✅ Цена: `{data['price']:,.0f}₽`\n"
-        f"✅ Магазин: `{data['store']}`\n"
-        f"✅ Описание: `{message.text.strip()[:30]}...`\n\n"
-        f"Шаг 5/6: Отправь **фото вещи**\n\n"
-        f"📷 Только изображения!",
-        fsm_nav_inline(show_skip=True),
-        state
-    )
-    await state.update_data(form_message_id=message_id)
-    await state.set_state(AddPurchase.waiting_photo)
+    async with FormStep(state) as form:
+        message_id = await update_form_message(
+            message,
+            f"📝 **Добавление покупки**\n\n"
+            f"✅ Название: `{form.data['name']}`\n"
+            f"✅ Цена: `{form.data['price']:,.0f}₽`\n"
+            f"✅ Магазин: `{form.data['store']}`\n"
+            f"✅ Описание: `{message.text.strip()[:30]}...`\n\n"
+            f"Шаг 5/6: Отправь **фото вещи**\n\n"
+            f"📷 Только изображения!",
+            fsm_nav_inline(show_skip=True),
+            form.data.get('form_message_id')
+        )
+        form.update(link_desc_text=message.text.strip(), form_message_id=message_id)
+        form.set_state(AddPurchase.waiting_photo)
 
 
 @router.message(StateFilter(AddPurchase.waiting_delay))
-async def process_delay_text(message: types.Message, state: FSMContext, bot: Bot):
+async def process_delay_text(message: types.Message, state: FSMContext, bot: Bot, repo: PurchaseRepository,
+                             scheduler: ReminderScheduler):
     """Обработка ввода минут текстом"""
     try:
         minutes = int(message.text.strip())
@@ -178,22 +174,17 @@ async def process_delay_text(message: types.Message, state: FSMContext, bot: Bot
         return
 
     # Сохраняем покупку
-    data = await state.get_data()
-    from datetime import datetime, timedelta
-    remind_at = (datetime.now() + timedelta(minutes=minutes)).isoformat()
-
-    from config import DB_NAME
-    import aiosqlite
-
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute('''
-                         INSERT INTO purchases (user_id, name, price, store, link, description, photo_path, remind_at,
-                                                created_at)
-                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                         ''', (message.from_user.id, data['name'], data['price'], data['store'],
-                               data.get('link_desc_text'), data.get('link_desc_text'),
-                               data.get('photo_path'), remind_at, datetime.now().isoformat()))
-        await db.commit()
+    async with FormStep(state) as form:
+        data = form.data
+        now = int(time.time())
+        remind_at = now + minutes * 60
+
+        await repo.add(message.from_user.id, data['name'], data['price'], data['store'],
+                       data.get('link_desc_text'), data.get('link_desc_text'),
+                       data.get('photo_path'), remind_at, now, data.get('photo_file_id'))
+        scheduler.add(remind_at)
+        # Покупка уже в базе — форма сбрасывается, даже если сообщение ниже не обновится
+        form.clear()
 
     # Обновляем сообщение формы
     form_message_id = data.get('form_message_id')
@@ -214,32 +205,27 @@ async def process_delay_text(message: types.Message, state: FSMContext, bot: Bot
             pass
 
     await message.delete()
-    await state.clear()
 
 
 @router.message(StateFilter(AddPurchase.waiting_photo), F.photo)
-async def process_photo(message: types.Message, state: FSMContext, bot: Bot):
+async def process_photo(message: types.Message, state: FSMContext, bot: Bot, media: MediaStore):
     """Обработка фото"""
-    photo = message.photo[-1]
-    user_id = message.from_user.id
-    file = await bot.get_file(photo.file_id)
-    photo_path = f"photos/{user_id}_{photo.file_id}.jpg"
-    Path("photos").mkdir(exist_ok=True)
-    await bot.download_file(file.file_path, photo_path)
-    await state.update_data(photo_path=photo_path)
-
-    data = await state.get_data()
-    message_id = await update_form_message(
-        message,
-        f"📝 **Добавление покупки**\n\n"
-        f"✅ Название: `{data['name']}`\n"
-        f"✅ Цена: `{data['price']:,.0f}₽`\n"
-        f"✅ Магазин: `{data['store']}`\n"
-        f"✅ Фото: загружено\n\n"
-        f"Шаг 6/6: Выбери **задержку до напоминания**\n"
-        f"💡 Можно выбрать кнопкой или написать минуты (например: `30`)",
-        fsm_time_inline(),
-        state
-    )
-    await state.update_data(form_message_id=message_id)
-    await state.set_state(AddPurchase.waiting_delay)
+    # ✅ На диск — размер не больше IMAGE_MAX_SIDE (уменьшается и пережимается вне event loop),
+    # файл по содержимому: одинаковые фото хранятся один раз; с MEDIA_LAZY файл не качается вовсе
+    photo_path, photo_file_id = await media.capture(bot, message.photo)
+    # ✅ file_id уже есть у Telegram — при показе фото файл повторно не загружается
+    async with FormStep(state) as form:
+        message_id = await update_form_message(
+            message,
+            f"📝 **Добавление покупки**\n\n"
+            f"✅ Название: `{form.data['name']}`\n"
+            f"✅ Цена: `{form.data['price']:,.0f}₽`\n"
+            f"✅ Магазин: `{form.data['store']}`\n"
+            f"✅ Фото: загружено\n\n"
+            f"Шаг 6/6: Выбери **задержку до напоминания**\n"
+            f"💡 Можно выбрать кнопкой или написать минуты (например: `30`)",
+            fsm_time_inline(),
+            form.data.get('form_message_id')
+        )
+        form.update(photo_path=photo_path, photo_file_id=photo_file_id, form_message_id=message_id)
+        form.set_state(AddPurchase.waiting_delay)
@@ -1,23 +1,33 @@
-import aiosqlite
 from aiogram import types, F, Router
 from aiogram.fsm.context import FSMContext
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from utils import escape_md
-from config import DB_NAME
+from keyboards import pagination_row
+from utils import escape_md, parse_page_cursor
+from repository import PurchaseRepository
+from models import Status
+from config import LIST_PAGE_SIZE
 
 router = Router()
 
 # Обработчики inline-кнопок для открытия списков
 @router.callback_query(F.data.startswith("list_"))
-async def list_callback(callback: types.CallbackQuery, state: FSMContext):
-    """Открытие списка по статусу через inline кнопку"""
-    status = callback.data.split("_")[1]
-    await show_list(callback.message, status, state, is_callback=True)
+async def list_callback(callback: types.CallbackQuery, state: FSMContext, repo: PurchaseRepository):
+    """Открытие списка по статусу через inline кнопку (list_<статус>[_n|p_<id>])"""
+    parts = callback.data.split("_")
+    status = parts[1]
+    before, after = parse_page_cursor(parts)
+    await show_list(callback.message, status, state, repo, is_callback=True, before=before, after=after)
     await callback.answer()
 
-async def show_list(message: types.Message, status: str, state: FSMContext, is_callback: bool = False):
-    """Показ списка покупок по статусу"""
-    await state.update_data(last_list_status=status)
+async def render_list(repo: PurchaseRepository, user_id: int, status: str,
+                      before: int | None = None, after: int | None = None):
+    """Текст и клавиатура страницы списка (text, kb, last_before) — из кэша или базы"""
+    key = ('list', status, before, after)
+    version = await repo.data_version(user_id)
+    view = repo.cache.get(user_id, key, version)
+    if view is not None:
+        return view
+
     titles = {
         "pending": "📋 Ждут решения",
         "buy": "✅ Куплено",
@@ -25,12 +35,10 @@ async def show_list(message: types.Message, status: str, state: FSMContext, is_c
         "reject": "❌ Отказы"
     }
 
-    async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute(
-            'SELECT id, name, price, store FROM purchases WHERE user_id=? AND status=? ORDER BY id DESC LIMIT 8',
-            (message.from_user.id, status)
-        )
-        rows = await cursor.fetchall()
+    page = await repo.page(user_id, Status.from_slug(status), LIST_PAGE_SIZE, before=before, after=after)
+    rows = page.items
+    # Курсор, по которому «К списку» вернёт на эту же страницу
+    last_before = rows[0].id + 1 if rows and page.prev_cursor is not None else None
 
     if not rows:
         text = f"{titles[status]}\n\n📭 **Пусто**"
@@ -42,18 +50,30 @@ async def show_list(message: types.Message, status: str, state: FSMContext, is_c
     else:
         text = f"{titles[status]}:\n\n"
         for row in rows:
-            name = escape_md(row[1])
-            price = f"{row[2]:,.0f}₽"
-            store = escape_md(row[3])
+            name = escape_md(row.name)
+            price = f"{row.price:,.0f}₽"
+            store = escape_md(row.store)
             text += f"• {name} — {price} ({store})\n"
 
+        nav = pagination_row(f"list_{status}", page.prev_cursor, page.next_cursor)
         kb = InlineKeyboardMarkup(
             inline_keyboard=[
-                [InlineKeyboardButton(text=f"📦 {row[1][:20]}...", callback_data=f"open_{row[0]}")]
+                [InlineKeyboardButton(text=f"📦 {row.name[:20]}...", callback_data=f"open_{row.id}")]
                 for row in rows
-            ] + [[InlineKeyboardButton(text="🔙 Главное меню", callback_data="back_to_main")]]
+            ] + ([nav] if nav else []) + [[InlineKeyboardButton(text="🔙 Главное меню", callback_data="back_to_main")]]
         )
 
+    view = (text, kb, last_before)
+    repo.cache.set(user_id, key, view, version)
+    return view
+
+async def show_list(message: types.Message, status: str, state: FSMContext, repo: PurchaseRepository,
+                    is_callback: bool = False, before: int | None = None, after: int | None = None):
+    """Показ списка покупок по статусу"""
+    text, kb, last_before = await render_list(repo, message.chat.id, status, before, after)
+    # Запоминаем страницу, чтобы «К списку» вернул на неё же
+    await state.update_data(last_list_status=status, last_list_before=last_before)
+
     # Если вызвано через callback - редактируем, иначе - новое сообщение
     if is_callback:
         await message.edit_text(text, reply_markup=kb, parse_mode="Markdown")
@@ -61,9 +81,10 @@ async def show_list(message: types.Message, status: str, state: FSMContext, is_c
         await message.answer(text, reply_markup=kb, parse_mode="Markdown")
 
 @router.callback_query(F.data == "back_to_list")
-async def back_to_list_callback(callback: types.CallbackQuery, state: FSMContext):
+async def back_to_list_callback(callback: types.CallbackQuery, state: FSMContext, repo: PurchaseRepository):
     """Возврат к списку покупок"""
     data = await state.get_data()
     last_status = data.get("last_list_status", "pending")
-    await show_list(callback.message, last_status, state, is_callback=True)
+    await show_list(callback.message, last_status, state, repo, is_callback=True,
+                    before=data.get("last_list_before"))
     await callback.answer()
@@ -1,91 +1,276 @@
 import asyncio
-import aiosqlite
-import os
-from datetime import datetime
+import random
+import time
 from aiogram import Bot, types, Router, F
-from config import DB_NAME
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from config import (SEND_PHOTO_WEIGHT, SEND_CONCURRENCY, WORKER_ID, REMINDER_LEASE_SECONDS, REMINDER_CLAIM_BATCH,
+                    REMINDER_DIGEST_WINDOW_SECONDS, REMINDER_DIGEST_MAX_ITEMS, RETRY_BASE_SECONDS,
+                    RETRY_MAX_DELAY_SECONDS, RETRY_MAX_ATTEMPTS, RETRY_INLINE_MAX_SECONDS, CATCHUP_LAG_SECONDS)
 from keyboards import main_inline_keyboard
+from repository import PurchaseRepository
+from scheduler import ReminderScheduler
+from ratelimit import RateLimiter
+from models import Status
+from media import exists, thumb_path
 
 router = Router()
 
+CAPTION_LIMIT = 1024  # предел подписи к фото в Telegram (у текста — 4096)
+DIGEST_FIELD_CHARS = 64  # название и магазин в строке сводки: 10 строк гарантированно влезают в сообщение
 
-async def check_reminders_loop(bot: Bot):
-    """Фоновая задача проверки напоминаний"""
+
+def reminder_message(p) -> tuple[str, types.InlineKeyboardMarkup]:
+    """Текст и клавиатура напоминания"""
+    text = (
+        f"⏰ **Напоминание о покупке!**\n\n"
+        f"📦 **{p.name}**\n"
+        f"💰 {p.price:,.0f}₽\n"
+        f"🏪 {p.store}\n"
+    )
+
+    if p.description:
+        text += f"📝 {p.description}\n"
+
+    if p.link:
+        text += f"🔗 [Ссылка]({p.link})\n"
+
+    text += "\n❓ Всё ещё хочешь купить?"
+
+    # Клавиатура
+    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+        [
+            types.InlineKeyboardButton(text="✅ Да, куплю", callback_data=f"buy_{p.id}"),
+            types.InlineKeyboardButton(text="❌ Нет, передумал", callback_data=f"cancel_{p.id}")
+        ]
+    ])
+    return text, keyboard
+
+
+async def send_reminder(bot: Bot, repo: PurchaseRepository, limiter: RateLimiter, p,
+                        catchup: bool = False) -> types.Message:
+    """Отправка одного напоминания с учётом лимитов (429 — пауза на retry_after и повтор)"""
+    text, keyboard = reminder_message(p)
+    # ✅ file_id, если фото уже было в Telegram, иначе файл с диска (если он есть)
+    has_photo = bool(p.photo_file_id) or await exists(p.photo_path)
+    chat_id = p.user_id
     while True:
+        await limiter.acquire(p.user_id, SEND_PHOTO_WEIGHT if has_photo else 1, catchup)
         try:
-            async with aiosqlite.connect(DB_NAME) as db:
-                now = datetime.now().isoformat()
-                cursor = await db.execute(
-                    'SELECT id, user_id, name, price, store, link, description, photo_path FROM purchases WHERE remind_at <= ? AND reminded = 0',
-                    (now,)
+            if has_photo:
+                message = await bot.send_photo(
+                    chat_id=p.user_id,
+                    photo=p.photo_file_id or types.FSInputFile(p.photo_path),
+                    caption=text,
+                    reply_markup=keyboard,
+                    parse_mode="Markdown"
                 )
-                purchases = await cursor.fetchall()
-
-                for p in purchases:
-                    purchase_id, user_id, name, price, store, link, desc, photo_path = p
-
-                    # Формируем текст напоминания
-                    text = (
-                        f"⏰ **Напоминание о покупке!**\n\n"
-                        f"📦 **{name}**\n"
-                        f"💰 {price:,.0f}₽\n"
-                        f"🏪 {store}\n"
-                    )
-
-                    if desc:
-                        text += f"📝 {desc}\n"
-
-                    if link:
-                        text += f"🔗 [Ссылка]({link})\n"
-
-                    text += "\n❓ Всё ещё хочешь купить?"
-
-                    # Клавиатура
-                    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-                        [
-                            types.InlineKeyboardButton(text="✅ Да, куплю", callback_data=f"buy_{purchase_id}"),
-                            types.InlineKeyboardButton(text="❌ Нет, передумал", callback_data=f"cancel_{purchase_id}")
-                        ]
-                    ])
-
-                    try:
-                        # ✅ Проверяем существование файла
-                        if photo_path and os.path.exists(photo_path):
-                            await bot.send_photo(
-                                chat_id=user_id,
-                                photo=types.FSInputFile(photo_path),
-                                caption=text,
-                                reply_markup=keyboard,
-                                parse_mode="Markdown"
-                            )
-                        else:
-                            await bot.send_message(
-                                chat_id=user_id,
-                                text=text,
-                                reply_markup=keyboard,
-                                parse_mode="Markdown"
-                            )
-
-                        # Отмечаем как отправленное
-                        await db.execute('UPDATE purchases SET reminded = 1 WHERE id = ?', (purchase_id,))
-                        await db.commit()
-                    except Exception as e:
-                        print(f"Ошибка отправки напоминания: {e}")
+                if not p.photo_file_id and message.photo:
+                    await repo.set_photo_file_id(p.id, p.user_id, message.photo[-1].file_id)
+                return message
+            return await bot.send_message(
+                chat_id=p.user_id,
+                text=text,
+                reply_markup=keyboard,
+                parse_mode="Markdown"
+            )
+        except TelegramRetryAfter as e:
+            limiter.pause(e.retry_after, chat_id)
+            if e.retry_after > RETRY_INLINE_MAX_SECONDS:
+                raise  # долгая пауза — повтор через retry_later, воркер не держим
+
+
+def digest_message(items: list) -> tuple[str, types.InlineKeyboardMarkup]:
+    """Текст и клавиатура сводки: по строке кнопок на каждую покупку"""
+    text = f"⏰ **Напоминание о покупках ({len(items)})!**\n\n"
+    rows = []
+    for number, p in enumerate(items, 1):
+        # Магазин (и у старых записей название) может быть NULL
+        name, store = p.name or "", p.store or ""
+        text += (f"{number}. 📦 **{name[:DIGEST_FIELD_CHARS]}** — 💰 {p.price:,.0f}₽, "
+                 f"🏪 {store[:DIGEST_FIELD_CHARS]}\n")
+        rows.append([
+            types.InlineKeyboardButton(text=f"✅ {number}. {name[:20]}", callback_data=f"dbuy_{p.id}"),
+            types.InlineKeyboardButton(text="❌ Передумал", callback_data=f"dcancel_{p.id}")
+        ])
+    text += "\n❓ Что из этого всё ещё хочешь купить?"
+    return text, types.InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+async def send_digest(bot: Bot, repo: PurchaseRepository, limiter: RateLimiter, items: list,
+                      catchup: bool = False) -> types.Message:
+    """Сводка напоминаний одного пользователя: фото одной media group + сообщение с кнопками"""
+    chat_id = items[0].user_id
+    photos = [p for p in items if p.photo_file_id or await exists(p.photo_path)]
+    # В альбоме сводки фото без file_id загружаются миниатюрой; её file_id не сохраняем — карточке нужно полное фото
+    thumbs = {p.id: thumb_path(p.photo_path) for p in photos
+              if not p.photo_file_id and await exists(thumb_path(p.photo_path))}
+    text, keyboard = digest_message(items)
+    while True:
+        try:
+            if len(photos) > 1:
+                await limiter.acquire(chat_id, SEND_PHOTO_WEIGHT, catchup)
+                sent = await bot.send_media_group(chat_id, [
+                    types.InputMediaPhoto(media=p.photo_file_id or types.FSInputFile(thumbs.get(p.id, p.photo_path)),
+                                          caption=(p.name or "")[:CAPTION_LIMIT])
+                    for p in photos
+                ])
+                for p, message in zip(photos, sent):
+                    if not p.photo_file_id and p.id not in thumbs and message.photo:
+                        await repo.set_photo_file_id(p.id, p.user_id, message.photo[-1].file_id)
+                photos = []  # при повторе после 429 фото уже отправлены
+            elif len(photos) == 1:
+                # Одно фото — подписью к нему идёт сама сводка, если влезает в CAPTION_LIMIT,
+                # иначе фото уходит с названием, а сводка — отдельным сообщением ниже
+                p = photos[0]
+                fits = len(text) <= CAPTION_LIMIT
+                caption = (dict(caption=text, reply_markup=keyboard, parse_mode="Markdown") if fits
+                           else dict(caption=(p.name or "")[:CAPTION_LIMIT]))
+                await limiter.acquire(chat_id, SEND_PHOTO_WEIGHT, catchup)
+                message = await bot.send_photo(chat_id, p.photo_file_id or types.FSInputFile(p.photo_path), **caption)
+                if not p.photo_file_id and message.photo:
+                    await repo.set_photo_file_id(p.id, p.user_id, message.photo[-1].file_id)
+                if fits:
+                    return message
+                photos = []  # при повторе после 429 фото уже отправлено
+            await limiter.acquire(chat_id, catchup=catchup)
+            return await bot.send_message(chat_id, text, reply_markup=keyboard, parse_mode="Markdown")
+        except TelegramRetryAfter as e:
+            limiter.pause(e.retry_after, chat_id)
+            if e.retry_after > RETRY_INLINE_MAX_SECONDS:
+                raise  # долгая пауза — повтор через retry_later, воркер не держим
+
+
+def backoff(attempts: int, retry_after: float = 0) -> int:
+    """Пауза перед следующей попыткой: экспонента с разбросом, но не меньше retry_after"""
+    delay = min(RETRY_BASE_SECONDS * 2 ** attempts, RETRY_MAX_DELAY_SECONDS)
+    return int(max(delay * random.uniform(0.5, 1), retry_after)) + 1
+
+
+async def handle_failure(repo: PurchaseRepository, scheduler: ReminderScheduler, items: list, error: Exception):
+    """Ошибка отправки: блокировка — пользователь неактивен, постоянная ошибка — dead letter, иначе повтор"""
+    now = int(time.time())
+    user_id = items[0].user_id
+    message = f"{type(error).__name__}: {error}"
+    if isinstance(error, TelegramForbiddenError) or (
+            isinstance(error, TelegramBadRequest) and "chat not found" in str(error).lower()):
+        stopped = await repo.deactivate_user(user_id, message, now)
+        print(f"⛔ Пользователь {user_id} недоступен, остановлено напоминаний: {stopped}")
+        return
+    for p in items:
+        if isinstance(error, TelegramBadRequest) or p.attempts + 1 >= RETRY_MAX_ATTEMPTS:
+            # Ошибка в самом сообщении не исправится повтором
+            await repo.dead_letter(p, message, now)
+            print(f"❌ Напоминание {p.id} в dead letters: {message}")
+            continue
+        next_at = now + backoff(p.attempts, getattr(error, 'retry_after', 0))
+        await repo.retry_later(p, next_at, message)
+        scheduler.add(next_at)
+
+
+def group_by_chat(purchases: list, max_items: int = REMINDER_DIGEST_MAX_ITEMS) -> list[list]:
+    """Пачка -> сводки по чатам (не больше max_items в каждой) в порядке round-robin:
+    сначала первая сводка каждого чата, потом вторая и т.д."""
+    by_chat = {}
+    for p in purchases:
+        by_chat.setdefault(p.user_id, []).append(p)
+    ranked = []
+    for items in by_chat.values():
+        for rank, start in enumerate(range(0, len(items), max_items)):
+            ranked.append((rank, items[start:start + max_items]))
+    return [items for _, items in sorted(ranked, key=lambda item: item[0])]
+
+
+async def dispatch_reminders(bot: Bot, repo: PurchaseRepository, scheduler: ReminderScheduler,
+                             limiter: RateLimiter, purchases: list, lease_until: int):
+    """Параллельная отправка захваченной пачки (SEND_CONCURRENCY воркеров, лимиты — в limiter).
+
+    Несколько напоминаний одного пользователя уходят одной сводкой.
+    После окончания аренды строку может перехватить другой процесс, поэтому такие
+    напоминания не отправляем — их доставит тот, кто захватит заново.
+    Опоздавшие больше чем на CATCHUP_LAG_SECONDS (простой бота) идут по лимиту догона.
+    Доставка «хотя бы один раз»: сбой между отправкой и complete_delivery даёт повтор после аренды.
+    При остановке бота начатые отправки дозавершаются, а аренда остальных снимается.
+    """
+    queue = asyncio.Queue()
+    for items in group_by_chat(purchases):
+        queue.put_nowait(items)
+
+    async def worker():
+        while not queue.empty() and not scheduler.stopping:
+            items = queue.get_nowait()
+            try:
+                if time.time() >= lease_until:
+                    continue
+                catchup = time.time() - items[0].remind_at > CATCHUP_LAG_SECONDS
+                if len(items) == 1:
+                    message = await send_reminder(bot, repo, limiter, items[0], catchup)
+                else:
+                    message = await send_digest(bot, repo, limiter, items, catchup)
+                # Подтверждения воркеров уходят в общие пачки записи
+                for p in items:
+                    await repo.complete_delivery(p, WORKER_ID, message.message_id, int(time.time()))
+            except Exception as e:
+                # Не-Telegram ошибки (сеть, файл фото, база) тоже идут на повтор с паузой и в dead letters
+                if not isinstance(e, TelegramAPIError):
+                    print(f"Ошибка отправки напоминания: {e}")
+                try:
+                    await handle_failure(repo, scheduler, items, e)
+                except Exception as err:
+                    print(f"Ошибка обработки неудачной отправки: {err}")
+
+    await asyncio.gather(*(worker() for _ in range(min(SEND_CONCURRENCY, queue.qsize()))))
+    limiter.prune()
+    if not queue.empty():
+        left = [p for _ in range(queue.qsize()) for p in queue.get_nowait()]
+        await repo.release_claims(left, WORKER_ID)
+        print(f"🧹 Остановка: возвращено неотправленных напоминаний: {len(left)}")
+
+
+async def check_reminders_loop(bot: Bot, repo: PurchaseRepository, scheduler: ReminderScheduler,
+                               limiter: RateLimiter | None = None):
+    """Фоновая задача отправки напоминаний (просыпается по сроку из ReminderScheduler).
+
+    Пачки захватываются с самых старых сроков; завершается после scheduler.stop(),
+    дослав уже начатое.
+    """
+    limiter = limiter or RateLimiter()
+    while not scheduler.stopping:
+        try:
+            now = await scheduler.wait_due()
+            if now is None:
+                break
+            while not scheduler.stopping:
+                lease_until = now + REMINDER_LEASE_SECONDS
+                purchases = await repo.claim_due(now, WORKER_ID, lease_until, REMINDER_CLAIM_BATCH,
+                                                 ahead=REMINDER_DIGEST_WINDOW_SECONDS)
+                if not purchases:
+                    break
+                lag = now - purchases[0].remind_at
+                if lag > CATCHUP_LAG_SECONDS:
+                    print(f"⏳ Догоняем просроченные напоминания: {len(purchases)} в пачке, "
+                          f"самое старое опоздало на {lag // 60} мин")
+                # Неотправленное из пачки вернётся по окончании аренды
+                scheduler.add(lease_until)
+                await dispatch_reminders(bot, repo, scheduler, limiter, purchases, lease_until)
+                now = int(time.time())
+
+            # Чужая аренда (в т.ч. упавшего процесса): проснуться, когда её можно перехватить
+            expiry = await repo.next_lease_expiry(now)
+            if expiry is not None:
+                scheduler.add(expiry)
 
         except Exception as e:
             print(f"Ошибка в check_reminders_loop: {e}")
-
-        await asyncio.sleep(10)  # Проверяем каждые 10 секунд
+            await asyncio.sleep(10)
+    print("✅ Отправка напоминаний остановлена")
 
 
 @router.callback_query(F.data.startswith("buy_"))
-async def buy_callback(callback: types.CallbackQuery):
+async def buy_callback(callback: types.CallbackQuery, repo: PurchaseRepository):
     """Пользователь купил"""
     purchase_id = int(callback.data.split("_")[1])
 
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute('UPDATE purchases SET status = "bought" WHERE id = ?', (purchase_id,))
-        await db.commit()
+    await repo.set_status(purchase_id, Status.BOUGHT, callback.from_user.id)
 
     # ✅ Проверяем тип сообщения
     if callback.message.photo:
@@ -103,13 +288,11 @@ async def buy_callback(callback: types.CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("cancel_"))
-async def cancel_callback(callback: types.CallbackQuery):
+async def cancel_callback(callback: types.CallbackQuery, repo: PurchaseRepository):
     """Пользователь передумал"""
     purchase_id = int(callback.data.split("_")[1])
 
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute('UPDATE purchases SET status = "cancelled" WHERE id = ?', (purchase_id,))
-        await db.commit()
+    await repo.set_status(purchase_id, Status.CANCELLED, callback.from_user.id)
 
     # ✅ Проверяем тип сообщения
     if callback.message.photo:
@@ -124,3 +307,24 @@ async def cancel_callback(callback: types.CallbackQuery):
         )
 
     await callback.answer("❌ Покупка отменена!")
+
+
+@router.callback_query(F.data.startswith("dbuy_") | F.data.startswith("dcancel_"))
+async def digest_item_callback(callback: types.CallbackQuery, repo: PurchaseRepository):
+    """Кнопка покупки в сводке: меняем статус и убираем её строку из клавиатуры"""
+    action, purchase_id = callback.data.split("_")
+    purchase_id = int(purchase_id)
+    bought = action == "dbuy"
+
+    await repo.set_status(purchase_id, Status.BOUGHT if bought else Status.CANCELLED, callback.from_user.id)
+
+    markup = callback.message.reply_markup
+    rows = [
+        row for row in (markup.inline_keyboard if markup else [])
+        if not any(button.callback_data in (f"dbuy_{purchase_id}", f"dcancel_{purchase_id}") for button in row)
+    ]
+    await callback.message.edit_reply_markup(
+        reply_markup=types.InlineKeyboardMarkup(inline_keyboard=rows) if rows else None
+    )
+
+    await callback.answer("✅ Покупка завершена!" if bought else "❌ Покупка отменена!")
@@ -1,23 +1,28 @@
-import os
-import aiosqlite
+import time
 from aiogram import types, F, Router
 from aiogram.filters import CommandStart, Command
 from aiogram.fsm.context import FSMContext
-from keyboards import main_inline_keyboard, main_keyboard
-from config import DB_NAME
+from keyboards import main_inline_keyboard, main_keyboard, paged_main_keyboard
+from fsm_storage import FormStep
+from repository import PurchaseRepository
+from scheduler import ReminderScheduler
+from models import Status
+from utils import parse_page_cursor
+from config import HISTORY_PAGE_SIZE
 
 router = Router()
 
 
 @router.message(CommandStart())
-async def cmd_start(message: types.Message, state: FSMContext):
+async def cmd_start(message: types.Message, state: FSMContext, repo: PurchaseRepository,
+                    scheduler: ReminderScheduler):
     """Команда /start"""
     await state.clear()
 
-    user_id = message.from_user.id
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute('INSERT OR IGNORE INTO users (user_id) VALUES (?)', (user_id,))
-        await db.commit()
+    # ✅ Вернувшемуся пользователю — остановленные напоминания снова в очередь
+    now = int(time.time())
+    if await repo.add_user(message.from_user.id, now):
+        scheduler.add(now)
 
     await message.answer(
         "🛒 **Бот импульсивных покупок**\n\n"
@@ -72,130 +77,87 @@ async def add_purchase_callback(callback: types.CallbackQuery, state: FSMContext
         parse_mode="Markdown"
     )
 
-    await state.update_data(form_message_id=callback.message.message_id)
-    await state.set_state(AddPurchase.waiting_name)
+    async with FormStep(state) as form:
+        form.update(form_message_id=callback.message.message_id)
+        form.set_state(AddPurchase.waiting_name)
     await callback.answer()
 
 
-@router.callback_query(F.data == "pending_purchases")
-async def pending_purchases_callback(callback: types.CallbackQuery):
-    """Покупки, ожидающие решения"""
-    user_id = callback.from_user.id
+# Экраны истории: callback-префикс -> (заголовок, текст при пустом списке, статус, только после напоминания)
+HISTORY_SCREENS = {
+    "pending_purchases": ("⏳ **Ждут решения**", "Нет покупок, ожидающих решения.", Status.PENDING, True),
+    "bought_purchases": ("✅ **Куплено**", "Нет купленных покупок.", Status.BOUGHT, False),
+    "cancelled_purchases": ("❌ **Отменено**", "Нет отмененных покупок.", Status.CANCELLED, False),
+}
+
 
-    async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute(
-            'SELECT id, name, price, store FROM purchases WHERE user_id = ? AND status = "pending" AND reminded = 1 ORDER BY created_at DESC',
-            (user_id,)
-        )
-        purchases = await cursor.fetchall()
+async def render_history(repo: PurchaseRepository, user_id: int, screen: str,
+                         before: int | None = None, after: int | None = None):
+    """Текст и клавиатура страницы истории (text, kb) — из кэша или базы"""
+    key = ('history', screen, before, after)
+    version = await repo.data_version(user_id)
+    view = repo.cache.get(user_id, key, version)
+    if view is not None:
+        return view
+
+    title, empty, status, reminded_only = HISTORY_SCREENS[screen]
+    page = await repo.page(user_id, status, HISTORY_PAGE_SIZE,
+                           before=before, after=after, reminded_only=reminded_only)
+    purchases = page.items
 
     if not purchases:
-        text = "⏳ **Ждут решения**\n\nНет покупок, ожидающих решения."
+        text = f"{title}\n\n{empty}"
     else:
-        text = "⏳ **Ждут решения**\n\n"
+        text = f"{title}\n\n"
         for p in purchases:
-            text += f"• **{p[1]}** — {p[2]:,.0f}₽ ({p[3]})\n"
-
-    await callback.message.edit_text(
-        text,
-        reply_markup=main_inline_keyboard(),
-        parse_mode="Markdown"
-    )
-    await callback.answer()
+            text += f"• **{p.name}** — {p.price:,.0f}₽ ({p.store})\n"
 
+    view = (text, paged_main_keyboard(screen, page.prev_cursor, page.next_cursor))
+    repo.cache.set(user_id, key, view, version)
+    return view
 
-@router.callback_query(F.data == "bought_purchases")
-async def bought_purchases_callback(callback: types.CallbackQuery):
-    """Купленные покупки"""
-    user_id = callback.from_user.id
 
-    async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute(
-            'SELECT id, name, price, store FROM purchases WHERE user_id = ? AND status = "bought" ORDER BY created_at DESC LIMIT 10',
-            (user_id,)
-        )
-        purchases = await cursor.fetchall()
-
-    if not purchases:
-        text = "✅ **Куплено**\n\nНет купленных покупок."
-    else:
-        text = "✅ **Куплено**\n\n"
-        for p in purchases:
-            text += f"• **{p[1]}** — {p[2]:,.0f}₽ ({p[3]})\n"
+async def show_history(callback: types.CallbackQuery, screen: str, repo: PurchaseRepository):
+    """Показ страницы истории (курсор — в хвосте callback_data)"""
+    before, after = parse_page_cursor(callback.data.split("_"))
+    text, kb = await render_history(repo, callback.from_user.id, screen, before, after)
 
     await callback.message.edit_text(
         text,
-        reply_markup=main_inline_keyboard(),
+        reply_markup=kb,
         parse_mode="Markdown"
     )
     await callback.answer()
 
 
-@router.callback_query(F.data == "cancelled_purchases")
-async def cancelled_purchases_callback(callback: types.CallbackQuery):
-    """Отмененные покупки"""
-    user_id = callback.from_user.id
+@router.callback_query(F.data.startswith("pending_purchases"))
+async def pending_purchases_callback(callback: types.CallbackQuery, repo: PurchaseRepository):
+    """Покупки, ожидающие решения"""
+    await show_history(callback, "pending_purchases", repo)
 
-    async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute(
-            'SELECT id, name, price, store FROM purchases WHERE user_id = ? AND status = "cancelled" ORDER BY created_at DESC LIMIT 10',
-            (user_id,)
-        )
-        purchases = await cursor.fetchall()
 
-    if not purchases:
-        text = "❌ **Отменено**\n\nНет отмененных покупок."
-    else:
-        text = "❌ **Отменено**\n\n"
-        for p in purchases:
-            text += f"• **{p[1]}** — {p[2]:,.0f}₽ ({p[3]})\n"
+@router.callback_query(F.data.startswith("bought_purchases"))
+async def bought_purchases_callback(callback: types.CallbackQuery, repo: PurchaseRepository):
+    """Купленные покупки"""
+    await show_history(callback, "bought_purchases", repo)
 
-    await callback.message.edit_text(
-        text,
-        reply_markup=main_inline_keyboard(),
-        parse_mode="Markdown"
-    )
-    await callback.answer()
+
+@router.callback_query(F.data.startswith("cancelled_purchases"))
+async def cancelled_purchases_callback(callback: types.CallbackQuery, repo: PurchaseRepository):
+    """Отмененные покупки"""
+    await show_history(callback, "cancelled_purchases", repo)
 
 
 @router.callback_query(F.data == "stats")
-async def stats_callback(callback: types.CallbackQuery):
+async def stats_callback(callback: types.CallbackQuery, repo: PurchaseRepository):
     """Статистика"""
-    user_id = callback.from_user.id
-
-    async with aiosqlite.connect(DB_NAME) as db:
-        # Общая сумма купленного
-        cursor = await db.execute(
-            'SELECT SUM(price) FROM purchases WHERE user_id = ? AND status = "bought"',
-            (user_id,)
-        )
-        total_bought = (await cursor.fetchone())[0] or 0
-
-        # Общая сумма отмененного
-        cursor = await db.execute(
-            'SELECT SUM(price) FROM purchases WHERE user_id = ? AND status = "cancelled"',
-            (user_id,)
-        )
-        total_cancelled = (await cursor.fetchone())[0] or 0
-
-        # Количество покупок
-        cursor = await db.execute(
-            'SELECT COUNT(*) FROM purchases WHERE user_id = ? AND status = "bought"',
-            (user_id,)
-        )
-        count_bought = (await cursor.fetchone())[0]
-
-        cursor = await db.execute(
-            'SELECT COUNT(*) FROM purchases WHERE user_id = ? AND status = "cancelled"',
-            (user_id,)
-        )
-        count_cancelled = (await cursor.fetchone())[0]
+    stats = await repo.stats(callback.from_user.id)
 
     text = (
         f"📊 **Статистика**\n\n"
-        f"✅ Куплено: {count_bought} шт. на {total_bought:,.0f}₽\n"
-        f"❌ Отменено: {count_cancelled} шт. на {total_cancelled:,.0f}₽\n\n"
-        f"💰 Сэкономлено: {total_cancelled:,.0f}₽"
+        f"✅ Куплено: {stats.count_bought} шт. на {stats.total_bought:,.0f}₽\n"
+        f"❌ Отменено: {stats.count_cancelled} шт. на {stats.total_cancelled:,.0f}₽\n\n"
+        f"💰 Сэкономлено: {stats.total_cancelled:,.0f}₽"
     )
 
     await callback.message.edit_text(
@@ -248,56 +210,39 @@ async def add_purchase_callback(callback: types.CallbackQuery, state: FSMContext
     )
 
     # ✅ Сохраняем ID сообщения формы
-    await state.update_data(form_message_id=callback.message.message_id)
-    await state.set_state(AddPurchase.waiting_name)
+    async with FormStep(state) as form:
+        form.update(form_message_id=callback.message.message_id)
+        form.set_state(AddPurchase.waiting_name)
     await callback.answer()
 
 
 @router.callback_query(F.data == "my_purchases")
-async def my_purchases_callback(callback: types.CallbackQuery):
+async def my_purchases_callback(callback: types.CallbackQuery, repo: PurchaseRepository):
     """Мои покупки"""
     user_id = callback.from_user.id
 
-    async with aiosqlite.connect(DB_NAME) as db:
-        # Ждут решения
-        cursor = await db.execute(
-            'SELECT id, name, price, store FROM purchases WHERE user_id = ? AND status = "pending" AND reminded = 1 ORDER BY created_at DESC',
-            (user_id,)
-        )
-        pending = await cursor.fetchall()
-
-        # Куплено
-        cursor = await db.execute(
-            'SELECT id, name, price, store FROM purchases WHERE user_id = ? AND status = "bought" ORDER BY created_at DESC LIMIT 5',
-            (user_id,)
-        )
-        bought = await cursor.fetchall()
-
-        # Отменено
-        cursor = await db.execute(
-            'SELECT id, name, price, store FROM purchases WHERE user_id = ? AND status = "cancelled" ORDER BY created_at DESC LIMIT 5',
-            (user_id,)
-        )
-        cancelled = await cursor.fetchall()
+    pending = (await repo.page(user_id, Status.PENDING, HISTORY_PAGE_SIZE, reminded_only=True)).items
+    bought = (await repo.page(user_id, Status.BOUGHT, 5)).items
+    cancelled = (await repo.page(user_id, Status.CANCELLED, 5)).items
 
     text = "📦 **Мои покупки**\n\n"
 
     if pending:
         text += "⏳ **Ждут решения:**\n"
         for p in pending:
-            text += f"• {p[1]} — {p[2]:,.0f}₽ ({p[3]})\n"
+            text += f"• {p.name} — {p.price:,.0f}₽ ({p.store})\n"
         text += "\n"
 
     if bought:
         text += "✅ **Куплено:**\n"
         for p in bought:
-            text += f"• {p[1]} — {p[2]:,.0f}₽\n"
+            text += f"• {p.name} — {p.price:,.0f}₽\n"
         text += "\n"
 
     if cancelled:
         text += "❌ **Отменено:**\n"
         for p in cancelled:
-            text += f"• {p[1]} — {p[2]:,.0f}₽\n"
+            text += f"• {p.name} — {p.price:,.0f}₽\n"
 
     if not pending and not bought and not cancelled:
         text += "У тебя пока нет покупок."
@@ -0,0 +1,106 @@
+import asyncio
+import contextlib
+import multiprocessing
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from config import IMAGE_MAX_SIDE, IMAGE_QUALITY, IMAGE_THUMB_SIDE, IMAGE_WORKERS
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # без Pillow фото сохраняются как есть, без миниатюр
+    Image = None
+
+# Декодирование и сжатие JPEG занимают CPU на десятки-сотни миллисекунд — это делают
+# отдельные процессы (spawn: форк процесса с потоками aiosqlite небезопасен),
+# event loop только ждёт результат.
+
+_pool = None
+
+
+def available() -> bool:
+    return Image is not None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(IMAGE_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+async def warm_up():
+    """Запуск процессов пула заранее: первый spawn с импортами занимает секунды"""
+    if Image is None:
+        return
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*(loop.run_in_executor(_get_pool(), os.getpid) for _ in range(IMAGE_WORKERS)))
+
+
+def shutdown():
+    """Остановка пула (при выходе бота)"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+
+
+def best_size(sizes: list, max_side: int = IMAGE_MAX_SIDE):
+    """PhotoSize для загрузки: самый крупный не больше max_side, иначе самый мелкий из больших"""
+    fitting = [s for s in sizes if max(s.width, s.height) <= max_side]
+    if fitting:
+        return max(fitting, key=lambda s: s.width * s.height)
+    return min(sizes, key=lambda s: s.width * s.height)
+
+
+def _normalize(source: str, target: str, thumb_target: str, max_side: int, quality: int,
+               thumb_side: int) -> str | None:
+    """В процессе пула: target — уменьшенная и пережатая копия, thumb_target — миниатюра.
+
+    Возвращает путь результата (target или source, если пережатие не уменьшило файл), None — не картинка.
+    """
+    try:
+        with Image.open(source) as original:
+            image = ImageOps.exif_transpose(original).convert('RGB')
+    except (OSError, Image.DecompressionBombError):
+        return None
+    resized = max(image.size) > max_side
+    full = image.copy()
+    full.thumbnail((max_side, max_side), Image.LANCZOS)
+    full.save(target, 'JPEG', quality=quality, optimize=True, progressive=True)
+    image.thumbnail((thumb_side, thumb_side), Image.LANCZOS)
+    image.save(thumb_target, 'JPEG', quality=quality, optimize=True)
+    if not resized and os.path.getsize(target) >= os.path.getsize(source):
+        return source
+    return target
+
+
+def _discard(*paths: str):
+    for path in paths:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+
+async def normalize(source: str, tmp_dir: str) -> tuple[str, str | None]:
+    """Обработка файла source в пуле: (путь фото, путь миниатюры или None).
+
+    Лишние файлы удаляются: остаётся либо source, либо его пережатая копия.
+    Без Pillow и для файлов, которые не удалось открыть, — (source, None).
+    """
+    if Image is None:
+        return source, None
+    name = uuid.uuid4().hex
+    target = os.path.join(tmp_dir, f'{name}.jpg')
+    thumb = os.path.join(tmp_dir, f'{name}.thumb.jpg')
+    loop = asyncio.get_running_loop()
+    try:
+        result = await loop.run_in_executor(_get_pool(), _normalize, source, target, thumb,
+                                            IMAGE_MAX_SIDE, IMAGE_QUALITY, IMAGE_THUMB_SIDE)
+    except Exception as e:
+        print(f"❌ Ошибка обработки фото: {e}")
+        result = None
+    if result is None:
+        await asyncio.to_thread(_discard, target, thumb)
+        return source, None
+    await asyncio.to_thread(_discard, target if result == source else source)
+    return result, thumb
@@ -22,6 +22,21 @@ def list_inline_keyboard():
         ]
     )
 
+def pagination_row(prefix: str, prev_cursor: int | None, next_cursor: int | None):
+    """Кнопки листания: курсор (id крайней строки) зашит в callback_data"""
+    row = []
+    if prev_cursor is not None:
+        row.append(InlineKeyboardButton(text="⬅️ Новее", callback_data=f"{prefix}_p_{prev_cursor}"))
+    if next_cursor is not None:
+        row.append(InlineKeyboardButton(text="Старше ➡️", callback_data=f"{prefix}_n_{next_cursor}"))
+    return row
+
+def paged_main_keyboard(prefix: str, prev_cursor: int | None, next_cursor: int | None):
+    """Главное меню + кнопки листания"""
+    row = pagination_row(prefix, prev_cursor, next_cursor)
+    menu = main_inline_keyboard().inline_keyboard
+    return InlineKeyboardMarkup(inline_keyboard=([row] if row else []) + menu)
+
 def card_actions_keyboard(purchase_id: int):
     """Inline кнопки для карточки товара"""
     return InlineKeyboardMarkup(
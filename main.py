@@ -1,37 +1,81 @@
 import asyncio
 import logging
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
-from config import BOT_TOKEN
-from handlers import start, menu, fsm_steps, blocks, reminders
-from database import init_db
+from config import BOT_TOKEN, SHUTDOWN_TIMEOUT_SECONDS
+from handlers import start, menu, fsm_steps, blocks, reminders, lists, cards, admin
+from sharding import ShardSet, init_shards
+from repository import PurchaseRepository
+from scheduler import ReminderScheduler
+from media import MediaStore
+from fsm_storage import SQLiteStorage
+import images
+from archive import archive_loop
+from maintenance import maintenance_loop
+from backup import backup_loop
+from photo_gc import photo_gc_loop
 
 logging.basicConfig(level=logging.INFO)
 
 bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+# ✅ Формы переживают перезапуск: состояние FSM в SQLite с отложенной записью
+storage = SQLiteStorage()
+dp = Dispatcher(storage=storage)
 
 
 async def main():
     """Запуск бота"""
-    await init_db()
+    # ✅ Один пул соединений на шард (по умолчанию один файл) на весь процесс
+    shards = await ShardSet().open()
+    await storage.open()
+    await init_shards(shards)
+    repo = PurchaseRepository(shards)
+    scheduler = ReminderScheduler(repo)
+    await scheduler.load()
+    media = MediaStore(repo)
 
     # Подключаем роутеры
+    dp.include_router(admin.router)
     dp.include_router(blocks.router)
     dp.include_router(start.router)
     dp.include_router(menu.router)
     dp.include_router(fsm_steps.router)
     dp.include_router(reminders.router)
+    dp.include_router(lists.router)
+    dp.include_router(cards.router)
 
     # ✅ Запускаем фоновую проверку напоминаний
-    asyncio.create_task(reminders.check_reminders_loop(bot))
+    reminder_task = asyncio.create_task(reminders.check_reminders_loop(bot, repo, scheduler))
+    background = [
+        # ✅ Перенос старых купленных/отменённых в архив
+        asyncio.create_task(archive_loop(repo)),
+        # ✅ Обслуживание базы (vacuum, статистика, checkpoint) ночью
+        asyncio.create_task(maintenance_loop(shards)),
+        # ✅ Снимки базы и фото без остановки бота
+        asyncio.create_task(backup_loop(shards, media, bot)),
+        # ✅ Удаление фото брошенных форм
+        asyncio.create_task(photo_gc_loop(repo, storage)),
+        # ✅ Процессы обработки фото стартуют заранее, а не на первом фото
+        asyncio.create_task(images.warm_up()),
+    ]
 
     print("✅ Бот запущен!")
 
     try:
-        await dp.start_polling(bot)
+        # Сессию бота закрываем сами после досылки напоминаний (иначе aiogram закроет её раньше)
+        await dp.start_polling(bot, repo=repo, scheduler=scheduler, media=media, close_bot_session=False)
     finally:
+        # ✅ Досылаем начатые напоминания (остальные возвращаются в очередь), потом гасим фоновые задачи
+        scheduler.stop()
+        try:
+            await asyncio.wait_for(reminder_task, SHUTDOWN_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            print("⛔ Напоминания не успели завершиться — их подхватят по окончании аренды")
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        images.shutdown()
         await bot.session.close()
+        await shards.close()
 
 
 if __name__ == '__main__':
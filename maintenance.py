@@ -0,0 +1,131 @@
+import asyncio
+import os
+import time
+from datetime import datetime
+from config import (DB_BUSY_TIMEOUT_MS, MAINTENANCE_WINDOW, MAINTENANCE_INTERVAL_SECONDS, MAINTENANCE_STEP_BUDGET_MS,
+                    MAINTENANCE_VACUUM_PAGES, MAINTENANCE_ANALYSIS_LIMIT, MAINTENANCE_ANALYZE_HOURS)
+from database import Database
+from sharding import ShardSet
+
+# Каждый шаг — серия коротких операций через Database.maintain: между ними проходят обычные записи,
+# а шаг прекращается, как только израсходован MAINTENANCE_STEP_BUDGET_MS.
+
+
+def in_window(now: datetime | None = None, window: str = MAINTENANCE_WINDOW) -> bool:
+    """Попадает ли текущий час в окно обслуживания"""
+    start, end = (int(hour) for hour in window.split('-'))
+    hour = (now or datetime.now()).hour
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+
+async def _pragma(db: Database, sql: str):
+    async def op(conn):
+        cursor = await conn.execute(sql)
+        return await cursor.fetchone()
+
+    return await db.maintain(op)
+
+
+async def incremental_vacuum(db: Database, budget: float) -> int:
+    """Возврат свободных страниц файлу порциями по MAINTENANCE_VACUUM_PAGES, байт освобождено"""
+    mode, = await _pragma(db, 'PRAGMA auto_vacuum')
+    if mode != 2:
+        return 0  # база создана без auto_vacuum=INCREMENTAL — см. manage.py vacuum
+    page_size, = await _pragma(db, 'PRAGMA page_size')
+    start_free, = await _pragma(db, 'PRAGMA freelist_count')
+    free = start_free
+    deadline = time.monotonic() + budget
+    while free and time.monotonic() < deadline:
+        # executescript: incremental_vacuum освобождает по странице на каждый шаг выполнения,
+        # а execute делает только один шаг
+        await db.maintain(lambda conn: conn.executescript(f'PRAGMA incremental_vacuum({MAINTENANCE_VACUUM_PAGES});'))
+        free, = await _pragma(db, 'PRAGMA freelist_count')
+    return (start_free - free) * page_size
+
+
+async def analyze(db: Database, budget: float) -> int:
+    """ANALYZE по таблицам с analysis_limit, число обработанных таблиц"""
+    tables = [row[0] for row in await db.fetchall(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+    )]
+    await _pragma(db, f'PRAGMA analysis_limit = {MAINTENANCE_ANALYSIS_LIMIT}')
+    deadline = time.monotonic() + budget
+    done = 0
+    for table in tables:
+        if time.monotonic() >= deadline:
+            break
+        await _pragma(db, f'ANALYZE "{table}"')
+        done += 1
+    await _pragma(db, 'PRAGMA optimize')
+    return done
+
+
+async def checkpoint(db: Database, budget: float) -> int:
+    """Перенос WAL в основной файл; если читатели не мешают — обрезка WAL, байт освобождено.
+
+    TRUNCATE ждёт читателей не дольше остатка бюджета (busy_timeout на время операции),
+    иначе он держал бы очередь записи шарда до DB_BUSY_TIMEOUT_MS.
+    """
+    wal_path = f'{db.path}-wal'
+    before = os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+    deadline = time.monotonic() + budget
+    busy, log_frames, checkpointed = await _pragma(db, 'PRAGMA wal_checkpoint(PASSIVE)')
+    left_ms = int((deadline - time.monotonic()) * 1000)
+    if not busy and log_frames == checkpointed and left_ms > 0:
+        async def op(conn):
+            await conn.execute(f'PRAGMA busy_timeout = {left_ms}')
+            try:
+                cursor = await conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+                return await cursor.fetchone()
+            finally:
+                await conn.execute(f'PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}')
+
+        await db.maintain(op)
+    after = os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+    return before - after
+
+
+class Maintenance:
+    """Обслуживание всех шардов: incremental vacuum, ANALYZE/optimize, checkpoint WAL"""
+
+    def __init__(self, shards: ShardSet, budget_ms: int = MAINTENANCE_STEP_BUDGET_MS):
+        self.shards = shards
+        self.budget = budget_ms / 1000
+        self._analyzed_at = {}  # path -> time.monotonic() последнего ANALYZE
+
+    async def run_once(self, force_analyze: bool = False):
+        """Один проход по шардам; шард с ожидающими записями пропускается"""
+        for db in self.shards:
+            if not db.idle:
+                print(f"🧹 {db.path}: есть ожидающие записи, обслуживание отложено")
+                continue
+            await self._step(db, "incremental_vacuum", incremental_vacuum(db, self.budget), "байт освобождено")
+            last = self._analyzed_at.get(db.path)
+            if force_analyze or last is None or time.monotonic() - last >= MAINTENANCE_ANALYZE_HOURS * 3600:
+                await self._step(db, "ANALYZE", analyze(db, self.budget), "таблиц")
+                self._analyzed_at[db.path] = time.monotonic()
+            await self._step(db, "checkpoint", checkpoint(db, self.budget), "байт WAL освобождено")
+
+    async def _step(self, db: Database, name: str, coro, unit: str):
+        started = time.monotonic()
+        try:
+            result = await coro
+        except Exception as e:
+            print(f"❌ {db.path}: {name} — ошибка: {e}")
+            return
+        print(f"🧹 {db.path}: {name} — {result} {unit} за {(time.monotonic() - started) * 1000:.0f} мс")
+
+
+async def maintenance_loop(shards: ShardSet):
+    """Фоновая задача обслуживания базы в окне низкой нагрузки"""
+    maintenance = Maintenance(shards)
+    while True:
+        await asyncio.sleep(MAINTENANCE_INTERVAL_SECONDS)
+        if not in_window():
+            continue
+        try:
+            await maintenance.run_once()
+        except Exception as e:
+            print(f"❌ Ошибка обслуживания базы: {e}")
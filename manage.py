@@ -0,0 +1,209 @@
+"""Служебные команды: python manage.py <команда>"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from aiogram import Bot
+from config import BOT_TOKEN, DB_SHARDS, BACKUP_DIR, PHOTOS_DIR, IMAGE_MAX_SIDE, IMAGE_QUALITY, IMAGE_THUMB_SIDE
+from database import Database
+from migrations import rebuild_user_stats, STATS_COLUMNS
+from repository import PurchaseRepository, QUERY_PLAN_CHECKS, full_scans
+from backup import snapshot
+from media import MediaStore, TMP_DIR, CACHE_DIR
+from fsm_storage import SQLiteStorage
+import photo_gc
+import images
+from maintenance import Maintenance
+from sharding import ShardSet, init_shards, rebalance
+
+
+async def check_plans(db: Database) -> bool:
+    """EXPLAIN QUERY PLAN для всех запросов репозитория, ошибка при полном скане таблицы"""
+    ok = True
+    async with db.read() as conn:
+        for sql, params in QUERY_PLAN_CHECKS:
+            cursor = await conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            details = [row[3] for row in await cursor.fetchall()]
+            scans = full_scans(details)
+            status = "❌" if scans else "✅"
+            print(f"{status} {' '.join(sql.split())}")
+            for detail in details:
+                print(f"     {detail}")
+            if scans:
+                ok = False
+    return ok
+
+
+async def check_stats(db: Database, fix: bool) -> bool:
+    """Сверка user_stats с purchases (с --fix — исправление расхождений)"""
+    diffs = await rebuild_user_stats(db, fix=fix)
+    for user_id, have, want in diffs:
+        changed = [
+            f"{column}: {old} -> {new}"
+            for column, old, new in zip(STATS_COLUMNS, have, want) if old != new
+        ]
+        print(f"❌ user_id={user_id}: {', '.join(changed)}")
+    if diffs:
+        print(f"{'✅ Исправлено' if fix else '❌ Расхождений'}: {len(diffs)}")
+    else:
+        print("✅ user_stats совпадает с purchases")
+    return fix or not diffs
+
+
+async def vacuum(db: Database):
+    """Полный VACUUM с переводом на auto_vacuum=INCREMENTAL (бот должен быть остановлен)"""
+
+    async def op(conn):
+        await conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        await conn.execute('VACUUM')
+
+    size = os.path.getsize(db.path)
+    await db.maintain(op)
+    print(f"✅ {db.path}: {size} -> {os.path.getsize(db.path)} байт, auto_vacuum=INCREMENTAL")
+
+
+async def dead_letters(shards: ShardSet, limit: int):
+    """Напоминания, отправка которых прекращена"""
+    repo = PurchaseRepository(shards)
+    rows = await repo.dead_letters(limit)
+    for purchase_id, user_id, name, reason, error, attempts, failed_at in rows:
+        when = datetime.fromtimestamp(failed_at).strftime('%Y-%m-%d %H:%M')
+        print(f"{when}  #{purchase_id} user_id={user_id} «{name}» {reason}, попыток {attempts}: {error}")
+    print(f"Всего: {await repo.dead_letter_count()}")
+
+
+async def backup_now(shards: ShardSet, backup_dir: str):
+    """Снимок; ленивые фото (только file_id) скачиваются через бота"""
+    bot = Bot(token=BOT_TOKEN)
+    try:
+        await snapshot(shards, backup_dir, MediaStore(PurchaseRepository(shards)), bot)
+    finally:
+        await bot.session.close()
+
+
+async def media_import(shards: ShardSet):
+    """Перенос старых фото в хранилище по содержимому"""
+    moved, duplicates = await MediaStore(PurchaseRepository(shards)).import_legacy()
+    print(f"✅ Перенесено фото: {moved}, из них дублей: {duplicates}")
+
+
+async def collect_photos(shards: ShardSet):
+    """Сборка мусора фото; фото незавершённых форм читаются из базы FSM (записанное ботом)"""
+    storage = await SQLiteStorage().open()
+    try:
+        print(photo_gc.report(await photo_gc.collect_once(PurchaseRepository(shards), storage=storage)))
+    finally:
+        await storage.close()
+
+
+async def bench_images(paths: list[str], limit: int):
+    """Обработка фото (images.py) на копиях файлов: сколько экономится диска и трафика на фото"""
+    if not images.available():
+        print("❌ Pillow не установлен — фото хранятся как есть")
+        return
+    if not paths:
+        paths = [
+            os.path.join(folder, name)
+            for folder, dirs, files in os.walk(PHOTOS_DIR) if os.path.basename(folder) not in (TMP_DIR, CACHE_DIR)
+            for name in files if not name.endswith('.thumb.jpg')
+        ]
+    paths = sorted(paths)[:limit]
+    print(f"IMAGE_MAX_SIDE={IMAGE_MAX_SIDE}, IMAGE_QUALITY={IMAGE_QUALITY}, IMAGE_THUMB_SIDE={IMAGE_THUMB_SIDE}")
+    total_original = total_stored = total_thumb = 0
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for path in paths:
+            source = os.path.join(tmp_dir, 'source')
+            shutil.copyfile(path, source)
+            started = time.perf_counter()
+            result, thumb = await images.normalize(source, tmp_dir)
+            elapsed = (time.perf_counter() - started) * 1000
+            original = os.path.getsize(path)
+            stored = os.path.getsize(result)
+            thumb_size = os.path.getsize(thumb) if thumb else stored
+            total_original += original
+            total_stored += stored
+            total_thumb += thumb_size
+            print(f"{path}: {original // 1024} -> {stored // 1024} КБ (миниатюра {thumb_size // 1024} КБ), "
+                  f"{elapsed:.0f} мс")
+            for name in os.listdir(tmp_dir):
+                os.remove(os.path.join(tmp_dir, name))
+    images.shutdown()
+    if paths:
+        count = len(paths)
+        print(f"✅ Фото: {count}, диск: {total_original // count // 1024} -> {total_stored // count // 1024} КБ "
+              f"на фото (−{100 - total_stored * 100 // max(total_original, 1)}%)")
+        print(f"   Трафик на фото: загрузка без file_id −{(total_original - total_stored) // count // 1024} КБ, "
+              f"в альбоме сводки −{(total_original - total_thumb) // count // 1024} КБ")
+
+
+async def run(args) -> int:
+    if args.command == 'rebalance':
+        await rebalance(args.old_shards, args.shards)
+        return 0
+    if args.command == 'bench-images':
+        await bench_images(args.paths, args.limit)
+        return 0
+
+    shards = await ShardSet().open()
+    try:
+        await init_shards(shards)
+        if args.command == 'snapshot':
+            await backup_now(shards, args.dir)
+            return 0
+        if args.command == 'dead-letters':
+            await dead_letters(shards, args.limit)
+            return 0
+        if args.command == 'photo-gc':
+            await collect_photos(shards)
+            return 0
+        if args.command == 'media-import':
+            await media_import(shards)
+            return 0
+        if args.command == 'maintenance':
+            await Maintenance(shards).run_once(force_analyze=True)
+            return 0
+        ok = True
+        for db in shards:
+            if len(shards) > 1:
+                print(f"— {db.path}")
+            if args.command == 'check-plans':
+                ok = await check_plans(db) and ok
+            elif args.command == 'check-stats':
+                ok = await check_stats(db, args.fix) and ok
+            elif args.command == 'vacuum':
+                await vacuum(db)
+        return 0 if ok else 1
+    finally:
+        await shards.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Служебные команды бота")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('check-plans', help="проверить, что запросы не сканируют таблицы целиком")
+    stats = commands.add_parser('check-stats', help="сверить user_stats с purchases")
+    stats.add_argument('--fix', action='store_true', help="пересчитать расходящиеся строки")
+    commands.add_parser('maintenance', help="обслуживание базы сейчас, без ожидания окна")
+    commands.add_parser('vacuum', help="полный VACUUM и включение incremental vacuum (бот остановлен)")
+    backup = commands.add_parser('snapshot', help="снимок базы и новых фото без остановки бота")
+    backup.add_argument('--dir', default=BACKUP_DIR, help="папка снимков (по умолчанию BACKUP_DIR)")
+    dead = commands.add_parser('dead-letters', help="напоминания, отправка которых прекращена")
+    dead.add_argument('--limit', type=int, default=50)
+    commands.add_parser('media-import', help="перенести старые photos/<user>_<file_id>.jpg в хранилище по содержимому")
+    commands.add_parser('photo-gc', help="удалить фото без ссылок (брошенные формы) старше MEDIA_GRACE_SECONDS")
+    bench = commands.add_parser('bench-images', help="замер обработки фото: экономия диска и трафика")
+    bench.add_argument('paths', nargs='*', help="файлы (по умолчанию — фото из PHOTOS_DIR)")
+    bench.add_argument('--limit', type=int, default=100)
+    balance = commands.add_parser('rebalance', help="перенести пользователей при смене числа шардов (бот остановлен)")
+    balance.add_argument('--from', dest='old_shards', type=int, required=True, help="прежнее число шардов (1 — DB_NAME)")
+    balance.add_argument('--to', dest='shards', type=int, default=DB_SHARDS, help="новое число шардов (по умолчанию DB_SHARDS)")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == '__main__':
+    main()
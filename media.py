@@ -0,0 +1,265 @@
+import asyncio
+import contextlib
+import hashlib
+import os
+import time
+import uuid
+from aiogram import Bot
+from collections import OrderedDict
+from config import PHOTOS_DIR, MEDIA_GRACE_SECONDS, MEDIA_LAZY, MEDIA_CACHE_MAX_MB, MEDIA_CHUNK_SIZE
+from repository import PurchaseRepository
+import images
+
+# Фото хранятся по содержимому: PHOTOS_DIR/ab/cd/<sha256>.jpg — два уровня по 256 папок,
+# чтобы в одной папке не копились сотни тысяч файлов. Одинаковые снимки лежат одним файлом,
+# ссылки на него считает таблица media_refs (триггеры на purchases и архиве, миграция 9).
+# Рядом лежит миниатюра <sha256>.thumb.jpg (см. images.py), она живёт и удаляется вместе с фото.
+# В ленивом режиме (MEDIA_LAZY) у новых покупок только file_id: отправки фото идут по нему, а байты
+# нужны только снимку (backup.py) — он берёт их через MediaCache (PHOTOS_DIR/cache), ограниченный
+# по размеру и без счётчика ссылок.
+# Вся работа с файлами — в потоках (asyncio.to_thread), event loop не ждёт диск.
+
+HASH_CHUNK_SIZE = 1024 * 1024
+TMP_DIR = 'tmp'  # недокачанные файлы, внутри PHOTOS_DIR (тот же диск — os.replace атомарен)
+CACHE_DIR = 'cache'
+
+
+def media_path(digest: str, root: str = PHOTOS_DIR) -> str:
+    return os.path.join(root, digest[:2], digest[2:4], f'{digest}.jpg')
+
+
+def cache_name(file_id: str) -> str:
+    """Имя файла ленивого фото (в MediaCache и в копии BACKUP_DIR/photos/lazy)"""
+    return hashlib.sha256(file_id.encode()).hexdigest()[:32] + '.jpg'
+
+
+def thumb_path(path: str) -> str:
+    return path[:-len('.jpg')] + '.thumb.jpg'
+
+
+def is_media_path(path: str, root: str = PHOTOS_DIR) -> bool:
+    """Путь из хранилища по содержимому (а не старое photos/<user>_<file_id>.jpg)"""
+    name = os.path.basename(path)
+    return path == media_path(name[:-len('.jpg')], root) and len(name) == 64 + len('.jpg')
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _store(source: str, root: str, keep_source: bool, thumb: str | None = None) -> str:
+    path = media_path(_hash_file(source), root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if thumb is not None:
+        if os.path.exists(thumb_path(path)):
+            os.remove(thumb)
+        else:
+            os.replace(thumb, thumb_path(path))
+    if os.path.exists(path):
+        # Такой снимок уже есть; свежий mtime защищает его от удаления на MEDIA_GRACE_SECONDS,
+        # пока покупка с ним ещё не сохранена
+        os.utime(path)
+        if not keep_source:
+            os.remove(source)
+    elif keep_source:
+        tmp = os.path.join(root, TMP_DIR, uuid.uuid4().hex)
+        with open(source, 'rb') as src, open(tmp, 'wb') as dst:
+            while chunk := src.read(HASH_CHUNK_SIZE):
+                dst.write(chunk)
+        os.replace(tmp, path)
+    else:
+        os.replace(source, path)
+    return path
+
+
+def _discard(path: str):
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(path)
+
+
+def _remove_unused(path: str, grace: float) -> bool:
+    try:
+        if time.time() - os.stat(path).st_mtime < grace:
+            return False
+        os.remove(path)
+    except FileNotFoundError:
+        return False
+    _discard(thumb_path(path))
+    return True
+
+
+async def exists(path: str | None) -> bool:
+    """os.path.exists вне event loop (None/'' — нет файла)"""
+    return bool(path) and await asyncio.to_thread(os.path.exists, path)
+
+
+def _scan_cache(folder: str) -> list[tuple[str, int]]:
+    """Файлы кэша (имя, размер) от давно не нужных к свежим; недокачанные удаляются"""
+    entries = []
+    with os.scandir(folder) as it:
+        for entry in it:
+            if not entry.is_file():
+                continue
+            if entry.name.endswith('.part'):
+                _discard(entry.path)
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, entry.name, stat.st_size))
+    return [(name, size) for _, name, size in sorted(entries)]
+
+
+def _touch(path: str) -> bool:
+    try:
+        os.utime(path)  # порядок LRU переживает перезапуск: при загрузке кэша сортируем по mtime
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def _remove_all(paths: list[str]):
+    for path in paths:
+        _discard(path)
+
+
+class MediaCache:
+    """LRU-кэш файлов Telegram на диске по file_id, суммарно не больше max_bytes.
+
+    Файл качается из Telegram кусками по chunk_size прямо в .part и переименовывается;
+    одновременные запросы одного file_id ждут одну загрузку.
+    """
+
+    def __init__(self, root: str = PHOTOS_DIR, max_bytes: int = MEDIA_CACHE_MAX_MB * 1024 * 1024,
+                 chunk_size: int = MEDIA_CHUNK_SIZE):
+        self.folder = os.path.join(root, CACHE_DIR)
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self._entries = None  # имя -> размер, от давно не нужных к свежим; читается с диска при первом обращении
+        self._size = 0
+        self._locks = {}  # имя -> asyncio.Lock на время загрузки
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.folder, exist_ok=True)
+
+    async def fetch(self, bot: Bot, file_id: str) -> str:
+        """Путь к файлу file_id (из кэша или загруженному сейчас)"""
+        if self._entries is None:
+            entries = await asyncio.to_thread(_scan_cache, self.folder)
+            if self._entries is None:
+                self._entries = OrderedDict(entries)
+                self._size = sum(self._entries.values())
+        name = cache_name(file_id)
+        path = os.path.join(self.folder, name)
+        lock = self._locks.setdefault(name, asyncio.Lock())
+        try:
+            async with lock:
+                if name in self._entries:
+                    if await asyncio.to_thread(_touch, path):
+                        self._entries.move_to_end(name)
+                        self.hits += 1
+                        return path
+                    self._size -= self._entries.pop(name)  # удалён снаружи — качаем заново
+                self.misses += 1
+                await self._download(bot, file_id, path)
+                return path
+        finally:
+            if not lock.locked():
+                self._locks.pop(name, None)
+
+    async def _download(self, bot: Bot, file_id: str, path: str):
+        file = await bot.get_file(file_id)
+        part = f'{path}.{uuid.uuid4().hex}.part'
+        try:
+            await bot.download_file(file.file_path, part, chunk_size=self.chunk_size)
+            await asyncio.to_thread(os.replace, part, path)
+        except BaseException:
+            await asyncio.to_thread(_discard, part)
+            raise
+        size = file.file_size or await asyncio.to_thread(os.path.getsize, path)
+        name = os.path.basename(path)
+        self._entries[name] = size
+        self._size += size
+        # Вытесняем давно не нужные; только что загруженный остаётся, даже если он один больше лимита
+        evicted = []
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            old, old_size = self._entries.popitem(last=False)
+            self._size -= old_size
+            evicted.append(os.path.join(self.folder, old))
+        if evicted:
+            self.evictions += len(evicted)
+            await asyncio.to_thread(_remove_all, evicted)
+
+    def stats(self) -> dict:
+        """Счётчики для подбора MEDIA_CACHE_MAX_MB"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries or ()),
+            "bytes": self._size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+class MediaStore:
+    """Хранилище фото покупок по sha256 содержимого со счётчиком ссылок в базе"""
+
+    def __init__(self, repo: PurchaseRepository, root: str = PHOTOS_DIR, grace: float = MEDIA_GRACE_SECONDS,
+                 lazy: bool = MEDIA_LAZY, cache: MediaCache | None = None):
+        self.repo = repo
+        self.root = root
+        self.grace = grace
+        self.lazy = lazy
+        self.cache = cache or MediaCache(root)
+        os.makedirs(os.path.join(root, TMP_DIR), exist_ok=True)
+
+    async def capture(self, bot: Bot, sizes: list) -> tuple[str | None, str]:
+        """Фото из сообщения: (photo_path, photo_file_id). В ленивом режиме файл не качается"""
+        file_id = sizes[-1].file_id
+        if self.lazy:
+            return None, file_id
+        return await self.download(bot, images.best_size(sizes).file_id), file_id
+
+    async def download(self, bot: Bot, file_id: str) -> str:
+        """Загрузка фото из Telegram, уменьшение и миниатюра (images.py), возвращает путь (для photo_path)"""
+        file = await bot.get_file(file_id)
+        tmp_dir = os.path.join(self.root, TMP_DIR)
+        tmp = os.path.join(tmp_dir, uuid.uuid4().hex)
+        thumb = None
+        try:
+            await bot.download_file(file.file_path, tmp)
+            tmp, thumb = await images.normalize(tmp, tmp_dir)
+            return await asyncio.to_thread(_store, tmp, self.root, False, thumb)
+        except BaseException:
+            await asyncio.to_thread(_discard, tmp)
+            if thumb is not None:
+                await asyncio.to_thread(_discard, thumb)
+            raise
+
+    async def put(self, source: str, keep_source: bool = True) -> str:
+        """Файл с диска в хранилище (копией или переносом), возвращает путь"""
+        return await asyncio.to_thread(_store, source, self.root, keep_source)
+
+    async def release(self, path: str | None) -> bool:
+        """После удаления покупки: файл удаляется, только если на него больше никто не ссылается"""
+        if not path or await self.repo.photo_refs(path):
+            return False
+        return await asyncio.to_thread(_remove_unused, path, self.grace)
+
+    async def import_legacy(self) -> tuple[int, int]:
+        """Перенос старых photos/<user>_<file_id>.jpg в хранилище: (перенесено, из них дублей)"""
+        legacy = [path for path in await self.repo.photo_paths() if not is_media_path(path, self.root)]
+        moves = []
+        for path in legacy:
+            if await exists(path):
+                moves.append((path, await self.put(path)))
+        await self.repo.move_photos(moves)
+        for old, _ in moves:
+            if not await self.repo.photo_refs(old):
+                await asyncio.to_thread(_discard, old)
+        return len(moves), len(moves) - len({new for _, new in moves})
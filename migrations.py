@@ -0,0 +1,580 @@
+import asyncio
+import time
+from datetime import datetime
+from config import MIGRATION_BATCH_SIZE, MIGRATION_BATCH_PAUSE_MS
+from models import Status
+
+# Миграции получают Database (см. database.py) и должны быть идемпотентны:
+# номер версии записывается в schema_version только после успешного завершения.
+
+
+async def _columns(db, table: str) -> list[str]:
+    rows = await db.fetchall(f"PRAGMA table_info({table})")
+    return [row[1] for row in rows]
+
+
+async def baseline(db):
+    """Таблицы users и purchases"""
+
+    async def op(conn):
+        # Таблица пользователей
+        await conn.execute('''
+                         CREATE TABLE IF NOT EXISTS users
+                         (
+                             id
+                             INTEGER
+                             PRIMARY
+                             KEY
+                             AUTOINCREMENT,
+                             user_id
+                             INTEGER
+                             UNIQUE
+                             NOT
+                             NULL,
+                             created_at
+                             TIMESTAMP
+                             DEFAULT
+                             CURRENT_TIMESTAMP
+                         )
+                         ''')
+
+        # Таблица покупок
+        await conn.execute('''
+                         CREATE TABLE IF NOT EXISTS purchases
+                         (
+                             id
+                             INTEGER
+                             PRIMARY
+                             KEY
+                             AUTOINCREMENT,
+                             user_id
+                             INTEGER
+                             NOT
+                             NULL,
+                             name
+                             TEXT
+                             NOT
+                             NULL,
+                             price
+                             REAL
+                             NOT
+                             NULL,
+                             store
+                             TEXT,
+                             link
+                             TEXT,
+                             description
+                             TEXT,
+                             photo_path
+                             TEXT,
+                             remind_at
+                             TIMESTAMP,
+                             reminded
+                             INTEGER
+                             DEFAULT
+                             0,
+                             status
+                             TEXT
+                             DEFAULT
+                             'pending',
+                             created_at
+                             TIMESTAMP
+                             DEFAULT
+                             CURRENT_TIMESTAMP,
+                             FOREIGN
+                             KEY
+                         (
+                             user_id
+                         ) REFERENCES users
+                         (
+                             user_id
+                         )
+                             )
+                         ''')
+
+        # ✅ Проверяем и добавляем отсутствующие столбцы
+        cursor = await conn.execute("PRAGMA table_info(purchases)")
+        columns = [row[1] for row in await cursor.fetchall()]
+
+        if 'reminded' not in columns:
+            await conn.execute('ALTER TABLE purchases ADD COLUMN reminded INTEGER DEFAULT 0')
+            print("✅ Добавлен столбец 'reminded'")
+
+        if 'status' not in columns:
+            await conn.execute('ALTER TABLE purchases ADD COLUMN status TEXT DEFAULT "pending"')
+            print("✅ Добавлен столбец 'status'")
+
+    await db.write(op)
+
+
+async def hot_indexes(db):
+    """Индексы под горячие запросы"""
+
+    async def op(conn):
+        # Напоминания: remind_at <= ? AND reminded = 0
+        await conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_purchases_due ON purchases (remind_at) WHERE reminded = 0'
+        )
+        # Списки и статистика: user_id = ? AND status = ? ORDER BY created_at / id
+        await conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_purchases_user_status_created ON purchases (user_id, status, created_at)'
+        )
+        await conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_purchases_user_status_id ON purchases (user_id, status, id)'
+        )
+
+    await db.write(op)
+
+
+def _epoch(value) -> int | None:
+    """ISO-строка (локальное время, как писал datetime.now().isoformat()) -> секунды epoch"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        return int(datetime.fromisoformat(value).timestamp())
+    except ValueError:
+        return None
+
+
+def _status_code(value) -> int:
+    """Текстовый статус -> models.Status (неизвестные считаем pending)"""
+    if isinstance(value, int):
+        return value
+    try:
+        return int(Status.from_slug(value))
+    except KeyError:
+        return int(Status.PENDING)
+
+
+async def typed_columns(db):
+    """remind_at/created_at -> INTEGER epoch, status -> INTEGER (models.Status).
+
+    Новые столбцы заполняются пачками по MIGRATION_BATCH_SIZE строк (короткие транзакции),
+    затем старые столбцы переименовываются в *_legacy, а новые получают их имена.
+    """
+    columns = await _columns(db, 'purchases')
+    if 'status_legacy' in columns:
+        return
+
+    async def add_columns(conn):
+        definitions = {
+            'status_code': f'INTEGER NOT NULL DEFAULT {Status.PENDING:d}',
+            'remind_ts': 'INTEGER',
+            'created_ts': 'INTEGER',
+        }
+        for column, definition in definitions.items():
+            if column not in columns:
+                await conn.execute(f'ALTER TABLE purchases ADD COLUMN {column} {definition}')
+
+    await db.write(add_columns)
+
+    # Заполняем пачками по id, между пачками отдаём базу другим писателям
+    last_id = 0
+    total = 0
+    while True:
+        rows = await db.fetchall(
+            'SELECT id, status, remind_at, created_at FROM purchases WHERE id > ? ORDER BY id LIMIT ?',
+            (last_id, MIGRATION_BATCH_SIZE)
+        )
+        if not rows:
+            break
+        updates = []
+        for purchase_id, status, remind_at, created_at in rows:
+            updates.append((
+                _status_code(status),
+                _epoch(remind_at),
+                _epoch(created_at) or 0,
+                purchase_id,
+            ))
+
+        async def backfill(conn, updates=updates):
+            await conn.executemany(
+                'UPDATE purchases SET status_code = ?, remind_ts = ?, created_ts = ? WHERE id = ?',
+                updates
+            )
+
+        await db.write(backfill)
+        last_id = rows[-1][0]
+        total += len(rows)
+        await asyncio.sleep(MIGRATION_BATCH_PAUSE_MS / 1000)
+
+    async def swap_columns(conn):
+        for index in ('idx_purchases_due', 'idx_purchases_user_status_created', 'idx_purchases_user_status_id'):
+            await conn.execute(f'DROP INDEX IF EXISTS {index}')
+        for old, new in (('status', 'status_code'), ('remind_at', 'remind_ts'), ('created_at', 'created_ts')):
+            await conn.execute(f'ALTER TABLE purchases RENAME COLUMN {old} TO {old}_legacy')
+            await conn.execute(f'ALTER TABLE purchases RENAME COLUMN {new} TO {old}')
+
+    await db.write(swap_columns)
+    await hot_indexes(db)
+    print(f"✅ Перенесено в типизированные столбцы: {total} покупок")
+
+
+# ===== user_stats: агрегаты по пользователю, поддерживаются триггерами =====
+# Суммы хранятся в копейках (INTEGER), чтобы инкременты триггеров не копили ошибку REAL
+
+STATS_COLUMNS = [f'{status.name.lower()}_{kind}' for status in Status for kind in ('count', 'sum')]
+
+# Таблицы с покупками, из которых считается user_stats (архив — после миграции 5)
+STATS_SOURCE_TABLES = ('purchases', 'purchases_archive')
+
+
+def _user_stats_aggregate_sql(tables) -> str:
+    """Пересчёт агрегатов по диапазону user_id (параметры: low, high на каждую таблицу)"""
+    source = ' UNION ALL '.join(
+        f'SELECT user_id, status, price FROM {table} WHERE user_id >= ? AND user_id <= ?' for table in tables
+    )
+    sums = ', '.join(
+        f'SUM(status = {status:d}), SUM(CASE WHEN status = {status:d} THEN CAST(ROUND(price * 100) AS INTEGER) ELSE 0 END)'
+        for status in Status
+    )
+    return f'SELECT user_id, {sums} FROM ({source}) GROUP BY user_id'
+
+
+def _stats_delta(row: str, sign: str) -> str:
+    """UPDATE user_stats для строки NEW/OLD: sign '+' или '-'"""
+    assignments = []
+    for status in Status:
+        name = status.name.lower()
+        assignments.append(f'{name}_count = {name}_count {sign} ({row}.status = {status:d})')
+        assignments.append(
+            f'{name}_sum = {name}_sum {sign} '
+            f'(CASE WHEN {row}.status = {status:d} THEN CAST(ROUND({row}.price * 100) AS INTEGER) ELSE 0 END)'
+        )
+    return f'UPDATE user_stats SET {", ".join(assignments)} WHERE user_id = {row}.user_id;'
+
+
+def _stats_triggers(table: str) -> list[str]:
+    ensure_new = 'INSERT INTO user_stats (user_id) VALUES (NEW.user_id) ON CONFLICT (user_id) DO NOTHING;'
+    return [
+        f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_stats_insert AFTER INSERT ON {table}
+            BEGIN {ensure_new} {_stats_delta('NEW', '+')} END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_stats_update AFTER UPDATE OF user_id, status, price ON {table}
+            BEGIN {_stats_delta('OLD', '-')} {ensure_new} {_stats_delta('NEW', '+')} END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_stats_delete AFTER DELETE ON {table}
+            BEGIN {_stats_delta('OLD', '-')} END''',
+    ]
+
+
+async def rebuild_user_stats(db, fix: bool = True) -> list[tuple]:
+    """Пересчёт user_stats из purchases (и архива) пачками пользователей.
+
+    Возвращает расхождения (user_id, в user_stats, пересчитано); при fix=True исправляет их.
+    Каждая пачка пересчитывается и записывается в одной транзакции писателя, поэтому
+    параллельные вставки (через триггеры) не теряются.
+    """
+    placeholders = ', '.join('?' * (len(STATS_COLUMNS) + 1))
+    existing = {row[0] for row in await db.fetchall("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    tables = [table for table in STATS_SOURCE_TABLES if table in existing]
+    aggregate_sql = _user_stats_aggregate_sql(tables)
+    users_sql = (
+        'SELECT user_id FROM ('
+        + ' UNION '.join(f'SELECT DISTINCT user_id FROM {table} WHERE user_id > ?' for table in tables)
+        + ') ORDER BY user_id LIMIT ?'
+    )
+
+    diffs = []
+    last_user = None
+    while True:
+        after_user = -2 ** 63 if last_user is None else last_user
+        rows = await db.fetchall(users_sql, (after_user,) * len(tables) + (MIGRATION_BATCH_SIZE,))
+        if not rows:
+            break
+        first_user, last_user = rows[0][0], rows[-1][0]
+
+        async def op(conn, low=first_user, high=last_user):
+            cursor = await conn.execute(aggregate_sql, (low, high) * len(tables))
+            expected = {row[0]: tuple(row[1:]) for row in await cursor.fetchall()}
+            cursor = await conn.execute(
+                f'SELECT user_id, {", ".join(STATS_COLUMNS)} FROM user_stats WHERE user_id >= ? AND user_id <= ?',
+                (low, high)
+            )
+            actual = {row[0]: tuple(row[1:]) for row in await cursor.fetchall()}
+            batch_diffs = []
+            for user_id in expected.keys() | actual.keys():
+                zero = (0,) * len(STATS_COLUMNS)
+                want, have = expected.get(user_id, zero), actual.get(user_id, zero)
+                if want != have:
+                    batch_diffs.append((user_id, have, want))
+            if fix and batch_diffs:
+                await conn.executemany(
+                    f'INSERT OR REPLACE INTO user_stats (user_id, {", ".join(STATS_COLUMNS)}) VALUES ({placeholders})',
+                    [(user_id, *want) for user_id, _, want in batch_diffs]
+                )
+            return batch_diffs
+
+        diffs.extend(await db.write(op))
+        await asyncio.sleep(MIGRATION_BATCH_PAUSE_MS / 1000)
+    return diffs
+
+
+async def user_stats(db):
+    """Таблица user_stats + триггеры на purchases + заполнение"""
+
+    async def op(conn):
+        columns = ',\n'.join(f'                {column} INTEGER NOT NULL DEFAULT 0' for column in STATS_COLUMNS)
+        await conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS user_stats (
+                user_id INTEGER PRIMARY KEY,
+{columns}
+            )
+        ''')
+        for trigger in _stats_triggers('purchases'):
+            await conn.execute(trigger)
+
+    await db.write(op)
+    await rebuild_user_stats(db)
+
+
+# ===== Холодный архив решённых покупок (см. archive.py) =====
+
+ARCHIVED_STATUSES = (Status.BOUGHT, Status.CANCELLED)
+ARCHIVED_STATUSES_SQL = ', '.join(f'{status:d}' for status in ARCHIVED_STATUSES)
+
+
+async def purchases_archive(db):
+    """Таблица purchases_archive с теми же столбцами и триггерами user_stats"""
+
+    async def op(conn):
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS purchases_archive (
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                price REAL NOT NULL,
+                store TEXT,
+                link TEXT,
+                description TEXT,
+                photo_path TEXT,
+                remind_at INTEGER,
+                reminded INTEGER NOT NULL DEFAULT 0,
+                status INTEGER NOT NULL,
+                created_at INTEGER
+            )
+        ''')
+        await conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_purchases_archive_user_status_id '
+            'ON purchases_archive (user_id, status, id)'
+        )
+        # Кандидаты на перенос: решённые покупки по возрасту
+        await conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_purchases_resolved '
+            f'ON purchases (created_at) WHERE status IN ({ARCHIVED_STATUSES_SQL})'
+        )
+        # Перенос = вставка в архив + удаление из purchases, в сумме user_stats не меняется
+        for trigger in _stats_triggers('purchases_archive'):
+            await conn.execute(trigger)
+
+    await db.write(op)
+
+
+# ===== Аренда напоминаний: несколько процессов делят отправку =====
+
+async def reminder_leases(db):
+    """claimed_by/lease_until в purchases и журнал доставок reminder_deliveries"""
+    columns = await _columns(db, 'purchases')
+
+    async def op(conn):
+        if 'claimed_by' not in columns:
+            await conn.execute('ALTER TABLE purchases ADD COLUMN claimed_by TEXT')
+        if 'lease_until' not in columns:
+            await conn.execute('ALTER TABLE purchases ADD COLUMN lease_until INTEGER')
+        # delivery_key = "<id>:<remind_at>" — запись об одной отправке
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS reminder_deliveries (
+                delivery_key TEXT PRIMARY KEY,
+                purchase_id INTEGER NOT NULL,
+                worker TEXT NOT NULL,
+                message_id INTEGER,
+                delivered_at INTEGER NOT NULL
+            )
+        ''')
+        await conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_reminder_deliveries_delivered ON reminder_deliveries (delivered_at)'
+        )
+
+    await db.write(op)
+
+
+async def photo_file_ids(db):
+    """photo_file_id: file_id фото в Telegram, чтобы не загружать файл повторно"""
+    for table in ('purchases', 'purchases_archive'):
+        if 'photo_file_id' in await _columns(db, table):
+            continue
+
+        async def op(conn, table=table):
+            await conn.execute(f'ALTER TABLE {table} ADD COLUMN photo_file_id TEXT')
+
+        await db.write(op)
+
+
+async def delivery_retries(db):
+    """Счётчик попыток, активность пользователя и dead letters напоминаний"""
+    purchases = await _columns(db, 'purchases')
+    archive = await _columns(db, 'purchases_archive')
+    users = await _columns(db, 'users')
+
+    async def op(conn):
+        if 'attempts' not in purchases:
+            await conn.execute('ALTER TABLE purchases ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0')
+        if 'last_error' not in purchases:
+            await conn.execute('ALTER TABLE purchases ADD COLUMN last_error TEXT')
+        if 'attempts' not in archive:
+            await conn.execute('ALTER TABLE purchases_archive ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0')
+        if 'active' not in users:
+            await conn.execute('ALTER TABLE users ADD COLUMN active INTEGER NOT NULL DEFAULT 1')
+        # reason: inactive — пользователь заблокировал бота (вернётся по /start), failed — исчерпаны попытки
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS reminder_dead_letters (
+                purchase_id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                reason TEXT NOT NULL,
+                error TEXT,
+                attempts INTEGER NOT NULL,
+                failed_at INTEGER NOT NULL
+            )
+        ''')
+        await conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_reminder_dead_letters_user ON reminder_dead_letters (user_id, reason)'
+        )
+        await conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_reminder_dead_letters_failed ON reminder_dead_letters (failed_at)'
+        )
+
+    await db.write(op)
+
+
+# ===== Фото по содержимому: счётчики ссылок (см. media.py) =====
+
+def _media_ref_triggers(table: str) -> list[str]:
+    increment = '''INSERT INTO media_refs (path, refs) SELECT NEW.photo_path, 1 WHERE NEW.photo_path IS NOT NULL
+                   ON CONFLICT (path) DO UPDATE SET refs = refs + 1;'''
+    decrement = '''UPDATE media_refs SET refs = refs - 1 WHERE path = OLD.photo_path;
+                   DELETE FROM media_refs WHERE path = OLD.photo_path AND refs <= 0;'''
+    return [
+        f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_media_insert AFTER INSERT ON {table}
+            BEGIN {increment} END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_media_update AFTER UPDATE OF photo_path ON {table}
+            WHEN OLD.photo_path IS NOT NEW.photo_path
+            BEGIN {decrement} {increment} END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_media_delete AFTER DELETE ON {table}
+            BEGIN {decrement} END''',
+    ]
+
+
+async def media_refs(db):
+    """media_refs: сколько покупок (с архивом) ссылается на файл фото; триггеры + заполнение"""
+
+    async def op(conn):
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS media_refs (
+                path TEXT PRIMARY KEY,
+                refs INTEGER NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        for table in ('purchases', 'purchases_archive'):
+            for trigger in _media_ref_triggers(table):
+                await conn.execute(trigger)
+        # Триггеры и заполнение в одной транзакции — вставки между ними не потеряются
+        await conn.execute('DELETE FROM media_refs')
+        await conn.execute('''
+            INSERT INTO media_refs (path, refs)
+            SELECT photo_path, COUNT(*) FROM (
+                SELECT photo_path FROM purchases UNION ALL SELECT photo_path FROM purchases_archive
+            ) WHERE photo_path IS NOT NULL GROUP BY photo_path
+        ''')
+
+    await db.write(op)
+
+
+# ===== Версии данных пользователя для RenderCache (см. cache.py) =====
+
+# Столбцы, от которых зависят карточки и списки (аренда, попытки и ошибки отправки — не в их числе)
+RENDERED_COLUMNS = ('user_id', 'name', 'price', 'store', 'link', 'description', 'photo_path', 'photo_file_id',
+                    'status', 'remind_at', 'reminded')
+
+
+def _bump_version(row: str) -> str:
+    return f'''INSERT INTO user_versions (user_id, version) VALUES ({row}.user_id, 1)
+               ON CONFLICT (user_id) DO UPDATE SET version = version + 1;'''
+
+
+def _version_triggers(table: str) -> list[str]:
+    return [
+        f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_version_insert AFTER INSERT ON {table}
+            BEGIN {_bump_version('NEW')} END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_version_update AFTER UPDATE OF {', '.join(RENDERED_COLUMNS)}
+            ON {table}
+            BEGIN {_bump_version('NEW')} END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_version_update_owner AFTER UPDATE OF user_id ON {table}
+            WHEN OLD.user_id IS NOT NEW.user_id
+            BEGIN {_bump_version('OLD')} END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_version_delete AFTER DELETE ON {table}
+            BEGIN {_bump_version('OLD')} END''',
+    ]
+
+
+async def user_versions(db):
+    """user_versions: счётчик изменений покупок пользователя от триггеров — растёт при любой записи,
+    в том числе из manage.py и других процессов"""
+
+    async def op(conn):
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS user_versions (
+                user_id INTEGER PRIMARY KEY,
+                version INTEGER NOT NULL
+            )
+        ''')
+        for table in ('purchases', 'purchases_archive'):
+            for trigger in _version_triggers(table):
+                await conn.execute(trigger)
+
+    await db.write(op)
+
+
+# (версия, описание, функция) — только добавлять в конец
+MIGRATIONS = [
+    (1, "Базовая схема", baseline),
+    (2, "Индексы горячих запросов", hot_indexes),
+    (3, "Типизированные remind_at/created_at/status", typed_columns),
+    (4, "Агрегаты user_stats на триггерах", user_stats),
+    (5, "Архив решённых покупок", purchases_archive),
+    (6, "Аренда напоминаний и журнал доставок", reminder_leases),
+    (7, "file_id фото в Telegram", photo_file_ids),
+    (8, "Повторы и dead letters напоминаний", delivery_retries),
+    (9, "Счётчики ссылок на фото", media_refs),
+    (10, "Версии данных пользователя", user_versions),
+]
+
+
+async def migrate(db):
+    """Применение недостающих миграций"""
+
+    async def create_version_table(conn):
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at INTEGER NOT NULL
+            )
+        ''')
+
+    await db.write(create_version_table)
+    row = await db.fetchone('SELECT MAX(version) FROM schema_version')
+    current = row[0] or 0
+
+    for version, name, migration in MIGRATIONS:
+        if version <= current:
+            continue
+        await migration(db)
+
+        async def record(conn, version=version, name=name):
+            await conn.execute(
+                'INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)',
+                (version, name, int(time.time()))
+            )
+
+        await db.write(record)
+        print(f"✅ Миграция {version}: {name}")
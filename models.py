@@ -0,0 +1,72 @@
+from enum import IntEnum
+
+
+class Status(IntEnum):
+    """Статус покупки (хранится в purchases.status как INTEGER)"""
+    PENDING = 0
+    BOUGHT = 1
+    WAIT = 2
+    CANCELLED = 3
+
+    @property
+    def slug(self) -> str:
+        """Короткое имя для callback_data"""
+        return _SLUGS[self]
+
+    @classmethod
+    def from_slug(cls, slug: str) -> "Status":
+        """Статус по строке (callback_data или старое текстовое значение)"""
+        return _BY_SLUG[slug]
+
+
+_SLUGS = {
+    Status.PENDING: "pending",
+    Status.BOUGHT: "buy",
+    Status.WAIT: "wait",
+    Status.CANCELLED: "reject",
+}
+
+# Старые текстовые значения: reminders.py писал bought/cancelled, cards.py — buy/reject
+_BY_SLUG = {
+    "pending": Status.PENDING,
+    "buy": Status.BOUGHT,
+    "bought": Status.BOUGHT,
+    "wait": Status.WAIT,
+    "reject": Status.CANCELLED,
+    "cancelled": Status.CANCELLED,
+}
+
+
+class _Row:
+    """Компактная строка результата (поля задаются через __slots__)"""
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class Purchase(_Row):
+    """Полная запись покупки"""
+    __slots__ = ('id', 'user_id', 'name', 'price', 'store', 'link', 'description',
+                 'photo_path', 'remind_at', 'reminded', 'status', 'created_at', 'photo_file_id',
+                 'attempts')
+
+
+class PurchaseBrief(_Row):
+    """Строка списка покупок"""
+    __slots__ = ('id', 'name', 'price', 'store')
+
+
+class UserStats(_Row):
+    """Статистика пользователя"""
+    __slots__ = ('count_bought', 'total_bought', 'count_cancelled', 'total_cancelled')
+
+
+class Page(_Row):
+    """Страница списка (keyset): id-курсоры соседних страниц или None"""
+    __slots__ = ('items', 'prev_cursor', 'next_cursor')
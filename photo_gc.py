@@ -0,0 +1,100 @@
+import asyncio
+import itertools
+import os
+import time
+from config import PHOTOS_DIR, MEDIA_GRACE_SECONDS, PHOTO_GC_INTERVAL_HOURS, PHOTO_GC_BATCH, PHOTO_GC_BATCH_PAUSE_MS
+from repository import PurchaseRepository
+from media import CACHE_DIR
+from fsm_storage import SQLiteStorage
+
+# Сирота — файл в PHOTOS_DIR, на который нет ссылки ни в media_refs, ни в photo_path незавершённой
+# формы (fsm_states и память SQLiteStorage): форму добавления бросили после загрузки фото (главное меню,
+# «назад») и её сессия истекла по FSM_SESSION_TTL_HOURS. Каталог обходится os.scandir по мере надобности,
+# ссылки проверяются пачками по PHOTO_GC_BATCH — ни список файлов, ни таблица целиком в памяти не держатся.
+# Фото форм читаются один раз за проход; загруженные позже моложе MEDIA_GRACE_SECONDS и не трогаются
+# (media.MediaStore освежает mtime при повторной загрузке).
+# cache/ не обходится — кэш ленивых фото ограничен по размеру сам.
+
+
+def _walk(root: str):
+    """(путь, размер, mtime) файлов root по мере обхода"""
+    folders = [root]
+    while folders:
+        folder = folders.pop()
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if not (folder == root and entry.name == CACHE_DIR):
+                        folders.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    stat = entry.stat()
+                    yield entry.path, stat.st_size, stat.st_mtime
+
+
+def _take(files, count: int) -> list:
+    return list(itertools.islice(files, count))
+
+
+def _owner(path: str) -> str:
+    """Миниатюра живёт, пока есть ссылка на её фото"""
+    return path[:-len('.thumb.jpg')] + '.jpg' if path.endswith('.thumb.jpg') else path
+
+
+def _remove(orphans: list[tuple[str, int]], grace: float) -> tuple[int, int]:
+    removed = freed = 0
+    for path, size in orphans:
+        try:
+            # mtime перепроверяется (файл могли загрузить заново, пока шла проверка ссылок);
+            # миниатюра остаётся, пока свежее её фото
+            if any(time.time() - os.stat(checked).st_mtime < grace for checked in {path, _owner(path)}
+                   if os.path.exists(checked)):
+                continue
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        removed += 1
+        freed += size
+    return removed, freed
+
+
+async def collect_once(repo: PurchaseRepository, root: str = PHOTOS_DIR, grace: float = MEDIA_GRACE_SECONDS,
+                       batch: int = PHOTO_GC_BATCH, storage: SQLiteStorage | None = None) -> dict:
+    """Один проход по PHOTOS_DIR: удаление сирот старше grace, возвращает отчёт"""
+    started = time.monotonic()
+    forms = await storage.photo_paths() if storage is not None else set()
+    files = _walk(root)
+    scanned = removed = freed = 0
+    while chunk := await asyncio.to_thread(_take, files, batch):
+        scanned += len(chunk)
+        cutoff = time.time() - grace
+        old = [(path, size) for path, size, mtime in chunk if mtime < cutoff]
+        if old:
+            referenced = forms | await repo.referenced_photos(sorted({_owner(path) for path, _ in old}))
+            orphans = [(path, size) for path, size in old if _owner(path) not in referenced]
+            if orphans:
+                count, size = await asyncio.to_thread(_remove, orphans, grace)
+                removed += count
+                freed += size
+        # Пауза между пачками, чтобы не занимать диск и читателей надолго
+        await asyncio.sleep(PHOTO_GC_BATCH_PAUSE_MS / 1000)
+    return {
+        "scanned": scanned,
+        "removed": removed,
+        "freed_bytes": freed,
+        "seconds": time.monotonic() - started,
+    }
+
+
+def report(result: dict) -> str:
+    return (f"🧹 Фото: проверено {result['scanned']}, удалено сирот {result['removed']} "
+            f"({result['freed_bytes'] / (1024 * 1024):.1f} МБ), {result['seconds']:.1f} с")
+
+
+async def photo_gc_loop(repo: PurchaseRepository, storage: SQLiteStorage):
+    """Фоновая задача: сборка мусора фото раз в PHOTO_GC_INTERVAL_HOURS"""
+    while True:
+        await asyncio.sleep(PHOTO_GC_INTERVAL_HOURS * 3600)
+        try:
+            print(report(await collect_once(repo, storage=storage)))
+        except Exception as e:
+            print(f"❌ Ошибка сборки мусора фото: {e}")
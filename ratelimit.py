@@ -0,0 +1,101 @@
+import asyncio
+import time
+from config import (SEND_RATE_GLOBAL, SEND_BURST_GLOBAL, SEND_RATE_CHAT, SEND_BURST_CHAT, CATCHUP_SHARE,
+                    SEND_FLOOD_CHATS, SEND_FLOOD_WINDOW_SECONDS)
+
+
+class TokenBucket:
+    """Маркерная корзина: rate маркеров в секунду, не больше capacity"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, weight: float, now: float) -> float:
+        """Сколько ждать, пока наберётся weight маркеров (0 — можно сейчас)"""
+        self._refill(now)
+        # Вес больше ёмкости корзины всё равно пропускаем, когда она полна
+        need = min(weight, self.capacity) - self.tokens
+        return max(0.0, need / self.rate)
+
+    def take(self, weight: float):
+        self.tokens -= weight
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class RateLimiter:
+    """Общая корзина бота + корзина на каждый чат; acquire ждёт обе.
+
+    Отправки догона (catchup=True) дополнительно ждут свою корзину на catchup_share
+    от общей скорости, чтобы старый хвост не съедал весь лимит.
+    429 сразу в flood_chats разных чатах за flood_window секунд означает общий лимит бота —
+    тогда на retry_after останавливаются все отправки.
+    """
+
+    def __init__(self, rate: float = SEND_RATE_GLOBAL, burst: float = SEND_BURST_GLOBAL,
+                 chat_rate: float = SEND_RATE_CHAT, chat_burst: float = SEND_BURST_CHAT,
+                 catchup_share: float = CATCHUP_SHARE, flood_chats: int = SEND_FLOOD_CHATS,
+                 flood_window: float = SEND_FLOOD_WINDOW_SECONDS):
+        self.global_bucket = TokenBucket(rate, burst)
+        self.catchup_bucket = TokenBucket(rate * catchup_share, burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._chats = {}  # chat_id -> TokenBucket
+        self._paused_until = 0.0
+        self.flood_chats = flood_chats
+        self.flood_window = flood_window
+        self._flooded = {}  # chat_id -> время последнего 429
+
+    async def acquire(self, chat_id: int, weight: float = 1, catchup: bool = False):
+        """Ожидание права отправить сообщение весом weight в чат chat_id"""
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        while True:
+            now = time.monotonic()
+            wait = max(self._paused_until - now, self.global_bucket.wait_time(weight, now),
+                       chat.wait_time(weight, now))
+            if catchup:
+                wait = max(wait, self.catchup_bucket.wait_time(weight, now))
+            if wait <= 0:
+                # Между проверкой и списанием нет await — другие задачи не вклинятся
+                self.global_bucket.take(weight)
+                chat.take(weight)
+                if catchup:
+                    self.catchup_bucket.take(weight)
+                return
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float, chat_id: int | None = None):
+        """Telegram ответил 429 (retry_after): останавливаем отправки в чат, без chat_id — все.
+
+        Если 429 за flood_window пришёл уже в flood_chats разных чатах, пауза тоже общая.
+        """
+        now = time.monotonic()
+        if chat_id is not None:
+            chat = self._chats.get(chat_id)
+            if chat is None:
+                chat = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            chat._refill(now)
+            chat.tokens = min(chat.tokens, 0) - seconds * chat.rate
+            self._flooded[chat_id] = now
+            self._flooded = {chat: at for chat, at in self._flooded.items() if now - at < self.flood_window}
+            if len(self._flooded) < self.flood_chats:
+                return
+            print(f"⏳ 429 в {len(self._flooded)} чатах за {self.flood_window:g} с — общая пауза {seconds} с")
+        self._paused_until = max(self._paused_until, now + seconds)
+
+    def prune(self):
+        """Удаление полных корзин чатов (они эквивалентны новым)"""
+        now = time.monotonic()
+        for chat_id in [chat_id for chat_id, bucket in self._chats.items() if bucket.full(now)]:
+            del self._chats[chat_id]
@@ -0,0 +1,497 @@
+import asyncio
+import json
+from database import Database
+from cache import RenderCache
+from sharding import ShardSet
+from migrations import ARCHIVED_STATUSES, ARCHIVED_STATUSES_SQL
+from models import Status, Purchase, PurchaseBrief, UserStats, Page
+
+
+PURCHASE_COLUMNS = ', '.join(Purchase.__slots__)
+BRIEF_COLUMNS = ', '.join(PurchaseBrief.__slots__)
+
+# ===== SQL =====
+
+SQL_ADD_USER = 'INSERT INTO users (user_id) VALUES (?) ON CONFLICT (user_id) DO UPDATE SET active = 1'
+SQL_DEACTIVATE_USER = 'INSERT INTO users (user_id, active) VALUES (?, 0) ON CONFLICT (user_id) DO UPDATE SET active = 0'
+SQL_GET = f'SELECT {PURCHASE_COLUMNS} FROM purchases WHERE id=? AND user_id=?'
+SQL_GET_ARCHIVED = f'SELECT {PURCHASE_COLUMNS} FROM purchases_archive WHERE id=? AND user_id=?'
+
+
+def _page_sql(reminded_only: bool, direction: str | None, table: str = 'purchases') -> str:
+    """Keyset-страница: before — старше курсора, after — новее курсора"""
+    sql = f'SELECT {BRIEF_COLUMNS} FROM {table} WHERE user_id = ? AND status = ?'
+    if reminded_only:
+        sql += ' AND reminded = 1'
+    if direction == 'before':
+        return sql + ' AND id < ? ORDER BY id DESC LIMIT ?'
+    if direction == 'after':
+        return sql + ' AND id > ? ORDER BY id ASC LIMIT ?'
+    return sql + ' ORDER BY id DESC LIMIT ?'
+
+
+def _archived_page_sql(reminded_only: bool, direction: str | None) -> str:
+    """Та же страница по purchases и purchases_archive (параметры горячей таблицы, архива и limit)"""
+    order = 'ASC' if direction == 'after' else 'DESC'
+    return (
+        f'SELECT * FROM ({_page_sql(reminded_only, direction)}) '
+        f'UNION ALL SELECT * FROM ({_page_sql(reminded_only, direction, "purchases_archive")}) '
+        f'ORDER BY id {order} LIMIT ?'
+    )
+
+
+# (reminded_only, direction, с архивом)
+SQL_PAGE = {
+    (reminded_only, direction, archived): (_archived_page_sql if archived else _page_sql)(reminded_only, direction)
+    for reminded_only in (False, True)
+    for direction in (None, 'before', 'after')
+    for archived in (False, True)
+}
+
+SQL_STATS = ('SELECT bought_count, bought_sum / 100.0, cancelled_count, cancelled_sum / 100.0 '
+             'FROM user_stats WHERE user_id = ?')
+SQL_UPCOMING = 'SELECT remind_at FROM purchases WHERE remind_at <= ? AND reminded = 0'
+SQL_INSERT = '''INSERT INTO purchases (user_id, name, price, store, link, description, photo_path, remind_at,
+                                     created_at, photo_file_id)
+              VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+SQL_SET_STATUS = 'UPDATE purchases SET status=? WHERE id=? AND user_id=?'
+SQL_SET_PHOTO_FILE_ID = 'UPDATE purchases SET photo_file_id=? WHERE id=? AND user_id=?'
+SQL_SET_PHOTO_FILE_ID_ARCHIVED = 'UPDATE purchases_archive SET photo_file_id=? WHERE id=? AND user_id=?'
+SQL_DELETE = 'DELETE FROM purchases WHERE id=? AND user_id=?'
+SQL_DELETE_ARCHIVED = 'DELETE FROM purchases_archive WHERE id=? AND user_id=?'
+
+# Архив: перенос пачки решённых покупок и возврат покупки обратно
+SQL_ARCHIVE_CANDIDATES = (f'SELECT id FROM purchases WHERE status IN ({ARCHIVED_STATUSES_SQL}) AND created_at < ? '
+                          'ORDER BY created_at LIMIT ?')
+SQL_ARCHIVE_COPY = (f'INSERT INTO purchases_archive ({PURCHASE_COLUMNS}) '
+                    f'SELECT {PURCHASE_COLUMNS} FROM purchases WHERE id = ?')
+SQL_ARCHIVE_REMOVE = 'DELETE FROM purchases WHERE id = ?'
+SQL_UNARCHIVE = (f'INSERT INTO purchases ({PURCHASE_COLUMNS}) '
+                 f'SELECT {PURCHASE_COLUMNS} FROM purchases_archive WHERE id=? AND user_id=?')
+
+# Напоминания: захват пачки с арендой (просроченная аренда перехватывается), подтверждение доставки
+# (доставка «хотя бы один раз» — см. complete_delivery)
+# Вместе с наступившими захватываются и ближайшие (до ahead) напоминания тех же пользователей — для сводки
+SQL_CLAIM = f'''UPDATE purchases SET claimed_by = ?, lease_until = ?
+               WHERE id IN (SELECT id FROM purchases
+                            WHERE remind_at <= ? AND reminded = 0 AND (lease_until IS NULL OR lease_until <= ?)
+                              AND user_id IN (SELECT user_id FROM purchases
+                                              WHERE remind_at <= ? AND reminded = 0
+                                                AND (lease_until IS NULL OR lease_until <= ?))
+                            ORDER BY remind_at LIMIT ?)
+               RETURNING {PURCHASE_COLUMNS}'''
+SQL_NEXT_LEASE_EXPIRY = 'SELECT MIN(lease_until) FROM purchases WHERE remind_at <= ? AND reminded = 0 AND lease_until > ?'
+SQL_RECORD_DELIVERY = '''INSERT OR IGNORE INTO reminder_deliveries (delivery_key, purchase_id, worker, message_id,
+                                                                   delivered_at)
+                         VALUES (?, ?, ?, ?, ?)'''
+SQL_COMPLETE = 'UPDATE purchases SET reminded = 1, claimed_by = NULL, lease_until = NULL WHERE id = ? AND remind_at = ?'
+SQL_RELEASE = '''UPDATE purchases SET claimed_by = NULL, lease_until = NULL
+                 WHERE id = ? AND remind_at = ? AND reminded = 0 AND claimed_by = ?'''
+SQL_PRUNE_DELIVERIES = 'DELETE FROM reminder_deliveries WHERE delivered_at < ?'
+
+# Неудачные отправки: повтор позже (remind_at сдвигается на момент следующей попытки) или dead letter
+REMINDED_DEAD = 2  # purchases.reminded: 0 — ждёт, 1 — отправлено, 2 — отправка прекращена
+SQL_RETRY = '''UPDATE purchases SET attempts = attempts + 1, remind_at = ?, last_error = ?,
+                                    claimed_by = NULL, lease_until = NULL
+               WHERE id = ? AND remind_at = ? AND reminded = 0'''
+SQL_DEAD_LETTER_INSERT = '''INSERT OR REPLACE INTO reminder_dead_letters (purchase_id, user_id, reason, error, attempts,
+                                                                         failed_at)
+                            SELECT id, user_id, ?, ?, attempts + 1, ? FROM purchases
+                            WHERE {where}'''
+SQL_DEAD_LETTER_MARK = f'''UPDATE purchases SET reminded = {REMINDED_DEAD}, attempts = attempts + 1, last_error = ?,
+                                             claimed_by = NULL, lease_until = NULL
+                          WHERE {{where}}'''
+DEAD_ONE = 'id = ? AND remind_at = ? AND reminded = 0'
+DEAD_USER = 'user_id = ? AND reminded = 0'
+SQL_REQUEUE_INACTIVE = f'''UPDATE purchases SET reminded = 0, attempts = 0, remind_at = MAX(remind_at, ?)
+                          WHERE user_id = ? AND reminded = {REMINDED_DEAD}
+                            AND id IN (SELECT purchase_id FROM reminder_dead_letters
+                                       WHERE user_id = ? AND reason = 'inactive')'''
+SQL_CLEAR_INACTIVE = "DELETE FROM reminder_dead_letters WHERE user_id = ? AND reason = 'inactive'"
+SQL_DEAD_LETTERS = '''SELECT d.purchase_id, d.user_id, p.name, d.reason, d.error, d.attempts, d.failed_at
+                      FROM reminder_dead_letters d LEFT JOIN purchases p ON p.id = d.purchase_id
+                      ORDER BY d.failed_at DESC LIMIT ?'''
+SQL_DEAD_LETTER_COUNT = 'SELECT COUNT(*) FROM reminder_dead_letters'
+
+# Версия данных пользователя для RenderCache (миграция 10, user_versions)
+SQL_USER_VERSION = 'SELECT version FROM user_versions WHERE user_id = ?'
+
+# Фото: ссылки на файлы считают триггеры (миграция 9, media_refs)
+SQL_PHOTO_REFS = 'SELECT refs FROM media_refs WHERE path = ?'
+SQL_PHOTO_PATHS = 'SELECT path FROM media_refs'
+SQL_PHOTOS_REFERENCED = 'SELECT path FROM media_refs WHERE path IN (SELECT value FROM json_each(?))'
+# Ленивые фото (только file_id) для снимка: проход по таблицам раз в BACKUP_INTERVAL_HOURS, не в QUERY_PLAN_CHECKS
+SQL_LAZY_PHOTOS = '''SELECT photo_file_id FROM purchases WHERE photo_path IS NULL AND photo_file_id IS NOT NULL
+                     UNION
+                     SELECT photo_file_id FROM purchases_archive WHERE photo_path IS NULL AND photo_file_id IS NOT NULL'''
+# Перенос старых файлов в хранилище по содержимому (manage.py media-import): один проход по таблице
+# на пачку переименований, поэтому без индекса по photo_path и не в QUERY_PLAN_CHECKS
+SQL_MOVE_PHOTOS = '''UPDATE {table} SET photo_path = moves.new
+                     FROM (SELECT json_extract(value, '$[0]') AS old, json_extract(value, '$[1]') AS new
+                           FROM json_each(?)) AS moves
+                     WHERE {table}.photo_path = moves.old'''
+
+
+def _page_params(user_id: int, status: Status, cursor: int | None, limit: int, archived: bool) -> tuple:
+    params = (user_id, status) + ((cursor,) if cursor is not None else ()) + (limit,)
+    return params * 2 + (limit,) if archived else params
+
+
+# Запросы с примерами параметров для проверки планов (manage.py check-plans, tests/test_query_plans.py)
+QUERY_PLAN_CHECKS = [
+    (SQL_GET, (1, 1)),
+    *[(sql, _page_params(1, Status.BOUGHT, 100 if direction else None, 8, archived))
+      for (_, direction, archived), sql in SQL_PAGE.items()],
+    (SQL_STATS, (1,)),
+    (SQL_UPCOMING, (0,)),
+    (SQL_SET_STATUS, (Status.BOUGHT, 1, 1)),
+    (SQL_SET_PHOTO_FILE_ID, ('file', 1, 1)),
+    (SQL_SET_PHOTO_FILE_ID_ARCHIVED, ('file', 1, 1)),
+    (SQL_DELETE, (1, 1)),
+    (SQL_GET_ARCHIVED, (1, 1)),
+    (SQL_DELETE_ARCHIVED, (1, 1)),
+    (SQL_ARCHIVE_CANDIDATES, (0, 500)),
+    (SQL_ARCHIVE_COPY, (1,)),
+    (SQL_ARCHIVE_REMOVE, (1,)),
+    (SQL_UNARCHIVE, (1, 1)),
+    (SQL_CLAIM, ('worker', 0, 60, 0, 0, 0, 500)),
+    (SQL_NEXT_LEASE_EXPIRY, (0, 0)),
+    (SQL_RECORD_DELIVERY, ('1:0', 1, 'worker', 1, 0)),
+    (SQL_COMPLETE, (1, 0)),
+    (SQL_RELEASE, (1, 0, 'worker')),
+    (SQL_PRUNE_DELIVERIES, (0,)),
+    (SQL_ADD_USER, (1,)),
+    (SQL_DEACTIVATE_USER, (1,)),
+    (SQL_RETRY, (0, 'error', 1, 0)),
+    (SQL_DEAD_LETTER_INSERT.format(where=DEAD_ONE), ('failed', 'error', 0, 1, 0)),
+    (SQL_DEAD_LETTER_INSERT.format(where=DEAD_USER), ('inactive', 'error', 0, 1)),
+    (SQL_DEAD_LETTER_MARK.format(where=DEAD_ONE), ('error', 1, 0)),
+    (SQL_DEAD_LETTER_MARK.format(where=DEAD_USER), ('error', 1)),
+    (SQL_REQUEUE_INACTIVE, (0, 1, 1)),
+    (SQL_CLEAR_INACTIVE, (1,)),
+    (SQL_DEAD_LETTERS, (20,)),
+    (SQL_USER_VERSION, (1,)),
+    (SQL_PHOTO_REFS, ('photos/ab/cd/abcd.jpg',)),
+    (SQL_PHOTOS_REFERENCED, ('["photos/ab/cd/abcd.jpg"]',)),
+]
+
+
+def full_scans(plan: list[str]) -> list[str]:
+    """Строки EXPLAIN QUERY PLAN с полным сканом таблицы.
+
+    SCAN (subquery-N) — проход по уже ограниченному LIMIT подзапросу, не по таблице;
+    SCAN json_each VIRTUAL TABLE — по списку из параметра.
+    """
+    return [detail for detail in plan
+            if detail.startswith('SCAN ') and not detail.startswith('SCAN (') and ' USING ' not in detail
+            and ' VIRTUAL TABLE ' not in detail]
+
+
+def delivery_key(purchase: Purchase) -> str:
+    """Ключ журнала доставок: одна запись на пару (покупка, срок)"""
+    return f'{purchase.id}:{purchase.remind_at}'
+
+
+class PurchaseRepository:
+    """Весь SQL по покупкам и пользователям.
+
+    Каждая запись сбрасывает затронутые записи RenderCache после COMMIT; записи из других процессов
+    кэш замечает по data_version.
+    Решённые покупки со временем переезжают в purchases_archive (archive_resolved);
+    чтение купленного/отменённого идёт по обеим таблицам, для вызывающего кода перенос незаметен.
+    Все данные пользователя лежат в одном шарде (ShardSet.for_user); по всем шардам ходят
+    только фоновые задачи (claim_due, archive_resolved).
+    """
+
+    def __init__(self, shards: ShardSet, cache: RenderCache | None = None):
+        self.shards = shards
+        self.cache = cache or RenderCache()
+
+    def _db(self, user_id: int) -> Database:
+        return self.shards.for_user(user_id)
+
+    # ===== ПОЛЬЗОВАТЕЛИ =====
+
+    async def add_user(self, user_id: int, now: int) -> int:
+        """Регистрация пользователя (если ещё нет) или его возвращение.
+
+        Напоминания, остановленные из-за блокировки бота, снова ставятся в очередь на now;
+        возвращает их число.
+        """
+
+        async def op(conn):
+            await conn.execute(SQL_ADD_USER, (user_id,))
+            cursor = await conn.execute(SQL_REQUEUE_INACTIVE, (now, user_id, user_id))
+            await conn.execute(SQL_CLEAR_INACTIVE, (user_id,))
+            return cursor.rowcount
+
+        requeued = await self._db(user_id).write(op)
+        if requeued:
+            self.cache.invalidate(user_id)
+        return requeued
+
+    async def deactivate_user(self, user_id: int, error: str, now: int) -> int:
+        """Пользователь недоступен (заблокировал бота): все его ждущие напоминания — в dead letters"""
+
+        async def op(conn):
+            await conn.execute(SQL_DEACTIVATE_USER, (user_id,))
+            await conn.execute(SQL_DEAD_LETTER_INSERT.format(where=DEAD_USER), ('inactive', error, now, user_id))
+            cursor = await conn.execute(SQL_DEAD_LETTER_MARK.format(where=DEAD_USER), (error, user_id))
+            return cursor.rowcount
+
+        stopped = await self._db(user_id).write(op)
+        self.cache.invalidate(user_id)
+        return stopped
+
+    # ===== ЧТЕНИЕ =====
+
+    async def data_version(self, user_id: int) -> int:
+        """Версия покупок пользователя в базе (для RenderCache); 0 — изменений ещё не было"""
+        row = await self._db(user_id).fetchone(SQL_USER_VERSION, (user_id,))
+        return row[0] if row else 0
+
+    async def get(self, purchase_id: int, user_id: int) -> Purchase | None:
+        """Покупка пользователя по ID"""
+        db = self._db(user_id)
+        row = await db.fetchone(SQL_GET, (purchase_id, user_id))
+        if row is None:
+            row = await db.fetchone(SQL_GET_ARCHIVED, (purchase_id, user_id))
+        return Purchase(*row) if row else None
+
+    async def page(self, user_id: int, status: Status, limit: int, before: int | None = None,
+                   after: int | None = None, reminded_only: bool = False) -> Page:
+        """Страница покупок со статусом (новые сверху), курсоры — id крайних строк"""
+        archived = status in ARCHIVED_STATUSES
+        db = self._db(user_id)
+        if after is not None:
+            rows = await db.fetchall(SQL_PAGE[(reminded_only, 'after', archived)],
+                                     _page_params(user_id, status, after, limit + 1, archived))
+            if not rows:
+                return await self.page(user_id, status, limit, reminded_only=reminded_only)
+            has_more = len(rows) > limit
+            items = [PurchaseBrief(*row) for row in reversed(rows[:limit])]
+            return Page(items, items[0].id if has_more else None, items[-1].id)
+
+        if before is not None:
+            rows = await db.fetchall(SQL_PAGE[(reminded_only, 'before', archived)],
+                                     _page_params(user_id, status, before, limit + 1, archived))
+            if not rows:
+                return await self.page(user_id, status, limit, reminded_only=reminded_only)
+        else:
+            rows = await db.fetchall(SQL_PAGE[(reminded_only, None, archived)],
+                                     _page_params(user_id, status, None, limit + 1, archived))
+        has_more = len(rows) > limit
+        items = [PurchaseBrief(*row) for row in rows[:limit]]
+        prev_cursor = items[0].id if before is not None and items else None
+        next_cursor = items[-1].id if has_more else None
+        return Page(items, prev_cursor, next_cursor)
+
+    async def stats(self, user_id: int) -> UserStats:
+        """Количество и суммы купленного/отменённого (одна строка user_stats)"""
+        row = await self._db(user_id).fetchone(SQL_STATS, (user_id,))
+        return UserStats(*row) if row else UserStats(0, 0, 0, 0)
+
+    async def upcoming_reminders(self, until: int) -> list[int]:
+        """Сроки неотправленных напоминаний до until (для ReminderScheduler)"""
+        results = await asyncio.gather(*(db.fetchall(SQL_UPCOMING, (until,)) for db in self.shards))
+        return [row[0] for rows in results for row in rows]
+
+    # ===== ЗАПИСЬ =====
+
+    async def add(self, user_id: int, name: str, price: float, store: str, link: str | None,
+                  description: str | None, photo_path: str | None, remind_at: int, created_at: int,
+                  photo_file_id: str | None = None) -> int:
+        """Новая покупка, возвращает её ID"""
+
+        async def op(conn):
+            cursor = await conn.execute(
+                SQL_INSERT,
+                (user_id, name, price, store, link, description, photo_path, remind_at, created_at, photo_file_id)
+            )
+            return cursor.lastrowid
+
+        purchase_id = await self._db(user_id).write(op)
+        self.cache.invalidate(user_id)
+        return purchase_id
+
+    async def set_status(self, purchase_id: int, status: Status, user_id: int) -> bool:
+        """Смена статуса покупки (архивная возвращается в purchases)"""
+
+        async def op(conn):
+            cursor = await conn.execute(SQL_UNARCHIVE, (purchase_id, user_id))
+            if cursor.rowcount > 0:
+                await conn.execute(SQL_DELETE_ARCHIVED, (purchase_id, user_id))
+            cursor = await conn.execute(SQL_SET_STATUS, (status, purchase_id, user_id))
+            return cursor.rowcount > 0
+
+        changed = await self._db(user_id).write(op)
+        self.cache.invalidate(user_id, purchase_id)
+        return changed
+
+    # ===== НАПОМИНАНИЯ =====
+
+    async def claim_due(self, now: int, worker: str, lease_until: int, limit: int, ahead: int = 0) -> list[Purchase]:
+        """Захват до limit просроченных напоминаний в каждом шарде (шарды параллельно).
+
+        Один UPDATE ... RETURNING: два процесса не получат одну строку; строка с истёкшей
+        арендой (упавший процесс) захватывается снова. У пользователей, которым уже пора
+        напомнить, захватываются и напоминания со сроком до now + ahead.
+        Результат отсортирован по remind_at (RETURNING порядок не гарантирует): после простоя
+        первыми уходят самые старые.
+        """
+
+        async def op(conn):
+            cursor = await conn.execute(SQL_CLAIM, (worker, lease_until, now + ahead, now, now, now, limit))
+            return await cursor.fetchall()
+
+        results = await asyncio.gather(*(db.write(op) for db in self.shards))
+        return sorted((Purchase(*row) for rows in results for row in rows), key=lambda p: p.remind_at)
+
+    async def next_lease_expiry(self, now: int) -> int | None:
+        """Ближайшее окончание чужой аренды (когда её можно будет перехватить)"""
+        results = await asyncio.gather(*(db.fetchone(SQL_NEXT_LEASE_EXPIRY, (now, now)) for db in self.shards))
+        expiries = [row[0] for row in results if row[0] is not None]
+        return min(expiries) if expiries else None
+
+    async def complete_delivery(self, purchase: Purchase, worker: str, message_id: int | None, now: int):
+        """Запись в журнал доставок + снятие аренды одной транзакцией (повтор с тем же ключом ничего не меняет).
+
+        Доставка «хотя бы один раз»: если процесс упал между отправкой и этой записью, аренда истечёт
+        и напоминание уйдёт повторно.
+        """
+
+        async def op(conn):
+            await conn.execute(SQL_RECORD_DELIVERY, (delivery_key(purchase), purchase.id, worker, message_id, now))
+            await conn.execute(SQL_COMPLETE, (purchase.id, purchase.remind_at))
+
+        await self._db(purchase.user_id).write(op)
+        self.cache.invalidate(purchase.user_id, purchase.id)
+
+    async def release_claims(self, purchases: list[Purchase], worker: str):
+        """Возврат неотправленных захваченных напоминаний (остановка бота) — без ожидания конца аренды"""
+        by_db = {}
+        for p in purchases:
+            by_db.setdefault(self._db(p.user_id), []).append((p.id, p.remind_at, worker))
+
+        def release(params):
+            async def op(conn):
+                await conn.executemany(SQL_RELEASE, params)
+            return op
+
+        await asyncio.gather(*(db.write(release(params)) for db, params in by_db.items()))
+
+    async def retry_later(self, purchase: Purchase, next_at: int, error: str):
+        """Неудачная попытка: следующая в next_at, аренда снимается"""
+
+        async def op(conn):
+            await conn.execute(SQL_RETRY, (next_at, error, purchase.id, purchase.remind_at))
+
+        await self._db(purchase.user_id).write(op)
+
+    async def dead_letter(self, purchase: Purchase, error: str, now: int):
+        """Отправка прекращена (ошибка не пройдёт при повторе или попытки исчерпаны)"""
+
+        async def op(conn):
+            await conn.execute(SQL_DEAD_LETTER_INSERT.format(where=DEAD_ONE),
+                               ('failed', error, now, purchase.id, purchase.remind_at))
+            await conn.execute(SQL_DEAD_LETTER_MARK.format(where=DEAD_ONE), (error, purchase.id, purchase.remind_at))
+
+        await self._db(purchase.user_id).write(op)
+        self.cache.invalidate(purchase.user_id, purchase.id)
+
+    async def dead_letters(self, limit: int) -> list[tuple]:
+        """Последние dead letters со всех шардов:
+        (purchase_id, user_id, name, reason, error, attempts, failed_at)"""
+        results = await asyncio.gather(*(db.fetchall(SQL_DEAD_LETTERS, (limit,)) for db in self.shards))
+        rows = [row for rows in results for row in rows]
+        return sorted(rows, key=lambda row: row[6], reverse=True)[:limit]
+
+    async def dead_letter_count(self) -> int:
+        results = await asyncio.gather(*(db.fetchone(SQL_DEAD_LETTER_COUNT) for db in self.shards))
+        return sum(row[0] for row in results)
+
+    async def prune_deliveries(self, before: int) -> int:
+        """Удаление старых записей журнала доставок"""
+
+        async def op(conn):
+            cursor = await conn.execute(SQL_PRUNE_DELIVERIES, (before,))
+            return cursor.rowcount
+
+        return sum(await asyncio.gather(*(db.write(op) for db in self.shards)))
+
+    async def set_photo_file_id(self, purchase_id: int, user_id: int, file_id: str):
+        """Запоминаем file_id фото после первой загрузки файла в Telegram"""
+
+        async def op(conn):
+            for sql in (SQL_SET_PHOTO_FILE_ID, SQL_SET_PHOTO_FILE_ID_ARCHIVED):
+                await conn.execute(sql, (file_id, purchase_id, user_id))
+
+        await self._db(user_id).write(op)
+        self.cache.invalidate(user_id, purchase_id)
+
+    async def delete(self, purchase_id: int, user_id: int) -> Purchase | None:
+        """Удаление покупки, возвращает удалённую запись"""
+
+        async def op(conn):
+            for get_sql, delete_sql in ((SQL_GET, SQL_DELETE), (SQL_GET_ARCHIVED, SQL_DELETE_ARCHIVED)):
+                cursor = await conn.execute(get_sql, (purchase_id, user_id))
+                row = await cursor.fetchone()
+                if row:
+                    await conn.execute(delete_sql, (purchase_id, user_id))
+                    return Purchase(*row)
+            return None
+
+        deleted = await self._db(user_id).write(op)
+        self.cache.invalidate(user_id, purchase_id)
+        return deleted
+
+    # ===== ФОТО =====
+
+    async def photo_refs(self, path: str) -> int:
+        """Сколько покупок во всех шардах ссылается на файл (один файл может быть у разных пользователей)"""
+        results = await asyncio.gather(*(db.fetchone(SQL_PHOTO_REFS, (path,)) for db in self.shards))
+        return sum(row[0] for row in results if row)
+
+    async def referenced_photos(self, paths: list[str]) -> set[str]:
+        """Какие из paths есть в media_refs хотя бы одного шарда (пачка файлов сборщика мусора)"""
+        params = (json.dumps(paths),)
+        results = await asyncio.gather(*(db.fetchall(SQL_PHOTOS_REFERENCED, params) for db in self.shards))
+        return {row[0] for rows in results for row in rows}
+
+    async def photo_paths(self) -> set[str]:
+        """Все файлы, на которые есть ссылки"""
+        results = await asyncio.gather(*(db.fetchall(SQL_PHOTO_PATHS) for db in self.shards))
+        return {row[0] for rows in results for row in rows}
+
+    async def lazy_photos(self) -> set[str]:
+        """file_id фото, которых нет на диске (MEDIA_LAZY)"""
+        results = await asyncio.gather(*(db.fetchall(SQL_LAZY_PHOTOS) for db in self.shards))
+        return {row[0] for rows in results for row in rows}
+
+    async def move_photos(self, moves: list[tuple[str, str]]):
+        """Замена photo_path old -> new во всех шардах (счётчики ссылок переносят триггеры)"""
+        params = (json.dumps(moves),)
+
+        async def op(conn):
+            for table in ('purchases', 'purchases_archive'):
+                await conn.execute(SQL_MOVE_PHOTOS.format(table=table), params)
+
+        await asyncio.gather(*(db.write(op) for db in self.shards))
+
+    # ===== АРХИВ =====
+
+    async def archive_resolved(self, created_before: int, limit: int) -> int:
+        """Перенос пачки купленных/отменённых покупок, созданных раньше created_before, в архив.
+
+        Одна транзакция на пачку в каждом шарде (шарды параллельно); кэш не сбрасывается — содержимое карточек и страниц не меняется.
+        Возвращает число перенесённых строк (суммарно; меньше limit — значит, все шарды разобраны).
+        """
+
+        async def op(conn):
+            cursor = await conn.execute(SQL_ARCHIVE_CANDIDATES, (created_before, limit))
+            ids = [(row[0],) for row in await cursor.fetchall()]
+            await conn.executemany(SQL_ARCHIVE_COPY, ids)
+            await conn.executemany(SQL_ARCHIVE_REMOVE, ids)
+            return len(ids)
+
+        return sum(await asyncio.gather(*(db.write(op) for db in self.shards)))
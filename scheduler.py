@@ -0,0 +1,63 @@
+import asyncio
+import heapq
+import time
+from config import REMINDER_HORIZON_SECONDS
+from repository import PurchaseRepository
+
+
+class ReminderScheduler:
+    """Мин-куча ближайших remind_at: цикл напоминаний спит ровно до следующего срока.
+
+    Источник истины — база: куча хранит только моменты пробуждения, сами покупки
+    по наступлении срока захватываются через repo.claim_due. В памяти лежат сроки
+    до loaded_until (сейчас + REMINDER_HORIZON_SECONDS), по его наступлении куча перечитывается.
+    """
+
+    def __init__(self, repo: PurchaseRepository, horizon: int = REMINDER_HORIZON_SECONDS):
+        self.repo = repo
+        self.horizon = horizon
+        self._heap = []
+        self._loaded_until = 0
+        self._wakeup = asyncio.Event()
+        self.stopping = False
+
+    async def load(self, now: int | None = None):
+        """Загрузка сроков из базы (при старте и по достижении горизонта)"""
+        now = int(time.time()) if now is None else now
+        until = now + self.horizon
+        self._heap = await self.repo.upcoming_reminders(until)
+        heapq.heapify(self._heap)
+        self._loaded_until = until
+
+    def add(self, remind_at: int):
+        """Новый срок (из обработчиков добавления покупки)"""
+        if remind_at > self._loaded_until:
+            return  # попадёт в кучу при следующей загрузке
+        if not self._heap or remind_at < self._heap[0]:
+            self._wakeup.set()
+        heapq.heappush(self._heap, remind_at)
+
+    def stop(self):
+        """Остановка бота: wait_due вернёт None, отправка дозавершает начатое"""
+        self.stopping = True
+        self._wakeup.set()
+
+    async def wait_due(self) -> int | None:
+        """Ждёт ближайшего срока, возвращает текущее время (секунды epoch); None — бот останавливается"""
+        while True:
+            if self.stopping:
+                return None
+            now = int(time.time())
+            if now >= self._loaded_until:
+                await self.load(now)
+            if self._heap and self._heap[0] <= now:
+                while self._heap and self._heap[0] <= now:
+                    heapq.heappop(self._heap)
+                return now
+
+            deadline = self._heap[0] if self._heap else self._loaded_until
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), deadline - time.time())
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,182 @@
+import asyncio
+from config import DB_NAME, DB_SHARDS, DB_SHARD_PATH, MIGRATION_BATCH_SIZE, MIGRATION_BATCH_PAUSE_MS
+from database import Database, init_db
+from models import Purchase
+
+# Столбцы покупки без id: при переносе в другой шард id выдаёт AUTOINCREMENT шарда-получателя
+MOVED_COLUMNS = ', '.join(column for column in Purchase.__slots__ if column != 'id')
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """Jump consistent hash: номер корзины 0..buckets-1.
+
+    При росте числа корзин с N до N+1 переезжает только ~1/(N+1) ключей.
+    """
+    key &= 0xFFFFFFFFFFFFFFFF
+    bucket, jump = -1, 0
+    while jump < buckets:
+        bucket = jump
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        jump = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_paths(count: int = DB_SHARDS) -> list[str]:
+    """Файлы шардов; при count <= 1 — один DB_NAME"""
+    if count <= 1:
+        return [DB_NAME]
+    return [DB_SHARD_PATH.format(index=index) for index in range(count)]
+
+
+class ShardSet:
+    """Набор баз (по одному Database с писателем и читателями на файл), пользователь живёт в одном шарде"""
+
+    def __init__(self, paths: list[str] | None = None):
+        self.shards = [Database(path) for path in paths or shard_paths()]
+
+    def __len__(self):
+        return len(self.shards)
+
+    def __iter__(self):
+        return iter(self.shards)
+
+    def for_user(self, user_id: int) -> Database:
+        """Шард пользователя"""
+        if len(self.shards) == 1:
+            return self.shards[0]
+        return self.shards[jump_hash(user_id, len(self.shards))]
+
+    async def open(self):
+        """Открытие всех шардов"""
+        await asyncio.gather(*(db.open() for db in self.shards))
+        return self
+
+    async def close(self):
+        await asyncio.gather(*(db.close() for db in self.shards))
+
+
+async def init_shards(shards: ShardSet):
+    """Миграции на каждом шарде"""
+    for db in shards:
+        await init_db(db)
+
+
+# ===== Перебалансировка при смене числа шардов =====
+
+async def _shard_users(db: Database):
+    """user_id всех пользователей шарда, пачками"""
+    last_user = -2 ** 63
+    while True:
+        rows = await db.fetchall(
+            'SELECT user_id FROM (SELECT user_id FROM users UNION SELECT user_id FROM purchases '
+            'UNION SELECT user_id FROM purchases_archive) WHERE user_id > ? ORDER BY user_id LIMIT ?',
+            (last_user, MIGRATION_BATCH_SIZE)
+        )
+        if not rows:
+            return
+        last_user = rows[-1][0]
+        yield [row[0] for row in rows]
+
+
+def _key_range(purchase_id: int) -> tuple[str, str]:
+    """Границы delivery_key "<id>:<remind_at>" одной покупки (';' идёт в ASCII сразу за ':')"""
+    return f'{purchase_id}:', f'{purchase_id};'
+
+
+async def move_user(source: Database, target: Database, user_id: int) -> int:
+    """Перенос пользователя между шардами, возвращает число перенесённых покупок.
+
+    Сначала одной транзакцией пишем копию в target (предварительно удалив там остатки прерванного
+    переноса), затем одной транзакцией удаляем из source — повторный запуск после сбоя безопасен.
+    Покупки получают новые id в target; архивные возвращаются в purchases и уедут в архив снова
+    при следующем проходе archive_loop. user_stats в target пересчитывают триггеры.
+    Вместе с покупками переезжают флаг active, dead letters (по ним /start вернёт напоминания)
+    и журнал доставок — с новыми id покупок.
+    """
+    user_row = await source.fetchone('SELECT user_id, created_at, active FROM users WHERE user_id = ?', (user_id,))
+    rows = await source.fetchall(
+        f'SELECT id, {MOVED_COLUMNS} FROM purchases WHERE user_id = ? '
+        f'UNION ALL SELECT id, {MOVED_COLUMNS} FROM purchases_archive WHERE user_id = ? ORDER BY created_at',
+        (user_id, user_id)
+    )
+    dead_letters = await source.fetchall(
+        'SELECT purchase_id, user_id, reason, error, attempts, failed_at FROM reminder_dead_letters WHERE user_id = ?',
+        (user_id,)
+    )
+    deliveries = []
+    for row in rows:
+        deliveries += await source.fetchall(
+            'SELECT delivery_key, purchase_id, worker, message_id, delivered_at FROM reminder_deliveries '
+            'WHERE delivery_key >= ? AND delivery_key < ?', _key_range(row[0])
+        )
+    placeholders = ', '.join('?' * len(MOVED_COLUMNS.split(', ')))
+
+    async def copy(conn):
+        # Остатки прерванного переноса: покупки пользователя в target и их доставки
+        stale = await conn.execute_fetchall(
+            'SELECT id FROM purchases WHERE user_id = ? UNION ALL SELECT id FROM purchases_archive WHERE user_id = ?',
+            (user_id, user_id)
+        )
+        for (purchase_id,) in stale:
+            await conn.execute('DELETE FROM reminder_deliveries WHERE delivery_key >= ? AND delivery_key < ?',
+                               _key_range(purchase_id))
+        for table in ('purchases', 'purchases_archive', 'users', 'reminder_dead_letters'):
+            await conn.execute(f'DELETE FROM {table} WHERE user_id = ?', (user_id,))
+        if user_row:
+            await conn.execute('INSERT INTO users (user_id, created_at, active) VALUES (?, ?, ?)', user_row)
+        new_ids = {}
+        for row in rows:
+            cursor = await conn.execute(f'INSERT INTO purchases ({MOVED_COLUMNS}) VALUES ({placeholders})', row[1:])
+            new_ids[row[0]] = cursor.lastrowid
+        await conn.executemany(
+            'INSERT INTO reminder_dead_letters (purchase_id, user_id, reason, error, attempts, failed_at) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            [(new_ids[row[0]],) + tuple(row[1:]) for row in dead_letters if row[0] in new_ids]
+        )
+        await conn.executemany(
+            'INSERT OR REPLACE INTO reminder_deliveries (delivery_key, purchase_id, worker, message_id, delivered_at) '
+            'VALUES (?, ?, ?, ?, ?)',
+            [(f"{new_ids[row[1]]}:{row[0].split(':', 1)[1]}", new_ids[row[1]]) + tuple(row[2:])
+             for row in deliveries]
+        )
+
+    async def remove(conn):
+        for row in rows:
+            await conn.execute('DELETE FROM reminder_deliveries WHERE delivery_key >= ? AND delivery_key < ?',
+                               _key_range(row[0]))
+        for table in ('purchases', 'purchases_archive', 'users', 'user_stats', 'reminder_dead_letters'):
+            await conn.execute(f'DELETE FROM {table} WHERE user_id = ?', (user_id,))
+
+    await target.write(copy)
+    await source.write(remove)
+    return len(rows)
+
+
+async def rebalance(old_count: int, new_count: int = DB_SHARDS) -> tuple[int, int]:
+    """Перенос пользователей из old_count шардов в new_count (бот должен быть остановлен).
+
+    Возвращает (пользователей, покупок) перенесено.
+    """
+    old_paths, new_paths = shard_paths(old_count), shard_paths(new_count)
+    databases = {path: Database(path) for path in dict.fromkeys(old_paths + new_paths)}
+    for db in databases.values():
+        await db.open()
+        await init_db(db)
+
+    users = purchases = 0
+    try:
+        for source_path in old_paths:
+            source = databases[source_path]
+            async for batch in _shard_users(source):
+                for user_id in batch:
+                    target_path = new_paths[jump_hash(user_id, len(new_paths))]
+                    if target_path == source_path:
+                        continue
+                    purchases += await move_user(source, databases[target_path], user_id)
+                    users += 1
+                await asyncio.sleep(MIGRATION_BATCH_PAUSE_MS / 1000)
+            print(f"✅ {source_path} обработан, всего перенесено пользователей {users}, покупок {purchases}")
+    finally:
+        for db in databases.values():
+            await db.close()
+    return users, purchases
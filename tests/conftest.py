@@ -0,0 +1,30 @@
+import asyncio
+import os
+import sys
+import pytest
+
+# Модули бота лежат в корне репозитория; config.py требует BOT_TOKEN при импорте
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('BOT_TOKEN', '0:test')
+
+from repository import PurchaseRepository  # noqa: E402
+from sharding import ShardSet, init_shards  # noqa: E402
+
+
+@pytest.fixture
+def run():
+    """Запуск корутины теста в отдельном event loop"""
+    return asyncio.run
+
+
+@pytest.fixture
+def open_repo(tmp_path):
+    """Фабрика PurchaseRepository на свежих шардах в tmp_path (закрывать: await repo.shards.close())"""
+
+    async def open_repo(shards: int = 1) -> PurchaseRepository:
+        paths = [str(tmp_path / f'shard{index}.db') for index in range(shards)]
+        shard_set = await ShardSet(paths).open()
+        await init_shards(shard_set)
+        return PurchaseRepository(shard_set)
+
+    return open_repo
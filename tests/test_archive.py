@@ -0,0 +1,41 @@
+from models import Status
+
+NOW = 1_000_000
+
+
+def test_archive_and_unarchive_keep_the_purchase(run, open_repo):
+    async def scenario():
+        repo = await open_repo()
+        try:
+            bought = await repo.add(7, 'Кроссовки', 5000, 'Лавка', None, None, '/p/a.jpg', NOW, NOW - 100)
+            pending = await repo.add(7, 'Шарф', 300, 'Лавка', None, None, None, NOW, NOW - 100)
+            await repo.set_status(bought, Status.BOUGHT, 7)
+            stats_before = await repo.stats(7)
+
+            moved = await repo.archive_resolved(NOW, 10)
+            db = repo._db(7)
+            live = [row[0] for row in await db.fetchall('SELECT id FROM purchases')]
+            archived = [row[0] for row in await db.fetchall('SELECT id FROM purchases_archive')]
+            page = await repo.page(7, Status.BOUGHT, 10)
+            refs = await repo.photo_refs('/p/a.jpg')
+            stats_after = await repo.stats(7)
+
+            # Смена статуса возвращает покупку из архива
+            await repo.set_status(bought, Status.WAIT, 7)
+            restored = await repo.get(bought, 7)
+            left = await db.fetchall('SELECT id FROM purchases_archive')
+            return (bought, pending, moved, live, archived, [item.id for item in page.items], refs,
+                    stats_before, stats_after, restored, left)
+        finally:
+            await repo.shards.close()
+
+    (bought, pending, moved, live, archived, page, refs, stats_before, stats_after,
+     restored, left) = run(scenario())
+
+    assert moved == 1
+    assert (live, archived) == ([pending], [bought])
+    assert page == [bought]
+    assert refs == 1  # ссылка на фото у архивной строки сохраняется
+    assert repr(stats_after) == repr(stats_before)
+    assert (restored.id, restored.status, restored.photo_path) == (bought, Status.WAIT, '/p/a.jpg')
+    assert left == []
@@ -0,0 +1,77 @@
+import json
+from datetime import datetime, timedelta
+
+import backup
+from media import MediaStore, cache_name
+from test_media import FileBot
+
+
+def test_deleted_photo_leaves_backup_with_last_snapshot(run, open_repo, tmp_path, monkeypatch):
+    photos_root = tmp_path / 'photos'
+    backup_dir = tmp_path / 'backup'
+    (photos_root / 'ab' / 'cd').mkdir(parents=True)
+    (photos_root / 'ab' / 'cd' / 'a.jpg').write_bytes(b'a')
+    (photos_root / 'ab' / 'cd' / 'b.jpg').write_bytes(b'b')
+    monkeypatch.setattr(backup, 'PHOTOS_ROOT', photos_root)
+    monkeypatch.setattr(backup, 'BACKUP_KEEP', 2)
+
+    # Снимки в одну секунду попали бы в одну папку
+    clock = iter(datetime(2026, 1, 1) + timedelta(minutes=i) for i in range(10))
+    monkeypatch.setattr(backup, 'datetime', type('Clock', (), {'now': staticmethod(lambda: next(clock))}))
+
+    def copied():
+        return json.loads((backup_dir / 'photos-manifest.json').read_text())
+
+    async def scenario():
+        repo = await open_repo()
+        try:
+            await backup.snapshot(repo.shards, str(backup_dir))
+            assert set(copied()) == {'ab/cd/a.jpg', 'ab/cd/b.jpg'}
+
+            (photos_root / 'ab' / 'cd' / 'a.jpg').unlink()
+            await backup.snapshot(repo.shards, str(backup_dir))
+            # Первый снимок ещё хранится и ссылается на a.jpg
+            assert (backup_dir / 'photos' / 'ab' / 'cd' / 'a.jpg').exists()
+            assert 'ab/cd/a.jpg' in copied()
+
+            await backup.snapshot(repo.shards, str(backup_dir))
+            assert not (backup_dir / 'photos' / 'ab' / 'cd' / 'a.jpg').exists()
+            assert set(copied()) == {'ab/cd/b.jpg'}
+        finally:
+            await repo.shards.close()
+
+    run(scenario())
+
+
+def test_empty_photo_folders_are_removed(tmp_path):
+    (tmp_path / 'photos' / 'ab' / 'cd').mkdir(parents=True)
+    (tmp_path / 'photos' / 'ab' / 'cd' / 'a.jpg').write_bytes(b'a')
+    copied = {'ab/cd/a.jpg': [1, 0]}
+
+    assert backup._prune_photos(tmp_path, copied) == 1
+    assert copied == {}
+    assert list((tmp_path / 'photos').iterdir()) == []
+
+
+def test_lazy_photo_is_fetched_into_backup_once(run, open_repo, tmp_path, monkeypatch):
+    monkeypatch.setattr(backup, 'PHOTOS_ROOT', tmp_path / 'photos')
+    backup_dir = tmp_path / 'backup'
+    bot = FileBot()
+
+    async def scenario():
+        repo = await open_repo()
+        try:
+            media = MediaStore(repo, str(tmp_path / 'photos'), lazy=True)
+            await repo.add(7, 'Кроссовки', 5000, 'Лавка', None, None, None, 0, 0, 'lazy-photo')
+            first = await backup.snapshot(repo.shards, str(backup_dir), media, bot)
+            second = await backup.snapshot(repo.shards, str(backup_dir), media, bot)
+            return first, second
+        finally:
+            await repo.shards.close()
+
+    first, second = run(scenario())
+
+    name = f'lazy/{cache_name("lazy-photo")}'
+    assert (backup_dir / 'photos' / name).read_bytes() == b'lazy-photo'
+    assert len(bot.downloads) == 1
+    assert name in json.loads((second / 'manifest.json').read_text())['photos']
@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+
+from fsm_storage import FormStep, SQLiteStorage
+from states import AddPurchase
+
+KEY = StorageKey(bot_id=1, chat_id=7, user_id=7)
+
+
+def with_storage(run, tmp_path, scenario, **kwargs):
+    async def wrapper():
+        storage = await SQLiteStorage(str(tmp_path / 'fsm.db'), **kwargs).open()
+        try:
+            return await scenario(storage, FSMContext(storage=storage, key=KEY))
+        finally:
+            await storage.close()
+
+    return run(wrapper())
+
+
+def test_update_data_during_form_step_is_kept(run, tmp_path):
+    async def scenario(storage, state):
+        await state.update_data(name='Кроссовки')
+        step_entered = asyncio.Event()
+
+        async def step():
+            async with FormStep(state) as form:
+                step_entered.set()
+                await asyncio.sleep(0.01)  # шаг ждёт Telegram
+                form.update(price=5000)
+                form.set_state(AddPurchase.waiting_store)
+
+        async def card_opened():
+            await step_entered.wait()
+            await state.update_data(last_viewed_id=3)
+
+        await asyncio.gather(step(), card_opened())
+        return await storage.get_record(KEY)
+
+    state, data = with_storage(run, tmp_path, scenario)
+
+    assert state == AddPurchase.waiting_store.state
+    assert data == {'name': 'Кроссовки', 'price': 5000, 'last_viewed_id': 3}
+
+
+def test_failed_step_writes_nothing_and_clear_drops_everything(run, tmp_path):
+    async def scenario(storage, state):
+        await state.update_data(name='Кроссовки')
+        with pytest.raises(ValueError):
+            async with FormStep(state) as form:
+                form.update(price=5000)
+                raise ValueError('неверная цена')
+        failed = await storage.get_record(KEY)
+
+        async with FormStep(state) as form:
+            form.clear()
+        return failed, await storage.get_record(KEY)
+
+    failed, cleared = with_storage(run, tmp_path, scenario)
+
+    assert failed == (None, {'name': 'Кроссовки'})
+    assert cleared == (None, {})
+
+
+def test_flush_survives_restart_and_drops_empty_records(run, tmp_path):
+    async def write(storage, state):
+        await state.set_state(AddPurchase.waiting_price)
+        await state.update_data(name='Кроссовки')
+        await FSMContext(storage=storage, key=StorageKey(bot_id=1, chat_id=8, user_id=8)).update_data(name='Шарф')
+        assert await storage.flush() == 2
+        await state.clear()
+
+    async def read(storage, state):
+        other = FSMContext(storage=storage, key=StorageKey(bot_id=1, chat_id=8, user_id=8))
+        return await storage.get_record(KEY), await other.get_data(), (await storage.stats())['stored']
+
+    with_storage(run, tmp_path, write)
+    cleared, other, stored = with_storage(run, tmp_path, read)
+
+    assert cleared == (None, {})  # close() дописал очистку
+    assert other == {'name': 'Шарф'}
+    assert stored == 1
+
+
+def test_sweep_expires_abandoned_forms_and_evicts_idle(run, tmp_path):
+    async def scenario(storage, state):
+        await state.set_state(AddPurchase.waiting_price)
+        await state.update_data(name='Кроссовки')
+        await storage.flush()
+        storage.session_ttl = -1  # всё «брошено»
+        expired, _ = await storage.sweep()
+        return expired, await storage.get_record(KEY), (await storage.stats())['stored']
+
+    expired, record, stored = with_storage(run, tmp_path, scenario)
+
+    assert expired == 1
+    assert record == (None, {})
+    assert stored == 0
+
+
+def test_sweep_evicts_idle_sessions_to_the_database(run, tmp_path):
+    async def scenario(storage, state):
+        await state.update_data(name='Кроссовки')
+        await storage.flush()
+        _, evicted = await storage.sweep()
+        live = (await storage.stats())['live']
+        return evicted, live, await state.get_data()
+
+    evicted, live, data = with_storage(run, tmp_path, scenario, memory_ttl=-1)
+
+    assert (evicted, live) == (1, 0)
+    assert data == {'name': 'Кроссовки'}  # прочитано из базы заново
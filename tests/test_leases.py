@@ -0,0 +1,52 @@
+NOW = 1_000_000
+
+
+async def due_purchase(repo, user_id=7, remind_at=NOW - 10):
+    await repo.add_user(user_id, NOW)
+    return await repo.add(user_id, 'Кроссовки', 5000, 'Лавка', None, None, None, remind_at, NOW - 100)
+
+
+def test_lease_blocks_other_workers_until_it_expires(run, open_repo):
+    async def scenario():
+        repo = await open_repo()
+        try:
+            purchase_id = await due_purchase(repo)
+            first = await repo.claim_due(NOW, 'a', NOW + 60, 10)
+            during = await repo.claim_due(NOW + 30, 'b', NOW + 90, 10)
+            expiry = await repo.next_lease_expiry(NOW + 30)
+            # Процесс a упал — после конца аренды строку перехватывает b
+            after = await repo.claim_due(NOW + 61, 'b', NOW + 121, 10)
+            return purchase_id, first, during, expiry, after
+        finally:
+            await repo.shards.close()
+
+    purchase_id, first, during, expiry, after = run(scenario())
+
+    assert [p.id for p in first] == [purchase_id]
+    assert during == []
+    assert expiry == NOW + 60
+    assert [p.id for p in after] == [purchase_id]
+
+
+def test_release_and_complete(run, open_repo):
+    async def scenario():
+        repo = await open_repo()
+        try:
+            released_id = await due_purchase(repo, remind_at=NOW - 20)
+            delivered_id = await due_purchase(repo, remind_at=NOW - 10)
+            claimed = await repo.claim_due(NOW, 'a', NOW + 60, 10)
+            delivered = next(p for p in claimed if p.id == delivered_id)
+            await repo.complete_delivery(delivered, 'a', 42, NOW)
+            await repo.complete_delivery(delivered, 'a', 42, NOW)  # повтор ничего не меняет
+            await repo.release_claims([p for p in claimed if p.id == released_id], 'a')
+            again = await repo.claim_due(NOW + 1, 'b', NOW + 61, 10)
+            deliveries = await repo._db(7).fetchall('SELECT delivery_key, message_id FROM reminder_deliveries')
+            return released_id, again, deliveries, delivered
+        finally:
+            await repo.shards.close()
+
+    released_id, again, deliveries, delivered = run(scenario())
+
+    # Возвращённое захватывается сразу, не дожидаясь конца аренды; доставленное — больше никогда
+    assert [p.id for p in again] == [released_id]
+    assert deliveries == [(f'{delivered.id}:{delivered.remind_at}', 42)]
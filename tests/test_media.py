@@ -0,0 +1,42 @@
+import os
+from types import SimpleNamespace
+
+from media import MediaCache, cache_name
+
+
+class FileBot:
+    """Бот, у которого file_id — это содержимое файла; считает загрузки"""
+
+    def __init__(self):
+        self.downloads = []
+
+    async def get_file(self, file_id):
+        return SimpleNamespace(file_path=file_id, file_size=None)
+
+    async def download_file(self, file_path, destination, chunk_size):
+        self.downloads.append((file_path, chunk_size))
+        with open(destination, 'wb') as f:
+            f.write(file_path.encode())
+
+
+def test_cache_streams_once_and_evicts_least_recent(run, tmp_path):
+    bot = FileBot()
+    cache = MediaCache(str(tmp_path), max_bytes=20, chunk_size=4096)
+
+    async def scenario():
+        first = await cache.fetch(bot, 'a' * 10)
+        assert open(first).read() == 'a' * 10
+        assert await cache.fetch(bot, 'a' * 10) == first
+        await cache.fetch(bot, 'b' * 10)
+        await cache.fetch(bot, 'a' * 10)  # a свежее b
+        await cache.fetch(bot, 'c' * 10)
+        return first
+
+    first = run(scenario())
+
+    assert bot.downloads == [('a' * 10, 4096), ('b' * 10, 4096), ('c' * 10, 4096)]
+    assert os.path.exists(first)
+    assert sorted(os.listdir(cache.folder)) == sorted([os.path.basename(first), cache_name('c' * 10)])
+    stats = cache.stats()
+    assert (stats['entries'], stats['bytes'], stats['hits'], stats['misses'], stats['evictions']) == (2, 20, 2, 3, 1)
+
@@ -0,0 +1,48 @@
+import os
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+
+import photo_gc
+from fsm_storage import SQLiteStorage, storage_key
+
+
+def old_file(path, age=7 * 24 * 3600):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'jpg')
+    os.utime(path, (time.time() - age, time.time() - age))
+    return str(path)
+
+
+def test_photos_of_purchases_and_open_forms_survive(run, open_repo, tmp_path):
+    root = tmp_path / 'photos'
+    saved = old_file(root / 'aa' / 'aa' / 'saved.jpg')
+    in_memory = old_file(root / 'bb' / 'bb' / 'memory.jpg')
+    in_db = old_file(root / 'cc' / 'cc' / 'stored.jpg')
+    orphan = old_file(root / 'dd' / 'dd' / 'orphan.jpg')
+    orphan_thumb = old_file(root / 'dd' / 'dd' / 'orphan.thumb.jpg')
+
+    async def scenario():
+        repo = await open_repo()
+        storage = await SQLiteStorage(str(tmp_path / 'fsm.db')).open()
+        try:
+            await repo.add(7, 'Кроссовки', 5000, 'Лавка', None, None, saved, 0, 0)
+            # Форма, выгруженная из памяти (есть только в базе), и форма в памяти
+            stored_key = StorageKey(bot_id=1, chat_id=8, user_id=8)
+            await storage.set_record(stored_key, 'AddPurchase:waiting_link', {'photo_path': in_db})
+            await storage.flush()
+            del storage._records[storage_key(stored_key)]
+            await storage.set_record(StorageKey(bot_id=1, chat_id=9, user_id=9), 'AddPurchase:waiting_link',
+                                     {'photo_path': in_memory})
+
+            return await photo_gc.collect_once(repo, str(root), grace=3600, storage=storage)
+        finally:
+            await storage.close()
+            await repo.shards.close()
+
+    result = run(scenario())
+
+    assert result['removed'] == 2
+    assert all(os.path.exists(path) for path in (saved, in_memory, in_db))
+    assert not os.path.exists(orphan) and not os.path.exists(orphan_thumb)
@@ -0,0 +1,42 @@
+import asyncio
+import pytest
+from database import Database
+from migrations import migrate
+from repository import QUERY_PLAN_CHECKS, full_scans
+
+
+def _plans(path: str) -> list[tuple[str, list[str]]]:
+    """Планы всех запросов репозитория на свежей базе после миграций"""
+
+    async def run():
+        db = await Database(path, readers=1).open()
+        try:
+            await migrate(db)
+            plans = []
+            async with db.read() as conn:
+                for sql, params in QUERY_PLAN_CHECKS:
+                    cursor = await conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                    plans.append((sql, [row[3] for row in await cursor.fetchall()]))
+            return plans
+        finally:
+            await db.close()
+
+    return asyncio.run(run())
+
+
+@pytest.fixture(scope='module')
+def plans(tmp_path_factory):
+    return dict(_plans(str(tmp_path_factory.mktemp('plans') / 'test.db')))
+
+
+@pytest.mark.parametrize('sql', [sql for sql, _ in QUERY_PLAN_CHECKS],
+                         ids=[' '.join(sql.split())[:60] for sql, _ in QUERY_PLAN_CHECKS])
+def test_query_uses_index(plans, sql):
+    assert not full_scans(plans[sql]), '\n'.join(plans[sql])
+
+
+def test_full_scans_detects_table_scan():
+    assert full_scans(['SCAN purchases']) == ['SCAN purchases']
+    assert not full_scans(['SEARCH purchases USING INDEX idx_purchases_user (user_id=?)',
+                           'SCAN (subquery-1)', 'SCAN json_each VIRTUAL TABLE INDEX 1:',
+                           'SCAN purchases USING COVERING INDEX idx_purchases_remind'])
@@ -0,0 +1,25 @@
+import asyncio
+import time
+
+import pytest
+
+from ratelimit import RateLimiter
+
+
+def test_single_chat_429_pauses_only_that_chat():
+    limiter = RateLimiter(flood_chats=3)
+    limiter.pause(30, 1)
+
+    assert limiter._paused_until < time.monotonic()
+    assert limiter._chats[1].wait_time(1, time.monotonic()) > 29
+
+
+def test_429_in_several_chats_pauses_everyone(run):
+    limiter = RateLimiter(flood_chats=3, flood_window=5)
+    for chat_id in (1, 2, 3):
+        limiter.pause(30, chat_id)
+
+    assert limiter._paused_until > time.monotonic() + 29
+    # Чат, который сам 429 не получал, тоже ждёт общую паузу
+    with pytest.raises(TimeoutError):
+        run(asyncio.wait_for(limiter.acquire(4), 0.2))
@@ -0,0 +1,47 @@
+import time
+
+from handlers.reminders import digest_message, dispatch_reminders
+from models import Purchase
+from ratelimit import RateLimiter
+from scheduler import ReminderScheduler
+
+
+def test_digest_tolerates_missing_store():
+    items = [Purchase(1, 7, 'Кроссовки', 5000, None, None, None, None, 0, 0, 0, 0, None, 0),
+             Purchase(2, 7, None, 300, 'Лавка', None, None, None, 0, 0, 0, 0, None, 0)]
+
+    text, keyboard = digest_message(items)
+
+    assert 'Кроссовки' in text and 'Лавка' in text
+    assert len(keyboard.inline_keyboard) == 2
+
+
+class BrokenBot:
+    """Бот, у которого отправка падает не Telegram-ошибкой (обрыв сети)"""
+
+    async def send_message(self, *args, **kwargs):
+        raise OSError('connection reset')
+
+
+def test_network_error_is_retried_with_backoff(run, open_repo):
+    async def scenario():
+        repo = await open_repo()
+        try:
+            now = int(time.time())
+            await repo.add_user(7, now)
+            purchase_id = await repo.add(7, 'Кроссовки', 5000, 'Лавка', None, None, None, now - 10, now - 100)
+            claimed = await repo.claim_due(now, 'test', now + 60, 10)
+            scheduler = ReminderScheduler(repo)
+
+            await dispatch_reminders(BrokenBot(), repo, scheduler, RateLimiter(), claimed, now + 60)
+
+            attempts, remind_at, error, lease = await repo._db(7).fetchone(
+                'SELECT attempts, remind_at, last_error, lease_until FROM purchases WHERE id = ?', (purchase_id,))
+            assert attempts == 1
+            assert remind_at > now
+            assert 'OSError' in error
+            assert lease is None
+        finally:
+            await repo.shards.close()
+
+    run(scenario())
@@ -0,0 +1,54 @@
+from database import Database
+from handlers.cards import load_card
+
+
+def test_card_sees_out_of_process_write(run, open_repo):
+    async def scenario():
+        repo = await open_repo()
+        try:
+            purchase_id = await repo.add(1, 'Куртка', 1000, 'Shop', None, None, None, 0, 0)
+            assert (await load_card(repo, purchase_id, 1))[1] == 'Куртка'
+            # Запись мимо репозитория (manage.py, другой процесс): invalidate() не вызывается
+            other = await Database(repo.shards.for_user(1).path, readers=1).open()
+            await other.write(lambda conn: conn.execute("UPDATE purchases SET name = 'Пальто' WHERE id = ?",
+                                                        (purchase_id,)))
+            await other.close()
+            assert (await load_card(repo, purchase_id, 1))[1] == 'Пальто'
+        finally:
+            await repo.shards.close()
+
+    run(scenario())
+
+
+def test_cache_hit_until_version_changes(run, open_repo):
+    async def scenario():
+        repo = await open_repo()
+        try:
+            purchase_id = await repo.add(1, 'Куртка', 1000, 'Shop', None, None, None, 0, 0)
+            await load_card(repo, purchase_id, 1)
+            hits = repo.cache.hits
+            await load_card(repo, purchase_id, 1)
+            assert repo.cache.hits == hits + 1
+            # Аренда напоминания не меняет отрисовку — версия та же
+            version = await repo.data_version(1)
+            await repo.claim_due(10, 'worker', 100, 10)
+            assert await repo.data_version(1) == version
+        finally:
+            await repo.shards.close()
+
+    run(scenario())
+
+
+def test_read_racing_write_is_not_cached(run, open_repo):
+    async def scenario():
+        repo = await open_repo()
+        try:
+            purchase_id = await repo.add(1, 'Куртка', 1000, 'Shop', None, None, None, 0, 0)
+            version = await repo.data_version(1)
+            await repo.set_status(purchase_id, 1, 1)
+            repo.cache.set(1, ('card', purchase_id), ('stale',), version)
+            assert repo.cache.get(1, ('card', purchase_id), await repo.data_version(1)) is None
+        finally:
+            await repo.shards.close()
+
+    run(scenario())
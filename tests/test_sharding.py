@@ -0,0 +1,42 @@
+from sharding import move_user
+
+NOW = 1_000_000
+
+
+def test_move_user_carries_purchases_dead_letters_and_deliveries(run, open_repo):
+    async def scenario():
+        repo = await open_repo(shards=2)
+        try:
+            source = repo._db(7)
+            target = next(db for db in repo.shards if db is not source)
+            await repo.add_user(7, NOW)
+            delivered = await repo.add(7, 'Кроссовки', 5000, 'Лавка', None, None, None, NOW - 20, NOW - 100)
+            failed = await repo.add(7, 'Шарф', 300, 'Лавка', None, None, None, NOW - 10, NOW - 90)
+            for p in await repo.claim_due(NOW, 'a', NOW + 60, 10):
+                if p.id == delivered:
+                    await repo.complete_delivery(p, 'a', 42, NOW)
+                else:
+                    await repo.dead_letter(p, 'Bad Request', NOW)
+            # Остатки прерванного переноса в target заменяются копией
+            await target.write(lambda conn: conn.execute(
+                "INSERT INTO purchases (user_id, name, price, store, remind_at, created_at) "
+                "VALUES (7, 'Старая копия', 1, 'x', 0, 0)"))
+
+            moved = await move_user(source, target, 7)
+            left = [await source.fetchone(f'SELECT COUNT(*) FROM {table} WHERE user_id = 7')
+                    for table in ('purchases', 'users', 'reminder_dead_letters')]
+            rows = await target.fetchall('SELECT id, name, reminded FROM purchases WHERE user_id = 7 ORDER BY created_at')
+            dead = await target.fetchall('SELECT purchase_id FROM reminder_dead_letters WHERE user_id = 7')
+            deliveries = await target.fetchall('SELECT delivery_key, purchase_id, message_id FROM reminder_deliveries')
+            return moved, left, rows, dead, deliveries
+        finally:
+            await repo.shards.close()
+
+    moved, left, rows, dead, deliveries = run(scenario())
+
+    assert moved == 2
+    assert left == [(0,), (0,), (0,)]
+    assert [name for _, name, _ in rows] == ['Кроссовки', 'Шарф']
+    (new_delivered, _, _), (new_failed, _, _) = rows
+    assert dead == [(new_failed,)]
+    assert deliveries == [(f'{new_delivered}:{NOW - 20}', new_delivered, 42)]
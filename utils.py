@@ -6,3 +6,11 @@ def escape_md(text: str) -> str:
     for char in escape_chars:
         text = text.replace(char, f'\\{char}')
     return text
+
+
+def parse_page_cursor(parts: list[str]) -> tuple[int | None, int | None]:
+    """Хвост callback_data [..., 'n'|'p', id] -> (before, after) для keyset-пагинации"""
+    if len(parts) >= 2 and parts[-2] in ("n", "p") and parts[-1].isdigit():
+        cursor = int(parts[-1])
+        return (cursor, None) if parts[-2] == "n" else (None, cursor)
+    return None, None